@@ -0,0 +1,82 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import time
+
+from benchmarks import admission, mining, sync, validation
+
+SUITES = {
+    "mining": mining,
+    "validation": validation,
+    "admission": admission,
+    "sync": sync,
+}
+DEFAULT_OUTPUT = "benchmark.json"
+
+
+def result_key(entry: dict) -> str:
+    return json.dumps([entry["suite"], entry["name"], entry["params"]], sort_keys=True)
+
+
+def compare(results: list[dict], baseline: list[dict]) -> list[dict]:
+    # 同じ suite, name, params の数値の指標ごとに、基準の実行からの比を求める
+    baseline_by_key = {result_key(entry): entry for entry in baseline}
+    comparisons = []
+    for entry in results:
+        base = baseline_by_key.get(result_key(entry))
+        if base is None:
+            continue
+        ratios = {
+            metric: value / base["metrics"][metric]
+            for metric, value in entry["metrics"].items()
+            if isinstance(value, (int, float))
+            and not isinstance(value, bool)
+            and base["metrics"].get(metric)
+        }
+        comparisons.append({**entry, "metrics": ratios})
+    return comparisons
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    # 省略した場合は全て実行する
+    parser.add_argument("-s", "--suite", action="append", choices=list(SUITES))
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, type=str)
+    parser.add_argument("-q", "--quick", action="store_true")
+    parser.add_argument("-w", "--workers", default=1, type=int)
+    # 前回の出力を渡すと、指標ごとの比を出力に加える
+    parser.add_argument("-b", "--baseline", default=None, type=str)
+    args = parser.parse_args()
+
+    # 1件ごとの INFO ログが計測を乱さないよう、警告以上だけを出す
+    logging.disable(logging.INFO)
+    results = []
+    for name in args.suite or SUITES:
+        print(f"running {name}", flush=True)
+        results += SUITES[name].run(quick=args.quick, workers=args.workers)
+
+    report = {
+        "created_at": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(results, json.load(f)["results"])
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for entry in results:
+        print(entry["suite"], entry["name"], entry["params"], entry["metrics"])
+    print(f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import blockchain_server
+from models import Transaction
+from wallet import Wallet, generate_signatures
+
+from benchmarks.common import (
+    RECIPIENT_PREFIX,
+    build_chain,
+    latency_metrics,
+    load_chain,
+    result,
+)
+
+SUITE = "admission"
+REQUESTS = 1_000
+BULK_SIZE = 500
+QUICK_REQUESTS = 200
+QUICK_BULK_SIZE = 100
+ADMISSION_VALUE = 1e-4
+
+
+def signed_requests(wallet: Wallet, count: int, offset: int = 0) -> list[dict]:
+    transactions = [
+        Transaction(
+            sender_blockchain_address=wallet.blockchain_address,
+            recipient_blockchain_address=f"{RECIPIENT_PREFIX}{offset + index}",
+            value=ADMISSION_VALUE,
+        )
+        for index in range(count)
+    ]
+    signatures = generate_signatures(
+        [(wallet.private_key, transaction) for transaction in transactions]
+    )
+    return [
+        {
+            **transaction.model_dump(),
+            "sender_public_key": wallet.public_key,
+            "signature": signature,
+        }
+        for transaction, signature in zip(transactions, signatures)
+    ]
+
+
+def run(quick: bool = False, workers: int = 1) -> list[dict]:
+    # FastAPI のアプリをプロセス内のテストクライアントから呼び、
+    # 1件ずつの /post_transactions と /post_transactions/bulk を計測する
+    count = QUICK_REQUESTS if quick else REQUESTS
+    bulk_size = QUICK_BULK_SIZE if quick else BULK_SIZE
+    wallet = Wallet()
+    blockchain = load_chain(build_chain(3, 0, miner=wallet), verify_workers=workers)
+    blockchain_server.cache.blockchain = blockchain
+    single = signed_requests(wallet, count)
+    bulk = signed_requests(wallet, count, offset=count)
+    results = []
+    try:
+        with TestClient(blockchain_server.app) as client:
+            samples = []
+            accepted = 0
+            for body in single:
+                start = time.perf_counter()
+                response = client.post("/post_transactions", json=body)
+                samples.append(time.perf_counter() - start)
+                accepted += response.status_code == 201
+            seconds = sum(samples)
+            results.append(
+                result(
+                    SUITE,
+                    "post_transactions",
+                    {"requests": count, "workers": workers},
+                    {
+                        "accepted": accepted,
+                        "seconds": seconds,
+                        "requests_per_sec": count / seconds,
+                        **latency_metrics(samples),
+                    },
+                )
+            )
+
+            samples = []
+            accepted = 0
+            for start_index in range(0, count, bulk_size):
+                start = time.perf_counter()
+                response = client.post(
+                    "/post_transactions/bulk",
+                    json=bulk[start_index : start_index + bulk_size],
+                )
+                samples.append(time.perf_counter() - start)
+                accepted += response.json()["accepted"]
+            seconds = sum(samples)
+            results.append(
+                result(
+                    SUITE,
+                    "post_transactions_bulk",
+                    {"requests": count, "bulk_size": bulk_size, "workers": workers},
+                    {
+                        "accepted": accepted,
+                        "seconds": seconds,
+                        "transactions_per_sec": count / seconds,
+                        **latency_metrics(samples),
+                    },
+                )
+            )
+    finally:
+        blockchain_server.cache.blockchain = None
+        blockchain.signature_verifier.close()
+    return results
@@ -0,0 +1,137 @@
+import statistics
+import time
+from collections.abc import Callable
+
+from blockchain import MINING_REWORD, MINING_SENDER, BlockChain
+from difficulty import TARGET_BLOCK_SEC, DifficultyTracker
+from merkle import EMPTY_ROOT, header_hash
+from miner import MiningJob, SerialMiningEngine
+from models import Block, SignedTransaction, Transaction
+from wallet import Wallet, generate_signatures
+
+# ベンチマーク用のチェーンで報酬を受け取り、送金元になるウォレット
+# ブロック中の送金は署名を検証されるため、鍵を持つ実際のアドレスにする
+MINER_WALLET = Wallet()
+MINER_ADDRESS = MINER_WALLET.blockchain_address
+RECIPIENT_PREFIX = "benchmark-recipient-"
+TRANSFER_VALUE = 0.001
+
+
+def result(suite: str, name: str, params: dict, metrics: dict) -> dict:
+    # 実行間で比べるときは suite, name, params の組で対応付ける
+    return {"suite": suite, "name": name, "params": params, "metrics": metrics}
+
+
+def timed(func: Callable, *args, **kwargs) -> tuple[float, object]:
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+def repeat_timed(func: Callable, repeat: int) -> dict:
+    samples = [timed(func)[0] for _ in range(repeat)]
+    return {
+        "repeat": repeat,
+        "min_sec": min(samples),
+        "mean_sec": statistics.fmean(samples),
+        "max_sec": max(samples),
+    }
+
+
+def latency_metrics(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def percentile(p: float) -> float:
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+    return {
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def signed_transfers(miner: Wallet, count: int) -> list[SignedTransaction]:
+    # 署名の作成はブロックごとには行わず、同じ送金を各ブロックで使い回す
+    transfers = [
+        Transaction(
+            sender_blockchain_address=miner.blockchain_address,
+            recipient_blockchain_address=f"{RECIPIENT_PREFIX}{index}",
+            value=TRANSFER_VALUE,
+        )
+        for index in range(count)
+    ]
+    signatures = generate_signatures(
+        [(miner.private_key, transfer) for transfer in transfers]
+    )
+    return [
+        SignedTransaction(
+            **transfer.model_dump(),
+            sender_public_key=miner.public_key,
+            signature=signature,
+        )
+        for transfer, signature in zip(transfers, signatures)
+    ]
+
+
+def build_chain(
+    length: int, transfers_per_block: int, miner: Wallet = MINER_WALLET
+) -> list[Block]:
+    # 報酬を miner に、2番目以降のブロックでは miner から一定額の送金を含むチェーンを作る
+    # 連続で作ると難易度が上がり続けるため、タイムスタンプは目標の間隔で過去から並べる
+    engine = SerialMiningEngine()
+    transfers = signed_transfers(miner, transfers_per_block)
+    tracker = DifficultyTracker()
+    genesis = Block(
+        timestamp=time.time() - length * TARGET_BLOCK_SEC,
+        transactions=[],
+        nonce=0,
+        previous_hash="",
+        merkle_root=EMPTY_ROOT,
+        difficulty=tracker.next_difficulty(),
+    )
+    chain = [genesis]
+    tracker.push(genesis.timestamp, genesis.difficulty)
+    previous_hash = header_hash(genesis.header())
+    for height in range(1, length):
+        transactions = [
+            SignedTransaction(
+                sender_blockchain_address=MINING_SENDER,
+                recipient_blockchain_address=miner.blockchain_address,
+                value=MINING_REWORD,
+            )
+        ]
+        if height > 1:
+            transactions += transfers
+        job = MiningJob(
+            transactions,
+            previous_hash,
+            tracker.next_difficulty(),
+            timestamp=chain[-1].timestamp + TARGET_BLOCK_SEC,
+        )
+        block = Block(
+            timestamp=job.timestamp,
+            transactions=transactions,
+            nonce=engine.search(job),
+            previous_hash=previous_hash,
+            merkle_root=job.merkle_root,
+            difficulty=job.difficulty,
+        )
+        chain.append(block)
+        tracker.push(block.timestamp, block.difficulty)
+        previous_hash = header_hash(block.header())
+    return chain
+
+
+def load_chain(
+    chain: list[Block], blockchain_address: str = MINER_ADDRESS, **kwargs
+) -> BlockChain:
+    # 新しいノードに chain を丸ごと取り込ませる。ジェネシスブロックが異なるため先端ごと切り替わる
+    blockchain = BlockChain(
+        blockchain_address=blockchain_address, mining_workers=1, **kwargs
+    )
+    blockchain.add_blocks(list(chain))
+    return blockchain
@@ -0,0 +1,93 @@
+import hashlib
+
+from blockchain import BlockChain
+from miner import MiningJob, create_mining_engine
+from models import PendingTransaction, Transaction
+
+from benchmarks.common import (
+    MINER_ADDRESS,
+    RECIPIENT_PREFIX,
+    build_chain,
+    load_chain,
+    result,
+    timed,
+)
+
+SUITE = "mining"
+POOL_SIZES = (0, 100, 1_000)
+DIFFICULTIES = (12, 16)
+JOBS = 4
+QUICK_POOL_SIZES = (0, 100)
+QUICK_DIFFICULTIES = (12,)
+QUICK_JOBS = 2
+
+
+def _add_entries(blockchain: BlockChain, entries: list[PendingTransaction]) -> None:
+    for entry in entries:
+        blockchain.mempool.add(entry)
+
+
+def fill_pool(blockchain: BlockChain, size: int) -> None:
+    # 署名の検証は admission で計測するため、ここでは検証を通さずにプールへ入れる
+    blockchain.clear_transaction_pool()
+    entries = [
+        PendingTransaction(
+            transaction=Transaction(
+                sender_blockchain_address=MINER_ADDRESS,
+                recipient_blockchain_address=f"{RECIPIENT_PREFIX}{index}",
+                value=1e-6 * (index + 1),
+            )
+        )
+        for index in range(size)
+    ]
+    blockchain.writer.call(_add_entries, blockchain, entries)
+
+
+def run(quick: bool = False, workers: int = 1) -> list[dict]:
+    # ブロックの組み立て(new_mining_job)と nonce の探索(proof_of_work)を分けて計測する
+    # 難易度は固定し、ジョブごとに previous_hash を変えて別の探索にする
+    pool_sizes = QUICK_POOL_SIZES if quick else POOL_SIZES
+    difficulties = QUICK_DIFFICULTIES if quick else DIFFICULTIES
+    jobs = QUICK_JOBS if quick else JOBS
+
+    blockchain = load_chain(build_chain(3, 0))
+    blockchain.mining_engine = create_mining_engine(workers)
+    results = []
+    try:
+        for pool_size in pool_sizes:
+            fill_pool(blockchain, pool_size)
+            build_sec, template = timed(blockchain.new_mining_job)
+            for difficulty in difficulties:
+                hashes = 0
+                elapsed = 0.0
+                for index in range(jobs):
+                    job = MiningJob(
+                        template.transactions,
+                        hashlib.sha256(f"{difficulty}:{index}".encode()).hexdigest(),
+                        difficulty,
+                    )
+                    seconds, _ = timed(blockchain.proof_of_work, job)
+                    hashes += job.hashes
+                    elapsed += seconds
+                results.append(
+                    result(
+                        SUITE,
+                        "proof_of_work",
+                        {
+                            "pool_size": pool_size,
+                            "difficulty": difficulty,
+                            "workers": workers,
+                        },
+                        {
+                            "jobs": jobs,
+                            "block_transactions": len(template.transactions),
+                            "new_mining_job_ms": build_sec * 1000,
+                            "hashes": hashes,
+                            "seconds": elapsed,
+                            "hashes_per_sec": hashes / elapsed,
+                        },
+                    )
+                )
+    finally:
+        blockchain.mining_engine.close()
+    return results
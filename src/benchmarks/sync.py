@@ -0,0 +1,65 @@
+from blockchain import BlockChain
+
+from benchmarks.common import build_chain, load_chain, result, timed
+from benchmarks.local_peers import LocalPeerClient
+
+SUITE = "sync"
+CHAIN_LENGTHS = (100, 500)
+PEER_COUNTS = (1, 4, 8)
+TRANSFERS_PER_BLOCK = 20
+# 追いつく場合に、手元のチェーンが先端から遅れているブロック数
+CATCH_UP_BLOCKS = 10
+QUICK_CHAIN_LENGTHS = (50,)
+QUICK_PEER_COUNTS = (1, 4)
+
+
+def resolve(
+    peers: dict[str, BlockChain], blocks: list, workers: int
+) -> tuple[float, BlockChain]:
+    # blocks を持つノードを作り、近隣ノードから同期する時間を計る
+    if blocks:
+        blockchain = load_chain(blocks, validate_workers=workers)
+    else:
+        blockchain = BlockChain(mining_workers=1, validate_workers=workers)
+    blockchain.peer_client = LocalPeerClient(peers)
+    blockchain.neighbours = list(peers)
+    try:
+        seconds, _ = timed(blockchain.resolve_conflicts)
+    finally:
+        blockchain.chain_validator.close()
+    return seconds, blockchain
+
+
+def run(quick: bool = False, workers: int = 1) -> list[dict]:
+    # 全ノードが同じチェーンを持つ近隣ノード N 個から、空のノードが全体を同期する場合と
+    # 先端の少し手前まで持つノードが追いつく場合の resolve_conflicts を計測する
+    lengths = QUICK_CHAIN_LENGTHS if quick else CHAIN_LENGTHS
+    peer_counts = QUICK_PEER_COUNTS if quick else PEER_COUNTS
+    chain = build_chain(max(lengths), TRANSFERS_PER_BLOCK)
+    results = []
+    for length in lengths:
+        blocks = chain[:length]
+        peer = load_chain(blocks)
+        for peer_count in peer_counts:
+            # 同じ内容の近隣ノードは1つの BlockChain を共有する
+            peers = {f"peer-{index}": peer for index in range(peer_count)}
+            for name, start in (
+                ("initial", []),
+                ("catch_up", blocks[: length - CATCH_UP_BLOCKS]),
+            ):
+                seconds, blockchain = resolve(peers, start, workers)
+                results.append(
+                    result(
+                        SUITE,
+                        f"resolve_conflicts_{name}",
+                        {"length": length, "peers": peer_count, "workers": workers},
+                        {
+                            "seconds": seconds,
+                            "synced": blockchain.snapshot.tip_hash
+                            == peer.snapshot.tip_hash,
+                            "blocks": length - len(start),
+                            "blocks_per_sec": (length - len(start)) / seconds,
+                        },
+                    )
+                )
+    return results
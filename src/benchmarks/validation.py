@@ -0,0 +1,45 @@
+from blockchain import BlockChain
+
+from benchmarks.common import build_chain, repeat_timed, result
+
+SUITE = "validation"
+CHAIN_LENGTHS = (100, 250, 500)
+TRANSFERS_PER_BLOCK = 20
+REPEAT = 3
+QUICK_CHAIN_LENGTHS = (20, 50)
+QUICK_REPEAT = 1
+
+
+def run(quick: bool = False, workers: int = 1) -> list[dict]:
+    # 同じチェーンの先頭 length ブロックを、ジェネシスブロックから全て検証する時間
+    lengths = QUICK_CHAIN_LENGTHS if quick else CHAIN_LENGTHS
+    repeat = QUICK_REPEAT if quick else REPEAT
+    chain = build_chain(max(lengths), TRANSFERS_PER_BLOCK)
+    blockchain = BlockChain(mining_workers=1, validate_workers=workers)
+    results = []
+    try:
+        for length in lengths:
+            blocks = chain[:length]
+            transactions = sum(len(block.transactions) for block in blocks)
+            metrics = repeat_timed(lambda: blockchain.valid_blockchain(blocks), repeat)
+            results.append(
+                result(
+                    SUITE,
+                    "valid_blockchain",
+                    {
+                        "length": length,
+                        "transfers_per_block": TRANSFERS_PER_BLOCK,
+                        "workers": workers,
+                    },
+                    {
+                        **metrics,
+                        "valid": blockchain.valid_blockchain(blocks),
+                        "transactions": transactions,
+                        "blocks_per_sec": length / metrics["min_sec"],
+                        "transactions_per_sec": transactions / metrics["min_sec"],
+                    },
+                )
+            )
+    finally:
+        blockchain.chain_validator.close()
+    return results
@@ -1,68 +1,491 @@
 import contextlib
-import hashlib
+import functools
 import logging
+import math
+import os
 import sys
 import threading
 import time
+from collections.abc import Iterator
+from itertools import islice
 
-import requests
-from ecdsa import NIST256p, VerifyingKey
-
-from models import Block, Transaction
-from utils import find_neighbours, get_host
+from blocktree import BlockNode, BlockTree
+from difficulty import (
+    INITIAL_DIFFICULTY,
+    RETARGET_INTERVAL,
+    DifficultyTracker,
+    block_work,
+    meets_difficulty,
+)
+from history import HISTORY_PAGE_LIMIT, HISTORY_SAVE_INTERVAL, HistoryIndex
+from ledger import BalanceIndex, BalanceView
+from mempool import BLOCK_MAX_TRANSACTIONS, Mempool, content_key, transaction_id
+from merkle import EMPTY_ROOT, header_hash, merkle_proof, merkle_root
+from miner import MiningEngine, MiningJob, MiningMetrics, create_mining_engine
+from models import (
+    Block,
+    BlockHeader,
+    CompactBlock,
+    PendingTransaction,
+    SignedTransaction,
+    StateSnapshot,
+    Transaction,
+)
+from peers import PeerClient
+from relay import (
+    RELAY_ACCEPTED,
+    RELAY_KNOWN,
+    RELAY_QUEUED,
+    RELAY_REJECTED,
+    assemble_block,
+    compact_block,
+    reconstruct_transactions,
+)
+from storage import POOL_LOG_COMPACT_MIN, BlockStore, StoreView
+from utils import find_neighbours, get_host, parse_address
+from validator import (
+    INVALID_MERKLE_ROOT,
+    MINING_SENDER,
+    VALIDATE_WORKERS,
+    ChainValidator,
+    ValidationResult,
+    check_header_proof,
+    check_timestamp,
+)
+from verifier import VERIFY_WORKERS, SignatureVerifier
+from wallet import blockchain_address_from_public_key
+from writer import ChainWriter
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
-MINING_DIFFICLTY = 3
-MINING_SENDER = "THE BLOCKCHAIN"
 MINING_REWORD = 1.0
 MINING_TIMER_SEC = 20
+MINING_WORKERS = os.cpu_count()
 
 BLOCKCHAIN_PORT_RANGE = (5000, 5003)
 NEIGHBOURS_IP_RANGE_NUM = (0, 1)
 BLOCKCHAIN_NEIGHBOURS_SYNC_TIME_SEC = 20
 
+SYNC_HEADERS_WINDOW = 16
+SYNC_MAX_HEADERS = 2000
+SYNC_MAX_BLOCKS = 500
+# 先端がこの倍数の高さを越えるたびに、残高のスナップショットを作る
+STATE_SNAPSHOT_INTERVAL = 1000
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+class ChainSnapshot:
+    # 読み取り側に見せる、ある時点のチェーンの先端とプールの状態
+    # 公開した後は変更しないため、読み取り側はロックを取らずに参照できる
+    # チェーンは追記されても length より前は変わらず、巻き戻す場合は別のリストに置き換える
+    # ストアの場合は、その後の巻き戻しの影響を受けない StoreView を持つ
+    chain: list[Block] | BlockStore | StoreView
+    length: int
+    tip_hash: str
+    transactions: tuple[SignedTransaction, ...]
+    # 書き込みスレッドが更新し続ける索引。このスナップショットのブロックと照合した項目だけを返す
+    block_heights: dict[str, int]
+    history_index: HistoryIndex
+
+    def __init__(
+        self,
+        chain: list[Block] | BlockStore | StoreView,
+        length: int,
+        tip_hash: str,
+        transactions: tuple[SignedTransaction, ...],
+        block_heights: dict[str, int],
+        history_index: HistoryIndex,
+    ) -> None:
+        self.chain = chain
+        self.length = length
+        self.tip_hash = tip_hash
+        self.transactions = transactions
+        self.block_heights = block_heights
+        self.history_index = history_index
+
+    def block(self, height: int) -> Block:
+        if not 0 <= height < self.length:
+            raise IndexError("block height out of range")
+        return self.chain[height]
+
+    def block_hash(self, height: int) -> str:
+        if not isinstance(self.chain, list):
+            return self.chain.hash_at(height)
+        block = self.block(height)
+        if block._hash is None:
+            block._hash = header_hash(block.header())
+        return block._hash
+
+    def block_timestamp(self, height: int) -> float:
+        if not isinstance(self.chain, list):
+            return self.chain.timestamp_at(height)
+        return self.block(height).timestamp
+
+    def block_difficulty(self, height: int) -> int:
+        if not isinstance(self.chain, list):
+            return self.chain.difficulty_at(height)
+        return self.block(height).difficulty
+
+    def on_chain(self, height: int) -> bool:
+        # このスナップショットの height のブロックが、今もメインチェーンの同じ高さにあること
+        # 索引はこれを満たす高さの項目だけを使い、巻き戻した後の別のブロックの項目を混ぜない
+        return (
+            0 <= height < self.length
+            and self.block_heights.get(self.block_hash(height)) == height
+        )
+
+    def height_of(self, block_hash: str) -> int | None:
+        height = self.block_heights.get(block_hash)
+        if (
+            height is None
+            or height >= self.length
+            or self.block_hash(height) != block_hash
+        ):
+            return None
+        return height
+
+    def locate(self, tx_id: str) -> list[tuple[int, int]]:
+        refs = self.history_index.locate(tx_id)
+        return [ref for ref in refs if self.on_chain(ref[0])]
+
+    def address_refs(
+        self, blockchain_address: str, offset: int, limit: int
+    ) -> tuple[int, list[tuple[int, int]]]:
+        total, refs = self.history_index.address_refs(blockchain_address, offset, limit)
+        return total, [ref for ref in refs if self.on_chain(ref[0])]
+
 
 class BlockChain:
-    transaction_pool: list
-    chain: list[Block]
+    # 状態の変更はすべて writer の1スレッドで行い、読み取りは snapshot から行う
+    mempool: Mempool
+    chain: list[Block] | BlockStore
     blockchain_address: str
     port: str
     mining_semaphore: threading.Semaphore
     neighbours: list
+    seeds: list[str]
     sync_neighbours_semaphore: threading.Semaphore
+    mining_engine: MiningEngine
+    mining_job: MiningJob | None
+    mining_metrics: MiningMetrics
+    balance_index: BalanceIndex
+    store: BlockStore | None
+    block_heights: dict[str, int]
+    block_tree: BlockTree
+    # ストアに保存した履歴の索引の高さ。巻き戻しでこれより前が外れたら分岐点まで下げる
+    history_saved_height: int
+    signature_verifier: SignatureVerifier
+    chain_validator: ChainValidator
+    peer_client: PeerClient
+    writer: ChainWriter
+    snapshot: ChainSnapshot
+    # 近隣ノードに配る、最後に作った残高のスナップショット
+    state_snapshot: StateSnapshot | None
+    # 起動に使った、まだ検証が終わっていないチェックポイント
+    # これ以前のブロックはトランザクションを持たないヘッダーだけのブロックになっている
+    checkpoint: StateSnapshot | None
+    checkpoint_thread: threading.Thread | None
+    # 通知を受けて送信元から同期する先端。ノードごとに最も高いものだけを残す
+    relay_sync_tips: dict[str, dict]
+    relay_sync_thread: threading.Thread | None
 
-    def __init__(self, blockchain_address: str = None, port: str = None) -> None:
-        self.transaction_pool = []
+    def __init__(
+        self,
+        blockchain_address: str = None,
+        port: str = None,
+        mining_workers: int = MINING_WORKERS,
+        mining_engine: MiningEngine = None,
+        store: BlockStore = None,
+        verify_workers: int = VERIFY_WORKERS,
+        validate_workers: int = VALIDATE_WORKERS,
+        seeds: list[str] = None,
+    ) -> None:
+        self.mempool = Mempool()
         self.chain = []
-        empty_block = Block(
-            timestamp=0.0,
-            transactions=[],
-            nonce=0,
-            previous_hash="",
-        )
+        self.balance_index = BalanceIndex()
+        self.history_index = HistoryIndex()
+        self.history_saved_height = 0
+        self.store = store
+        self.block_heights = {}
+        self.block_tree = BlockTree()
         self.neighbours = []
-        self.create_block(0, self.hash(empty_block))
+        self.seeds = seeds or []
+        self.state_snapshot = None
+        self.checkpoint = None
+        self.checkpoint_thread = None
+        self.relay_sync_tips = {}
+        self.relay_sync_thread = None
+        self.relay_sync_lock = threading.Lock()
+        if store is not None and len(store):
+            self.load_store()
+        else:
+            if store is not None:
+                self.chain = store
+            empty_block = Block(
+                timestamp=0.0,
+                transactions=[],
+                nonce=0,
+                previous_hash="",
+                merkle_root=EMPTY_ROOT,
+                difficulty=INITIAL_DIFFICULTY,
+            )
+            self._create_block(
+                0, self.hash(empty_block), [], INITIAL_DIFFICULTY, time.time()
+            )
         self.blockchain_address = blockchain_address
         self.port = port
         self.mining_semaphore = threading.Semaphore(1)
         self.sync_neighbours_semaphore = threading.Semaphore(1)
+        self.mining_engine = mining_engine or create_mining_engine(mining_workers)
+        self.mining_job = None
+        self.mining_metrics = MiningMetrics()
+        self.signature_verifier = SignatureVerifier(workers=verify_workers)
+        self.chain_validator = ChainValidator(
+            workers=validate_workers, signature_verifier=self.signature_verifier
+        )
+        self.peer_client = PeerClient()
+        self.writer = ChainWriter(self.publish_snapshot)
+        self.publish_snapshot()
+
+    def publish_snapshot(self) -> None:
+        # 書き込みをまとめて実行した後に1回だけ呼ばれるので、プールの保存もここで行う
+        self.save_transaction_pool()
+        height = len(self.chain) - 1
+        self.snapshot = ChainSnapshot(
+            chain=self.store.view() if self.store is not None else self.chain,
+            length=height + 1,
+            tip_hash=self.block_hash(height),
+            transactions=tuple(self.mempool.transactions()),
+            block_heights=self.block_heights,
+            history_index=self.history_index,
+        )
+
+    def load_store(self) -> None:
+        # ブロック本体は参照時に読み込むため、ここではストアを順に走査して残高だけ作る
+        self.chain = self.store
+        self.checkpoint = self.store.load_checkpoint()
+        self.state_snapshot = self.store.load_state_snapshot()
+        self.block_heights = {}
+        for height in range(len(self.store)):
+            block_hash = self.store.hash_at(height)
+            previous_hash = (
+                self.store.hash_at(height - 1)
+                if height > 0
+                else self.store[0].previous_hash
+            )
+            self.block_heights[block_hash] = height
+            self.block_tree.add(
+                block_hash, previous_hash, block_work(self.store.difficulty_at(height))
+            )
+        self.rebuild_balances()
+        self.load_history()
+        entries = self.store.load_pool()
+        for entry in entries:
+            # 以前のバージョンで受け付けていたマイニング報酬は、採掘されないため読み込まない
+            if entry.transaction.sender_blockchain_address != MINING_SENDER:
+                self.mempool.add(entry)
+        # 読み込んだエントリーはログにあるので、読み込まなかったものがあるときだけ書き直す
+        self.mempool.drain_changes()
+        if len(self.mempool) < len(entries):
+            self.store.save_pool(self.mempool.entries_by_id())
+        logger.info(
+            {
+                "action": "load_store",
+                "height": len(self.chain),
+                "transactions": len(self.mempool),
+                "checkpoint": self.checkpoint.height if self.checkpoint else None,
+            }
+        )
+
+    def rebuild_balances(self, balances: StateSnapshot = None) -> None:
+        # チェックポイントから起動した場合は、その残高に後ろのブロックだけを適用する
+        balances = balances or self.checkpoint
+        if balances is None:
+            self.balance_index.rebuild(self.chain)
+            return
+        self.balance_index.rebuild(
+            self.blocks_after(balances.height), balances.balances
+        )
+
+    def blocks_after(self, height: int) -> Iterator[Block]:
+        # 書き込みスレッドから、height より後ろのブロックを順に読む
+        if self.store is not None:
+            return self.store.iter_range(height + 1)
+        return islice(self.chain, height + 1, None)
+
+    def load_history(self) -> None:
+        # 保存した索引がストアの同じ高さのブロックと一致すれば、その後ろだけを追加する
+        snapshot = self.store.load_history()
+        height = 0
+        if (
+            snapshot is not None
+            and 0 < snapshot["height"] <= len(self.store)
+            and snapshot["tip_hash"] == self.store.hash_at(snapshot["height"] - 1)
+        ):
+            self.history_index.restore(snapshot)
+            height = snapshot["height"]
+        else:
+            self.history_index.rebuild([])
+        self.history_saved_height = height
+        for offset, block in enumerate(self.store.iter_range(height)):
+            self.history_index.apply_block(height + offset, block)
+        self.save_history_periodically()
+
+    def save_history(self) -> None:
+        if self.store is not None:
+            height = self.history_index.height
+            self.store.save_history(
+                self.history_index.snapshot(self.block_hash(height - 1))
+            )
+            self.history_saved_height = height
+
+    def save_history_periodically(self) -> None:
+        # 索引全体を書き出すため、保存した高さから HISTORY_SAVE_INTERVAL 進むまでは書かない
+        # それまでのブロックは起動時に保存した高さから当て直す
+        height = self.history_index.height
+        if height - self.history_saved_height >= HISTORY_SAVE_INTERVAL:
+            self.save_history()
+
+    @property
+    def transaction_pool(self) -> list[SignedTransaction]:
+        return list(self.snapshot.transactions)
+
+    def save_transaction_pool(self) -> None:
+        # 前回の保存から変わったエントリーだけをプールのログに追記する
+        # 削除した分が溜まってログが大きくなったら、残っているエントリーだけで書き直す
+        cleared, changes = self.mempool.drain_changes()
+        if self.store is None or not (cleared or changes):
+            return
+        records = self.store.pool_records + len(changes)
+        if cleared or records > 2 * len(self.mempool) + POOL_LOG_COMPACT_MIN:
+            self.store.save_pool(self.mempool.entries_by_id())
+        else:
+            self.store.append_pool(changes)
+
+    def block_hash(self, height: int) -> str:
+        if self.store is not None:
+            return self.store.hash_at(height)
+        return self.hash(self.chain[height])
+
+    def tip_node(self) -> BlockNode:
+        return self.block_tree.get(self.block_hash(len(self.chain) - 1))
+
+    def add_blocks(self, blocks: list[Block]) -> bool:
+        return self.writer.call(self._add_blocks, blocks)
+
+    def _add_blocks(self, blocks: list[Block]) -> bool:
+        # 検証済みのブロックを木に加え、累積ワークが最大の先端に切り替える
+        for block in blocks:
+            self.block_tree.add(
+                self.hash(block),
+                block.previous_hash,
+                block_work(block.difficulty),
+                block=block,
+            )
+        return self.choose_best_tip()
+
+    def choose_best_tip(self) -> bool:
+        tip = self.tip_node()
+        best_tip = self.block_tree.best_tip
+        if best_tip is tip or best_tip.work <= tip.work:
+            return False
+        self.reorganize(best_tip)
+        return True
+
+    def reorganize(self, new_tip: BlockNode) -> None:
+        # 分岐点より後ろのブロックだけを外して付け替える
+        detach, attach = self.block_tree.fork_path(self.tip_node(), new_tip)
+        tip_height = len(self.chain) - 1
+        fork_height = tip_height - len(detach)
+
+        # 外れるブロックの本体は木に移し、残高を元に戻す
+        detached_blocks = []
+        for node in detach:
+            block = self.chain[node.height]
+            node.block = block
+            detached_blocks.append(block)
+            self.history_index.revert_block(node.height, block)
+            self.block_heights.pop(node.hash, None)
+            self.balance_index.revert_block(block)
+
+        # 保存した索引が外れたブロックを含んでいれば、起動時には作り直すことになる
+        self.history_saved_height = min(self.history_saved_height, fork_height + 1)
+        if self.store is not None:
+            self.store.truncate(fork_height + 1)
+        elif detach:
+            # 公開済みのスナップショットが参照するリストは変更せず、新しいリストに置き換える
+            # 外すブロックがなければ、スナップショットは length までしか読まないため追記してよい
+            self.chain = self.chain[: fork_height + 1]
+
+        attached_blocks = []
+        for node in attach:
+            block = node.block
+            node.block = None
+            self.chain.append(block)
+            self.block_heights[node.hash] = node.height
+            self.history_index.apply_block(node.height, block)
+            self.balance_index.apply_block(block)
+            attached_blocks.append(block)
+
+        self.save_history_periodically()
+        self.update_state_snapshot(tip_height)
+        self.restore_orphaned_transactions(detached_blocks, attached_blocks)
+        logger.info(
+            {
+                "action": "reorganize",
+                "fork_height": fork_height,
+                "detached": len(detached_blocks),
+                "attached": len(attached_blocks),
+            }
+        )
+
+    def restore_orphaned_transactions(
+        self, detached_blocks: list[Block], attached_blocks: list[Block]
+    ) -> None:
+        # メインチェーンから外れたブロックのトランザクションをプールに戻す
+        # マイニング報酬は新しいチェーンでは無効なので戻さない
+        for block in attached_blocks:
+            self.mempool.remove_transactions(block.transactions)
+        included = {
+            content_key(t) for block in attached_blocks for t in block.transactions
+        }
+        for block in reversed(detached_blocks):
+            for transaction in block.transactions:
+                if (
+                    transaction.sender_blockchain_address != MINING_SENDER
+                    and content_key(transaction) not in included
+                ):
+                    # 公開鍵と署名も戻し、別のブロックに含めても検証を通るようにする
+                    self.mempool.add(
+                        PendingTransaction(
+                            transaction=transaction.unsigned(),
+                            sender_public_key=transaction.sender_public_key,
+                            signature=transaction.signature,
+                        )
+                    )
 
     def run(self):
         self.sync_neighbours()
+        self.start_checkpoint_verification(self.neighbours)
         self.resolve_conflicts()
         self.start_mining()
 
     def set_neighbours(self):
-        self.neighbours = find_neighbours(
+        neighbours = find_neighbours(
             my_host=get_host(),
             my_port=self.port,
             start_ip_range=NEIGHBOURS_IP_RANGE_NUM[0],
             end_ip_range=NEIGHBOURS_IP_RANGE_NUM[1],
             start_port=BLOCKCHAIN_PORT_RANGE[0],
             end_port=BLOCKCHAIN_PORT_RANGE[1],
+            seeds=self.seeds,
         )
+        # 自分のアドレスが判定できずシードもなければ None が返る
+        self.neighbours = neighbours or []
         logger.info({"action": "set_neighours", "neighbours": self.neighbours})
 
     def sync_neighbours(self):
@@ -76,23 +499,91 @@ class BlockChain:
                 )
                 loop.start()
 
-    def create_block(self, nonce: int, previous_hash: str) -> Block:
+    def create_block(
+        self,
+        nonce: int,
+        previous_hash: str,
+        transactions: list[SignedTransaction] = None,
+        difficulty: int = None,
+        timestamp: float = None,
+    ) -> Block:
+        if difficulty is None:
+            difficulty = self.next_difficulty()
+        if timestamp is None:
+            timestamp = time.time()
+        return self.writer.call(
+            self._create_block,
+            nonce,
+            previous_hash,
+            transactions,
+            difficulty,
+            timestamp,
+        )
+
+    def _create_block(
+        self,
+        nonce: int,
+        previous_hash: str,
+        transactions: list[SignedTransaction] | None,
+        difficulty: int,
+        timestamp: float,
+    ) -> Block:
+        # タイムスタンプは PoW の対象なので、探索した MiningJob のものをそのまま使う
+        if transactions is None:
+            transactions = self.mempool.transactions()
         block = Block(
-            timestamp=time.time(),
-            transactions=self.transaction_pool,
+            timestamp=timestamp,
+            transactions=transactions,
             nonce=nonce,
             previous_hash=previous_hash,
+            merkle_root=merkle_root(transactions),
+            difficulty=difficulty,
         )
         self.chain.append(block)
-        self.transaction_pool = []
-
-        for node in self.neighbours:
-            requests.delete(f"http://{node}/delete_transaction")
+        self.block_heights[self.hash(block)] = len(self.chain) - 1
+        self.block_tree.add(self.hash(block), previous_hash, block_work(difficulty))
+        self.balance_index.apply_block(block)
+        self.history_index.apply_block(len(self.chain) - 1, block)
+        self.save_history_periodically()
+        self.update_state_snapshot(len(self.chain) - 2)
+        # ブロックに含めたトランザクションだけをプールから取り除く
+        self.mempool.remove_transactions(block.transactions)
         return block
 
+    def update_state_snapshot(self, previous_height: int) -> None:
+        # 先端の高さが STATE_SNAPSHOT_INTERVAL の区切りをまたいだら、先端までの残高を保存する
+        # ジェネシスブロックだけのチェーンでは作らない
+        height = len(self.chain) - 1
+        if (
+            height // STATE_SNAPSHOT_INTERVAL
+            == max(previous_height, 0) // STATE_SNAPSHOT_INTERVAL
+        ):
+            return
+        self.state_snapshot = StateSnapshot(
+            height=height,
+            block_hash=self.block_hash(height),
+            balances=self.balance_index.snapshot(),
+        )
+        if self.store is not None:
+            self.store.save_state_snapshot(self.state_snapshot)
+        logger.info({"action": "state_snapshot", "height": height})
+
+    def get_state_snapshot(self) -> StateSnapshot | None:
+        # 巻き戻しでメインチェーンから外れたブロックのスナップショットは配らない
+        state = self.state_snapshot
+        if state is None or self.block_heights.get(state.block_hash) != state.height:
+            return None
+        return state
+
+    def history_available(self, height: int) -> bool:
+        # チェックポイント以前のブロックは、検証が終わるまでヘッダーしか持たない
+        checkpoint = self.checkpoint
+        return checkpoint is None or height > checkpoint.height
+
     def hash(self, block: Block) -> str:
-        sorted_block = block.model_dump_json()
-        return hashlib.sha256(sorted_block.encode()).hexdigest()
+        if block._hash is None:
+            block._hash = header_hash(block.header())
+        return block._hash
 
     def add_transaction(
         self,
@@ -100,26 +591,88 @@ class BlockChain:
         sender_public_key: str = None,
         signature: str = None,
     ) -> bool:
-        if transaction.sender_blockchain_address == MINING_SENDER:
-            self.transaction_pool.append(transaction)
-            return True
-
-        if self.verify_transaction_signature(
+        entry = PendingTransaction(
+            transaction=transaction,
             sender_public_key=sender_public_key,
             signature=signature,
-            transaction=transaction,
-        ):
+        )
+        return self.add_transactions([entry])[0]
+
+    def add_transactions(self, entries: list[PendingTransaction]) -> list[bool]:
+        # 署名はまとめて検証し、残高の確認とプールへの追加は届いた順に1回の書き込みで行う
+        results = [False] * len(entries)
+        seen = set()
+        candidates = []
+        for index, entry in enumerate(entries):
+            if entry.transaction.sender_blockchain_address == MINING_SENDER:
+                # マイニング報酬はマイニングするノードが new_mining_job で作る
+                logger.info({"action": "add_transaction", "status": "mining_sender"})
+                continue
+            tx_id = transaction_id(entry.transaction, entry.signature)
+            if tx_id in self.mempool or tx_id in seen:
+                logger.info({"action": "add_transaction", "status": "duplicate"})
+                continue
+            seen.add(tx_id)
+            candidates.append(index)
+
+        # 署名の検証は書き込みスレッドの外で行う
+        # 公開鍵から求めたアドレスが送信者と一致しなければ、他人のアドレスからの送金になる
+        mismatched = {
+            index
+            for index in candidates
+            if not self.owns_sender_address(entries[index])
+        }
+        signed = [index for index in candidates if index not in mismatched]
+        verified = self.verify_transaction_signatures(
+            [
+                (
+                    entries[index].sender_public_key,
+                    entries[index].signature,
+                    entries[index].transaction,
+                )
+                for index in signed
+            ]
+        )
+        rejected = mismatched | {index for index, ok in zip(signed, verified) if not ok}
+        accepted = [index for index in candidates if index not in rejected]
+        if not accepted:
+            return results
+
+        added = self.writer.call(
+            self._add_verified_transactions, [entries[index] for index in accepted]
+        )
+        for index, is_added in zip(accepted, added):
+            results[index] = is_added
+        return results
+
+    def owns_sender_address(self, entry: PendingTransaction) -> bool:
+        try:
+            address = blockchain_address_from_public_key(entry.sender_public_key)
+        except (TypeError, ValueError):
+            return False
+        if address == entry.transaction.sender_blockchain_address:
+            return True
+        logger.info({"action": "add_transaction", "status": "address_mismatch"})
+        return False
+
+    def _add_verified_transactions(
+        self, entries: list[PendingTransaction]
+    ) -> list[bool]:
+        results = []
+        for entry in entries:
+            transaction = entry.transaction
             # # 送信者が保有している以上の仮想通貨を送信しようとしている場合
+            # # プール内の未確定の送金も差し引いて二重支払いを防ぐ
             if (
-                self.calculate_total_amount(transaction.sender_blockchain_address)
+                transaction.value < 0
+                or self.available_amount(transaction.sender_blockchain_address)
                 < transaction.value
             ):
                 logger.error({"action": "add_transaction", "error": "no_value"})
-                return False
-
-            self.transaction_pool.append(transaction)
-            return True
-        return False
+                results.append(False)
+                continue
+            results.append(self.mempool.add(entry) is not None)
+        return results
 
     def create_transaction(
         self,
@@ -132,76 +685,192 @@ class BlockChain:
         )
 
         if is_transactions:
-            for node in self.neighbours:
-                requests.post(
-                    f"http://{node}/update_transactions",
-                    json={
-                        "sender_blockchain_address": transaction.sender_blockchain_address,
-                        "recipient_blockchain_address": transaction.recipient_blockchain_address,
-                        "value": transaction.value,
-                        "sender_public_key": sender_public_key,
-                        "signature": signature,
-                    },
-                )
+            self.peer_client.broadcast(
+                self.neighbours,
+                "POST",
+                "/update_transactions",
+                json={
+                    "sender_blockchain_address": transaction.sender_blockchain_address,
+                    "recipient_blockchain_address": transaction.recipient_blockchain_address,
+                    "value": transaction.value,
+                    "sender_public_key": sender_public_key,
+                    "signature": signature,
+                },
+            )
         return is_transactions
 
+    def create_transactions(self, entries: list[PendingTransaction]) -> list[bool]:
+        # 追加できたものだけを1つのメッセージにまとめて近隣ノードへ送る
+        results = self.add_transactions(entries)
+        accepted = [
+            {
+                **entry.transaction.model_dump(),
+                "sender_public_key": entry.sender_public_key,
+                "signature": entry.signature,
+            }
+            for entry, is_added in zip(entries, results)
+            if is_added
+        ]
+        if accepted:
+            self.peer_client.broadcast(
+                self.neighbours, "POST", "/update_transactions/bulk", json=accepted
+            )
+        return results
+
     def verify_transaction_signature(
         self, sender_public_key: str, signature: str, transaction: Transaction
     ) -> bool:
-        sha256 = hashlib.sha256()
-        sha256.update(str(transaction).encode("utf-8"))
-        message = sha256.digest()
-        signature_bytes = bytes().fromhex(signature)
-        verifying_key = VerifyingKey.from_string(
-            bytes().fromhex(sender_public_key), curve=NIST256p
-        )
-        verified_key = verifying_key.verify(signature_bytes, message)
-        return verified_key
+        return self.signature_verifier.verify(sender_public_key, signature, transaction)
+
+    def verify_transaction_signatures(
+        self, items: list[tuple[str, str, Transaction]]
+    ) -> list[bool]:
+        # (公開鍵, 署名, トランザクション) をまとめてプロセスプールで検証する
+        return self.signature_verifier.verify_batch(items)
 
     def valid_proof(
         self,
-        transactions: list[Transaction],
+        merkle_root: str,
         previous_hash: str,
-        nonce: float,
-        difficulty: int = MINING_DIFFICLTY,
+        nonce: int,
+        difficulty: int,
+        timestamp: float,
     ) -> bool:
-        guess_block = Block(
-            timestamp=0.0,
-            transactions=transactions,
+        guess_header = BlockHeader(
+            timestamp=timestamp,
+            merkle_root=merkle_root,
             nonce=nonce,
             previous_hash=previous_hash,
+            difficulty=difficulty,
+        )
+        return meets_difficulty(header_hash(guess_header), difficulty)
+
+    def difficulty_tracker(
+        self, height: int, snapshot: ChainSnapshot = None
+    ) -> DifficultyTracker:
+        # height のブロックまでを受け取った状態を、見直しに必要な直近のブロックだけから作る
+        snapshot = snapshot or self.snapshot
+        start = max(height - RETARGET_INTERVAL, 0)
+        tracker = DifficultyTracker(start)
+        for block_height in range(start, height + 1):
+            tracker.push(
+                snapshot.block_timestamp(block_height),
+                snapshot.block_difficulty(block_height),
+            )
+        return tracker
+
+    def next_difficulty(self) -> int:
+        snapshot = self.snapshot
+        return self.difficulty_tracker(snapshot.length - 1, snapshot).next_difficulty()
+
+    def valid_block_state(self, balances: BalanceView, block: Block) -> bool:
+        # マイニング報酬は先頭の1件だけで、それ以外は送信者の残高を超えないこと
+        # balances には検証したブロックのトランザクションが順に適用される
+        for index, transaction in enumerate(block.transactions):
+            if transaction.sender_blockchain_address == MINING_SENDER:
+                if index > 0 or not 0 <= transaction.value <= MINING_REWORD:
+                    return False
+            elif not balances.can_spend(transaction):
+                return False
+            balances.apply_transaction(transaction)
+        return True
+
+    def balances_at(self, height: int) -> BalanceView:
+        return self.writer.call(self._balances_at, height)
+
+    def _balances_at(self, height: int) -> BalanceView:
+        # height のブロックまでを適用した残高。現在の残高を写し、先端から巻き戻す
+        balances = BalanceView(self.balance_index.copy().balance)
+        for block_height in range(len(self.chain) - 1, height, -1):
+            balances.revert_block(self.chain[block_height])
+        return balances
+
+    def validate_blocks(
+        self,
+        blocks: list[Block],
+        start_height: int,
+        previous_hash: str | None,
+        difficulty: DifficultyTracker,
+        balances: BalanceView,
+    ) -> ValidationResult:
+        return self.chain_validator.validate(
+            blocks,
+            start_height,
+            previous_hash,
+            difficulty,
+            check_state=functools.partial(self.valid_block_state, balances),
         )
-        guess_hash = self.hash(guess_block)
-        return guess_hash[:difficulty] == "0" * difficulty
 
-    def proof_of_work(self) -> int:
-        transactions = self.transaction_pool.copy()
-        previous_hash = self.hash(self.chain[-1])
-        nonce = 0
+    def new_mining_job(self) -> MiningJob:
+        # マイニング報酬を先頭に、プールから到着順に上限件数までを取り出したブロックを作る
+        reward = SignedTransaction(
+            sender_blockchain_address=MINING_SENDER,
+            recipient_blockchain_address=self.blockchain_address,
+            value=MINING_REWORD,
+        )
+        snapshot = self.snapshot
+        # 巻き戻しで残高が足りなくなったトランザクションは、ブロックが不正にならないよう除く
+        balances = BalanceView(self.balance_index.balance)
+        transactions = [reward]
+        for transaction in snapshot.transactions:
+            if len(transactions) >= BLOCK_MAX_TRANSACTIONS:
+                break
+            if transaction.sender_blockchain_address == MINING_SENDER:
+                continue
+            if balances.can_spend(transaction):
+                balances.apply_transaction(transaction)
+                transactions.append(transaction)
+        # 直近のブロックの中央値より後でなければ受け入れられないため、時計が遅れていれば進める
+        tracker = self.difficulty_tracker(snapshot.length - 1, snapshot)
+        timestamp = time.time()
+        median_time = tracker.median_time()
+        if median_time is not None:
+            timestamp = max(timestamp, math.nextafter(median_time, math.inf))
+        return MiningJob(
+            transactions=transactions,
+            previous_hash=snapshot.tip_hash,
+            difficulty=tracker.next_difficulty(),
+            timestamp=timestamp,
+        )
+
+    def proof_of_work(self, job: MiningJob = None) -> int | None:
+        if job is None:
+            job = self.new_mining_job()
+        self.mining_job = job
+        try:
+            return self.mining_engine.search(job)
+        finally:
+            self.mining_job = None
 
-        while self.valid_proof(transactions, previous_hash, nonce) is False:
-            nonce += 1
-        return nonce
+    def abort_mining(self) -> None:
+        job = self.mining_job
+        if job is not None:
+            job.cancel()
 
     def mining(self) -> bool:
         # if not self.transaction_pool:
         #     return False
 
-        self.add_transaction(
-            transaction=Transaction(
-                sender_blockchain_address=MINING_SENDER,
-                recipient_blockchain_address=self.blockchain_address,
-                value=MINING_REWORD,
-            )
-        )
-        nonce = self.proof_of_work()
-        previous_hash = self.hash(self.chain[-1])
-        self.create_block(nonce, previous_hash)
+        while True:
+            job = self.new_mining_job()
+            nonce = self.proof_of_work(job)
+            block = None
+            if nonce is not None:
+                block = self.writer.call(self._append_mined_block, job, nonce)
+            if block is not None:
+                break
+            # 探索中にチェーンが置き換わったので新しい先端とプールでやり直す
+            self.mining_metrics.record(job, mined=False)
+            logger.info({"action": "mining", "status": "restart"})
+
+        self.mining_metrics.record(job, mined=True)
 
         logger.info({"action": "mining", "status": "success"})
 
-        for node in self.neighbours:
-            requests.post(f"http://{node}/consensus")
+        # 近隣ノードに全チェーンを問い合わせさせず、新しいブロックだけを送る
+        height = self.block_heights.get(self.hash(block))
+        if height is not None:
+            self.announce_block(block, height)
         return True
 
     def start_mining(self) -> None:
@@ -213,60 +882,701 @@ class BlockChain:
                 loop = threading.Timer(MINING_TIMER_SEC, self.start_mining)
                 loop.start()
 
+    def _append_mined_block(self, job: MiningJob, nonce: int) -> Block | None:
+        # 先端の確認と追加を書き込みスレッドでまとめて行う
+        if job.previous_hash != self.block_hash(len(self.chain) - 1):
+            return None
+        return self._create_block(
+            nonce, job.previous_hash, job.transactions, job.difficulty, job.timestamp
+        )
+
+    def node_address(self) -> str:
+        return f"{get_host()}:{self.port}"
+
+    def announce_block(self, block: Block, height: int, exclude: str = None) -> None:
+        # 近隣ノードにはヘッダーとトランザクションの短いIDだけを送る
+        # プールにないはずのマイニング報酬は本体ごと送る
+        compact = compact_block(
+            block,
+            height,
+            self.node_address(),
+            prefilled=[
+                index
+                for index, transaction in enumerate(block.transactions)
+                if transaction.sender_blockchain_address == MINING_SENDER
+            ],
+        )
+        nodes = [node for node in self.neighbours if node != exclude]
+        self.peer_client.broadcast(
+            nodes, "POST", "/blocks/compact", json=compact.model_dump()
+        )
+
+    def receive_compact_block(
+        self, compact: CompactBlock, client_host: str = None
+    ) -> str:
+        # 通知されたブロックをプールのトランザクションで組み立て、足りない分だけ送信元に問い合わせる
+        # 先端につながらない場合や組み立てられない場合は、送信元からブロックごと同期する
+        # 問い合わせ先は通知の本文にあるため、近隣ノードか通知を送ってきたホストでなければ受け付けない
+        if not self.trusted_relay_node(compact.node, client_host):
+            logger.error(
+                {
+                    "action": "receive_compact_block",
+                    "node": compact.node,
+                    "error": "untrusted_node",
+                }
+            )
+            return RELAY_REJECTED
+        block_hash = header_hash(compact.header)
+        if block_hash in self.block_tree:
+            return RELAY_KNOWN
+        if compact.height <= 0 or check_header_proof(compact.header) is not None:
+            return RELAY_REJECTED
+
+        snapshot = self.snapshot
+        if not self.valid_announced_header(compact.header, snapshot):
+            return RELAY_REJECTED
+        if compact.header.previous_hash != snapshot.tip_hash:
+            return self.sync_announced_block(compact)
+        try:
+            transactions, missing = reconstruct_transactions(
+                compact, snapshot.transactions
+            )
+        except ValueError:
+            return RELAY_REJECTED
+        if missing:
+            fetched = self.fetch_block_transactions(compact.node, block_hash, missing)
+            if fetched is None:
+                return self.sync_announced_block(compact)
+            for index, transaction in zip(missing, fetched):
+                transactions[index] = transaction
+
+        block = assemble_block(compact.header, transactions)
+        result = self.writer.call(self._add_announced_block, block)
+        if result is None:
+            # 組み立てている間に先端が進んだ
+            return self.sync_announced_block(compact)
+        if not result.valid:
+            if result.reason == INVALID_MERKLE_ROOT:
+                # 短いIDが別のトランザクションと衝突した可能性がある
+                return self.sync_announced_block(compact)
+            return RELAY_REJECTED
+
+        self.abort_mining()
+        logger.info(
+            {
+                "action": "receive_compact_block",
+                "height": compact.height,
+                "transactions": len(transactions),
+                "missing": len(missing),
+            }
+        )
+        self.announce_block(block, compact.height, exclude=compact.node)
+        return RELAY_ACCEPTED
+
+    def trusted_relay_node(self, node: str, client_host: str | None) -> bool:
+        if node in self.neighbours:
+            return True
+        try:
+            host, _ = parse_address(node)
+        except ValueError:
+            return False
+        return client_host is not None and host == client_host
+
+    def valid_announced_header(
+        self, header: BlockHeader, snapshot: ChainSnapshot
+    ) -> bool:
+        # 親がメインチェーンにあれば、難易度とタイムスタンプが規則どおりかをヘッダーだけで確かめる
+        # 親を知らないブロックは、同期したブロックと合わせて検証する
+        parent_height = snapshot.height_of(header.previous_hash)
+        if parent_height is None:
+            return True
+        tracker = self.difficulty_tracker(parent_height, snapshot)
+        return (
+            header.difficulty == tracker.next_difficulty()
+            and check_timestamp(header.timestamp, tracker, time.time()) is None
+        )
+
+    def sync_announced_block(self, compact: CompactBlock) -> str:
+        # 同期はブロックの数だけ時間がかかるため、通知を受けたスレッドでは行わず1つのスレッドに任せる
+        # 同じノードからの同期が待っていれば、先端だけを新しくする
+        tip = {"height": compact.height, "length": compact.height + 1}
+        with self.relay_sync_lock:
+            pending = self.relay_sync_tips.get(compact.node)
+            if pending is None or pending["height"] < tip["height"]:
+                self.relay_sync_tips[compact.node] = tip
+            if self.relay_sync_thread is None:
+                self.relay_sync_thread = threading.Thread(
+                    target=self._sync_announced_nodes, name="relay-sync", daemon=True
+                )
+                self.relay_sync_thread.start()
+        return RELAY_QUEUED
+
+    def _sync_announced_nodes(self) -> None:
+        while True:
+            with self.relay_sync_lock:
+                if not self.relay_sync_tips:
+                    self.relay_sync_thread = None
+                    return
+                node = next(iter(self.relay_sync_tips))
+                tip = self.relay_sync_tips.pop(node)
+            try:
+                synced = self.sync_from(node, tip)
+            except Exception as ex:
+                logger.exception(
+                    {"action": "sync_announced_block", "node": node, "ex": str(ex)}
+                )
+                synced = False
+            if synced:
+                self.abort_mining()
+
+    def fetch_block_transactions(
+        self, node: str, block_hash: str, indexes: list[int]
+    ) -> list[SignedTransaction] | None:
+        response_json = self._get_json(
+            node, f"/blocks/{block_hash}/transactions", {"indexes": indexes}
+        )
+        if response_json is None:
+            return None
+        transactions = [
+            SignedTransaction.model_validate(transaction)
+            for transaction in response_json["transactions"]
+        ]
+        if len(transactions) != len(indexes):
+            return None
+        return transactions
+
+    def get_block_transactions(
+        self, block_hash: str, indexes: list[int]
+    ) -> list[SignedTransaction] | None:
+        snapshot = self.snapshot
+        height = snapshot.height_of(block_hash)
+        if height is None:
+            return None
+        transactions = snapshot.block(height).transactions
+        if not all(0 <= index < len(transactions) for index in indexes):
+            return None
+        return [transactions[index] for index in indexes]
+
+    def _add_announced_block(self, block: Block) -> ValidationResult | None:
+        # 先端の確認から検証、追加までを書き込みスレッドでまとめて行う
+        # 残高は書き込みスレッドの中では変わらないため、写さずに参照する
+        height = len(self.chain)
+        tip_hash = self.block_hash(height - 1)
+        if block.previous_hash != tip_hash:
+            return None
+        snapshot = ChainSnapshot(
+            self.chain, height, tip_hash, (), self.block_heights, self.history_index
+        )
+        result = self.validate_blocks(
+            [block],
+            height,
+            tip_hash,
+            self.difficulty_tracker(height - 1, snapshot),
+            BalanceView(self.balance_index.balance),
+        )
+        if result.valid:
+            self._add_blocks([block])
+        return result
+
+    def clear_transaction_pool(self) -> None:
+        self.writer.call(self._clear_transaction_pool)
+
+    def _clear_transaction_pool(self) -> None:
+        self.mempool.clear()
+
     def calculate_total_amount(self, blockchain_address: str) -> float:
-        total_amount = 0.0
-        for block in self.chain:
-            for transaction in block.transactions:
-                value = transaction.value
-                if blockchain_address == transaction.recipient_blockchain_address:
-                    total_amount += value
-                if blockchain_address == transaction.sender_blockchain_address:
-                    total_amount -= value
+        return self.balance_index.balance(blockchain_address)
 
-        return total_amount
+    def available_amount(self, blockchain_address: str) -> float:
+        # プール内の未確定の送金を差し引いた、これから送金できる額
+        return self.calculate_total_amount(
+            blockchain_address
+        ) - self.mempool.pending_spend(blockchain_address)
 
     def valid_blockchain(self, chain: list[Block]) -> bool:
-        pre_block = chain[0]
-        current_index = 1
+        # ジェネシスブロックから全ブロックを検証する
+        # 難易度が規則どおりかも確かめるため、長さではなく累積ワークで比べられるチェーンになる
+        return self.validate_blocks(
+            chain, 0, None, DifficultyTracker(), BalanceView(lambda _: 0.0)
+        ).valid
 
-        while current_index < len(chain):
-            block = chain[current_index]
+    def get_tip(self) -> dict:
+        snapshot = self.snapshot
+        node = self.block_tree.get(snapshot.tip_hash)
+        return {
+            "height": snapshot.length - 1,
+            "length": snapshot.length,
+            "hash": snapshot.tip_hash,
+            # 先端までの累積ワーク。ノード間ではチェーンの長さではなくこれで比べる
+            "work": node.work if node is not None else 0,
+        }
 
-            if block["previous_hash"] != self.hash(pre_block):
-                return False
+    def get_headers(self, from_height: int, limit: int = SYNC_MAX_HEADERS) -> list:
+        # ヘッダーだけで PoW とつながりを確認できるよう、ヘッダーの全フィールドを返す
+        snapshot = self.snapshot
+        from_height = max(from_height, 0)
+        to_height = min(snapshot.length, from_height + min(limit, SYNC_MAX_HEADERS))
+        return [
+            {
+                "height": height,
+                "hash": snapshot.block_hash(height),
+                **snapshot.block(height).header().model_dump(),
+            }
+            for height in range(from_height, to_height)
+        ]
 
-            if not self.valid_proof(
-                transactions=block.transactions,
-                previous_hash=block.previous_hash,
-                nonce=block.nonce,
-                difficulty=MINING_DIFFICLTY,
-            ):
-                return False
+    def get_transaction(self, tx_id: str) -> dict | None:
+        # 同じIDのトランザクションが複数あれば最も新しいものを返し、すべての位置も返す
+        snapshot = self.snapshot
+        refs = snapshot.locate(tx_id)
+        if not refs:
+            return None
+        height, index = refs[0]
+        return {
+            "transaction_id": tx_id,
+            "transaction": snapshot.block(height).transactions[index],
+            "block_hash": snapshot.block_hash(height),
+            "height": height,
+            "index": index,
+            "confirmations": snapshot.length - height,
+            "occurrences": self.occurrences(refs, snapshot),
+        }
 
-            pre_block = block
-            current_index += 1
+    def occurrences(
+        self, refs: list[tuple[int, int]], snapshot: ChainSnapshot
+    ) -> list[dict]:
+        return [
+            {
+                "block_hash": snapshot.block_hash(height),
+                "height": height,
+                "index": index,
+                "confirmations": snapshot.length - height,
+            }
+            for height, index in refs
+        ]
 
-        return True
+    def get_address_history(
+        self, blockchain_address: str, offset: int = 0, limit: int = HISTORY_PAGE_LIMIT
+    ) -> dict:
+        # 新しい順にページングして返す
+        snapshot = self.snapshot
+        total, refs = snapshot.address_refs(
+            blockchain_address, offset, min(limit, HISTORY_PAGE_LIMIT)
+        )
+        transactions = []
+        for height, index in refs:
+            transaction = snapshot.block(height).transactions[index]
+            transactions.append(
+                {
+                    "transaction_id": transaction_id(transaction),
+                    "transaction": transaction,
+                    "height": height,
+                    "index": index,
+                }
+            )
+        return {
+            "blockchain_address": blockchain_address,
+            "total": total,
+            "offset": offset,
+            "transactions": transactions,
+        }
+
+    def transaction_proof(
+        self, tx_id: str, height: int = None, index: int = None
+    ) -> dict | None:
+        # 同じIDのトランザクションが複数あれば、height と index で選んだものの証明を返す
+        # 省略した場合は最も新しいものを選ぶ
+        snapshot = self.snapshot
+        refs = snapshot.locate(tx_id)
+        selected = [
+            ref
+            for ref in refs
+            if (height is None or ref[0] == height)
+            and (index is None or ref[1] == index)
+        ]
+        if not selected:
+            return None
+        height, index = selected[0]
+        block = snapshot.block(height)
+        return {
+            "transaction_id": tx_id,
+            "block_hash": snapshot.block_hash(height),
+            "height": height,
+            "confirmations": snapshot.length - height,
+            "header": block.header().model_dump(),
+            "index": index,
+            # マークルツリーの葉は公開鍵と署名も含むため、検証する側が葉を求められるよう本体も返す
+            "transaction": block.transactions[index],
+            "proof": merkle_proof(block.transactions, index),
+            "occurrences": self.occurrences(refs, snapshot),
+        }
+
+    def get_blocks(
+        self, to_hash: str, after_hash: str = None, limit: int = SYNC_MAX_BLOCKS
+    ) -> list[Block] | None:
+        # after_hash の次のブロックから to_hash のブロックまでを返す
+        snapshot = self.snapshot
+        to_height = snapshot.height_of(to_hash)
+        from_height = 0
+        if after_hash is not None:
+            after_height = snapshot.height_of(after_hash)
+            if after_height is None:
+                return None
+            from_height = after_height + 1
+        if to_height is None or not self.history_available(from_height):
+            return None
+
+        end_height = min(
+            to_height + 1,
+            from_height + min(limit, SYNC_MAX_BLOCKS),
+            snapshot.length,
+        )
+        return [snapshot.block(height) for height in range(from_height, end_height)]
+
+    def chain_range(
+        self, from_height: int = 0, to_height: int = None, limit: int = None
+    ) -> range:
+        # to_height はそのブロックを含む
+        stop = self.snapshot.length
+        if to_height is not None:
+            stop = min(stop, to_height + 1)
+        from_height = max(from_height, 0)
+        if limit is not None:
+            stop = min(stop, from_height + max(limit, 0))
+        return range(from_height, max(stop, from_height))
+
+    def iter_chain(self, heights: range) -> Iterator[Block]:
+        # 公開済みのスナップショットから読むため、読んでいる間に巻き戻されても混ざらない
+        chain = self.snapshot.chain
+        if not isinstance(chain, list):
+            return chain.iter_range(heights.start, heights.stop)
+        return islice(chain, heights.start, heights.stop)
+
+    def iter_chain_lines(self, heights: range) -> Iterator[bytes]:
+        # ストアの行はそのまま NDJSON の1行として返せる
+        chain = self.snapshot.chain
+        if not isinstance(chain, list):
+            return chain.iter_lines(heights.start, heights.stop)
+        return (
+            block.model_dump_json().encode() + b"\n"
+            for block in self.iter_chain(heights)
+        )
+
+    def _get_json(self, node: str, path: str, params: dict = None) -> dict | None:
+        return self.peer_client.get_json(node, path, params=params)
+
+    def find_common_height(self, node: str, peer_length: int) -> int | None:
+        # 先端付近のヘッダーから順に、窓を広げながら共通の祖先を探す
+        window = SYNC_HEADERS_WINDOW
+        snapshot = self.snapshot
+        top = min(snapshot.length, peer_length) - 1
+        while top >= 0:
+            start = max(0, top - window + 1)
+            response_json = self._get_json(
+                node, "/headers", {"from_height": start, "limit": top - start + 1}
+            )
+            if response_json is None:
+                return None
+            for header in reversed(response_json["headers"]):
+                if snapshot.height_of(header["hash"]) == header["height"]:
+                    return header["height"]
+            top = start - 1
+            window *= 2
+        return -1
+
+    def sync_from(self, node: str, tip: dict) -> bool:
+        fork_height = self.find_common_height(node, tip["length"])
+        if fork_height is None:
+            return False
+        if not self.history_available(fork_height + 1):
+            # チェックポイントより前の分岐は、履歴の検証が終わるまで受け入れない
+            logger.error(
+                {"action": "sync_from", "node": node, "error": "before_checkpoint"}
+            )
+            return False
+
+        # 共通の祖先より後ろのブロックをストリームで受け取り、一定数ごとに並列に検証して
+        # 不正なブロックの手前までを木に加える。メインチェーンを追い越した後は順次取り込まれ
+        # 手元に溜めるブロックはチェーン全体の長さに比例しない
+        blocks = self.peer_client.iter_blocks(
+            node,
+            "/chain",
+            {"from_height": fork_height + 1, "to_height": tip["height"]},
+        )
+        if blocks is None:
+            return False
+
+        replaced = False
+        height = fork_height + 1
+        previous_hash = (
+            self.snapshot.block_hash(fork_height) if fork_height >= 0 else None
+        )
+        difficulty = (
+            self.difficulty_tracker(fork_height)
+            if fork_height >= 0
+            else DifficultyTracker()
+        )
+        balances = self.balances_at(fork_height)
+        with contextlib.closing(blocks):
+            while True:
+                batch = list(islice(blocks, SYNC_MAX_BLOCKS))
+                if not batch:
+                    break
+                result = self.validate_blocks(
+                    batch, height, previous_hash, difficulty, balances
+                )
+                if result.hashes:
+                    replaced = self.add_blocks(batch[: len(result.hashes)]) or replaced
+                    height += len(result.hashes)
+                    previous_hash = result.hashes[-1]
+                if not result.valid:
+                    logger.error(
+                        {
+                            "action": "sync_from",
+                            "node": node,
+                            "invalid_height": result.height,
+                            "reason": result.reason,
+                        }
+                    )
+                    break
+
+        logger.info(
+            {
+                "action": "sync_from",
+                "node": node,
+                "fork_height": fork_height,
+                "blocks": height - fork_height - 1,
+                "replaced": replaced,
+            }
+        )
+        return replaced
 
     def resolve_conflicts(self) -> bool:
-        longest_chain = None
-        max_length = len(self.chain)
-
-        for node in self.neighbours:
-            response = requests.get(f"http://{node}/chain")
-            if response.status_code == 200:
-                response_json = response.json()
-                chain: list[Block] = response_json["chain"]
-                chain_length = len(chain)
-
-                if chain_length > max_length and self.valid_blockchain(chain=chain):
-                    max_length = chain_length
-                    longest_chain = chain
-
-        if longest_chain:
-            self.chain = longest_chain
-            logger.info({"action": "resolve)confilixts", "status": "replaced"})
-            return True
+        # 各ノードの先端だけを取得し、自分より累積ワークが大きいノードから差分のブロックを同期する
+        # 難易度の低いブロックを積み上げただけの長いチェーンには切り替えない
+        work = self.get_tip()["work"]
+        tips = []
+        for node, tip in self.peer_client.gather_json(
+            self.neighbours, "/chain/tip"
+        ).items():
+            if tip is not None and tip.get("work", 0) > work:
+                tips.append((tip["work"], node, tip))
+
+        for _, node, tip in sorted(tips, reverse=True):
+            if self.sync_from(node, tip):
+                self.abort_mining()
+                logger.info({"action": "resolve)confilixts", "status": "replaced"})
+                return True
 
         logger.info({"action": "resolve)confilixts", "status": "not_replaced"})
         return False
+
+    def bootstrap(self, node: str, checkpoint_hash: str = None) -> bool:
+        # 信頼できるチェックポイントの残高のスナップショットとヘッダーだけを取り込んで起動する
+        # それより後ろのブロックは通常の同期で受け取り、前の履歴はバックグラウンドで検証する
+        # checkpoint_hash を省略した場合は、node が配るスナップショットをそのまま信頼する
+        if len(self.chain) > 1:
+            logger.error({"action": "bootstrap", "error": "chain_not_empty"})
+            return False
+        state = self.peer_client.get_state_snapshot(node)
+        if state is None:
+            logger.error({"action": "bootstrap", "node": node, "error": "no_snapshot"})
+            return False
+        if checkpoint_hash is not None and state.block_hash != checkpoint_hash:
+            logger.error(
+                {"action": "bootstrap", "node": node, "error": "checkpoint_mismatch"}
+            )
+            return False
+
+        headers = self.fetch_checkpoint_headers(node, state)
+        if headers is None or not self.writer.call(
+            self._load_checkpoint, state, headers
+        ):
+            return False
+        logger.info({"action": "bootstrap", "node": node, "height": state.height})
+        self.start_checkpoint_verification([node])
+        return True
+
+    def fetch_checkpoint_headers(
+        self, node: str, state: StateSnapshot
+    ) -> list[BlockHeader] | None:
+        # ジェネシスブロックからチェックポイントまでのヘッダーを受け取り、
+        # PoW とつながり、難易度を確かめた上で、最後のハッシュがチェックポイントと一致すること
+        headers = []
+        previous_hash = None
+        difficulty = DifficultyTracker()
+        while len(headers) <= state.height:
+            response_json = self._get_json(
+                node,
+                "/headers",
+                {
+                    "from_height": len(headers),
+                    "limit": min(SYNC_MAX_HEADERS, state.height + 1 - len(headers)),
+                },
+            )
+            if response_json is None or not response_json["headers"]:
+                logger.error({"action": "bootstrap", "error": "headers_unavailable"})
+                return None
+            page = [
+                BlockHeader.model_validate(header)
+                for header in response_json["headers"]
+            ]
+            result = self.chain_validator.validate_headers(
+                page, len(headers), previous_hash, difficulty
+            )
+            if not result.valid:
+                return None
+            headers.extend(page)
+            previous_hash = result.hashes[-1]
+        if previous_hash != state.block_hash:
+            logger.error({"action": "bootstrap", "error": "checkpoint_hash"})
+            return None
+        return headers
+
+    def _load_checkpoint(
+        self, state: StateSnapshot, headers: list[BlockHeader]
+    ) -> bool:
+        # ジェネシスブロックだけのチェーンを、ヘッダーだけのブロックのチェーンに置き換える
+        if len(self.chain) > 1:
+            return False
+        blocks = [Block(transactions=[], **header.model_dump()) for header in headers]
+        if self.store is not None:
+            self.store.save_checkpoint(state)
+            self.store.truncate(0)
+            self.store.extend(blocks)
+        else:
+            self.chain = blocks
+        self.checkpoint = state
+        self.block_heights = {}
+        self.block_tree = BlockTree()
+        for height, block in enumerate(blocks):
+            self.block_heights[self.hash(block)] = height
+            self.block_tree.add(
+                self.hash(block), block.previous_hash, block_work(block.difficulty)
+            )
+        self.rebuild_balances()
+        self.history_index.rebuild(blocks)
+        self.save_history()
+        self.update_state_snapshot(0)
+        return True
+
+    def start_checkpoint_verification(self, nodes: list[str]) -> None:
+        if self.checkpoint is None or (
+            self.checkpoint_thread is not None and self.checkpoint_thread.is_alive()
+        ):
+            return
+        self.checkpoint_thread = threading.Thread(
+            target=self.verify_checkpoint,
+            args=(list(nodes),),
+            name="checkpoint-verifier",
+            daemon=True,
+        )
+        self.checkpoint_thread.start()
+
+    def verify_checkpoint(self, nodes: list[str]) -> bool:
+        # チェックポイントまでの全ブロックをジェネシスブロックから検証し、
+        # ヘッダーだけのブロックと同じハッシュであれば本体に置き換える
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            return True
+        for node in nodes:
+            history_index = HistoryIndex()
+            balances = BalanceView(lambda _: 0.0)
+            blocks = self._iter_verified_history(
+                node, checkpoint, history_index, balances
+            )
+            try:
+                if self.store is not None:
+                    self.store.write_prefix(blocks)
+                    verified = None
+                else:
+                    verified = list(blocks)
+            except CheckpointError as ex:
+                logger.error(
+                    {"action": "verify_checkpoint", "node": node, "error": str(ex)}
+                )
+                continue
+
+            replayed = None
+            if not balances.matches(checkpoint.balances):
+                # ヘッダーは正しいが残高が履歴と合わない。履歴から求めた残高に直す
+                logger.error(
+                    {"action": "verify_checkpoint", "error": "checkpoint_invalid"}
+                )
+                replayed = StateSnapshot(
+                    height=checkpoint.height,
+                    block_hash=checkpoint.block_hash,
+                    balances=balances.changes(),
+                )
+            self.writer.call(
+                self._complete_checkpoint, history_index, verified, replayed
+            )
+            logger.info(
+                {
+                    "action": "verify_checkpoint",
+                    "node": node,
+                    "height": checkpoint.height,
+                }
+            )
+            return True
+        return False
+
+    def _iter_verified_history(
+        self,
+        node: str,
+        checkpoint: StateSnapshot,
+        history_index: HistoryIndex,
+        balances: BalanceView,
+    ) -> Iterator[Block]:
+        # 検証を通ったブロックを順に返す。balances と history_index には返したブロックが適用される
+        blocks = self.peer_client.iter_blocks(
+            node, "/chain", {"from_height": 0, "to_height": checkpoint.height}
+        )
+        if blocks is None:
+            raise CheckpointError("history_unavailable")
+
+        height = 0
+        previous_hash = None
+        difficulty = DifficultyTracker()
+        with contextlib.closing(blocks):
+            while True:
+                batch = list(islice(blocks, SYNC_MAX_BLOCKS))
+                if not batch:
+                    break
+                result = self.validate_blocks(
+                    batch, height, previous_hash, difficulty, balances
+                )
+                for offset, block_hash in enumerate(result.hashes):
+                    if block_hash != self.snapshot.block_hash(height + offset):
+                        raise CheckpointError("hash_mismatch")
+                if not result.valid:
+                    raise CheckpointError(result.reason)
+                for offset, block in enumerate(batch):
+                    history_index.apply_block(height + offset, block)
+                yield from batch
+                height += len(batch)
+                previous_hash = result.hashes[-1]
+        if height != checkpoint.height + 1:
+            raise CheckpointError("incomplete_history")
+
+    def _complete_checkpoint(
+        self,
+        history_index: HistoryIndex,
+        blocks: list[Block] | None,
+        balances: StateSnapshot | None,
+    ) -> None:
+        checkpoint = self.checkpoint
+        if self.store is not None:
+            self.store.swap_prefix()
+        else:
+            # 公開済みのスナップショットが参照するリストは変更せず、新しいリストに置き換える
+            self.chain = blocks + self.chain[checkpoint.height + 1 :]
+        for offset, block in enumerate(self.blocks_after(checkpoint.height)):
+            history_index.apply_block(checkpoint.height + 1 + offset, block)
+        self.history_index = history_index
+        if balances is not None:
+            self.rebuild_balances(balances)
+        self.checkpoint = None
+        if self.store is not None:
+            self.store.clear_checkpoint()
+        self.save_history()
@@ -1,41 +1,199 @@
+import threading
+
 import uvicorn
 import uvicorn.protocols
-from fastapi import FastAPI, status
-from fastapi.responses import JSONResponse
-
-from blockchain import BlockChain
-from models import BlockChainCache, PostTransactionRequest, Transaction
+from fastapi import FastAPI, Query, Request, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from blockchain import (
+    MINING_WORKERS,
+    SYNC_MAX_BLOCKS,
+    SYNC_MAX_HEADERS,
+    BlockChain,
+)
+from history import HISTORY_PAGE_LIMIT
+from models import (
+    BlockChainCache,
+    CompactBlock,
+    PendingTransaction,
+    PostTransactionRequest,
+    Transaction,
+)
+from storage import BlockStore
+from utils import load_seeds
 from wallet import Wallet
+from wire import (
+    MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    STATE_MEDIA_TYPE,
+    encode_blocks,
+    encode_state_snapshot,
+)
+
+# 一括送信で一度に受け付けるトランザクション数の上限
+BULK_MAX_TRANSACTIONS = 10_000
+# これより大きいレスポンスは Accept-Encoding: gzip を送ったクライアントにだけ圧縮して返す
+RESPONSE_COMPRESS_MIN_SIZE = 1024
 
 app = FastAPI()
+app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_COMPRESS_MIN_SIZE)
 app.state.port = 8000
+app.state.mining_workers = None
+app.state.data_dir = None
+app.state.seeds = []
 cache = BlockChainCache()
+cache_lock = threading.Lock()
 
 
 def get_blockchain() -> BlockChain:
     cached_blockchain = cache.blockchain
-    if not cached_blockchain:
+    if cached_blockchain:
+        return cached_blockchain
+
+    # 並行に届いた最初のリクエストで二重に作らないようにする
+    with cache_lock:
+        if cache.blockchain:
+            return cache.blockchain
         miners_wallet = Wallet()
+        store = BlockStore(app.state.data_dir) if app.state.data_dir else None
         cache.blockchain = BlockChain(
             blockchain_address=miners_wallet.blockchain_address,
             port=app.state.port,
+            mining_workers=app.state.mining_workers,
+            store=store,
+            seeds=app.state.seeds,
         )
 
     return cache.blockchain
 
 
+def wants_wire_format(request: Request) -> bool:
+    return MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def wire_response(blocks) -> Response:
+    return Response(b"".join(encode_blocks(blocks)), media_type=MEDIA_TYPE)
+
+
 @app.get("/")
 def check_connect():
     return {"connection": True}
 
 
 @app.get("/chain")
-def get_chain():
+def get_chain(
+    request: Request,
+    from_height: int = 0,
+    to_height: int = None,
+    limit: int = None,
+):
+    # バイナリ形式と NDJSON はストアから1ブロックずつ読みながら返す
     block_chain = get_blockchain()
-    response = {"chain": block_chain.chain}
+    heights = block_chain.chain_range(from_height, to_height, limit)
+    if heights and not block_chain.history_available(heights.start):
+        # チェックポイントから起動し、まだ前の履歴を持っていない
+        return JSONResponse(
+            {"message": "history_unavailable"}, status_code=status.HTTP_409_CONFLICT
+        )
+    if wants_wire_format(request):
+        return StreamingResponse(
+            encode_blocks(block_chain.iter_chain(heights)), media_type=MEDIA_TYPE
+        )
+    if wants_ndjson(request):
+        return StreamingResponse(
+            block_chain.iter_chain_lines(heights), media_type=NDJSON_MEDIA_TYPE
+        )
+    response = {"chain": list(block_chain.iter_chain(heights))}
     return response
 
 
+@app.get("/chain/tip")
+def get_chain_tip():
+    return get_blockchain().get_tip()
+
+
+@app.get("/state/snapshot")
+def get_state_snapshot():
+    state = get_blockchain().get_state_snapshot()
+    if state is None:
+        return JSONResponse(
+            {"message": "not_found"}, status_code=status.HTTP_404_NOT_FOUND
+        )
+    return Response(encode_state_snapshot(state), media_type=STATE_MEDIA_TYPE)
+
+
+@app.get("/headers")
+def get_headers(from_height: int = 0, limit: int = SYNC_MAX_HEADERS):
+    return {"headers": get_blockchain().get_headers(from_height, limit)}
+
+
+@app.get("/blocks")
+def get_blocks(
+    request: Request,
+    to_hash: str,
+    after_hash: str = None,
+    limit: int = SYNC_MAX_BLOCKS,
+):
+    blocks = get_blockchain().get_blocks(to_hash, after_hash, limit)
+    if blocks is None:
+        return JSONResponse(
+            {"message": "not_found"}, status_code=status.HTTP_404_NOT_FOUND
+        )
+    if wants_wire_format(request):
+        return wire_response(blocks)
+    return {"blocks": blocks}
+
+
+@app.post("/blocks/compact")
+def receive_compact_block(body: CompactBlock, request: Request):
+    # 近隣ノードがマイニングしたブロックの通知
+    client_host = request.client.host if request.client else None
+    return {"status": get_blockchain().receive_compact_block(body, client_host)}
+
+
+@app.get("/blocks/{block_hash}/transactions")
+def get_block_transactions(block_hash: str, indexes: list[int] = Query()):
+    # 通知されたブロックを組み立てるのに足りないトランザクション
+    transactions = get_blockchain().get_block_transactions(block_hash, indexes)
+    if transactions is None:
+        return JSONResponse(
+            {"message": "not_found"}, status_code=status.HTTP_404_NOT_FOUND
+        )
+    return {"transactions": transactions}
+
+
+@app.get("/transactions/{transaction_id}")
+def get_transaction_by_id(transaction_id: str):
+    transaction = get_blockchain().get_transaction(transaction_id)
+    if transaction is None:
+        return JSONResponse(
+            {"message": "not_found"}, status_code=status.HTTP_404_NOT_FOUND
+        )
+    return transaction
+
+
+@app.get("/addresses/{blockchain_address}/transactions")
+def get_address_history(
+    blockchain_address: str, offset: int = 0, limit: int = HISTORY_PAGE_LIMIT
+):
+    return get_blockchain().get_address_history(blockchain_address, offset, limit)
+
+
+@app.get("/transactions/{transaction_id}/proof")
+def get_transaction_proof(transaction_id: str, height: int = None, index: int = None):
+    proof = get_blockchain().transaction_proof(transaction_id, height, index)
+    if proof is None:
+        return JSONResponse(
+            {"message": "not_found"}, status_code=status.HTTP_404_NOT_FOUND
+        )
+    return proof
+
+
 @app.get("/get_transactions")
 def get_transaction():
     block_chain = get_blockchain()
@@ -66,7 +224,7 @@ def post_transactions(body: PostTransactionRequest):
     return JSONResponse({"message": "success"}, status_code=status.HTTP_201_CREATED)
 
 
-@app.post("update_transaction")
+@app.post("/update_transactions")
 def update_transaction(body: PostTransactionRequest):
     block_chain = get_blockchain()
 
@@ -88,10 +246,65 @@ def update_transaction(body: PostTransactionRequest):
     return JSONResponse({"message": "success"}, status_code=status.HTTP_200_OK)
 
 
+def to_pending_transactions(
+    body: list[PostTransactionRequest],
+) -> list[PendingTransaction]:
+    return [
+        PendingTransaction(
+            transaction=Transaction(
+                sender_blockchain_address=item.sender_blockchain_address,
+                recipient_blockchain_address=item.recipient_blockchain_address,
+                value=item.value,
+            ),
+            sender_public_key=item.sender_public_key,
+            signature=item.signature,
+        )
+        for item in body
+    ]
+
+
+def bulk_response(results: list[bool]) -> dict:
+    return {
+        "results": [
+            {"index": index, "message": "success" if is_added else "fail"}
+            for index, is_added in enumerate(results)
+        ],
+        "accepted": sum(results),
+    }
+
+
+def bulk_too_large(body: list) -> JSONResponse | None:
+    if len(body) > BULK_MAX_TRANSACTIONS:
+        return JSONResponse(
+            {"message": "too_many_transactions", "limit": BULK_MAX_TRANSACTIONS},
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    return None
+
+
+@app.post("/post_transactions/bulk")
+def post_transactions_bulk(body: list[PostTransactionRequest]):
+    # 結果は送られてきた順に1件ずつ返す
+    too_large = bulk_too_large(body)
+    if too_large is not None:
+        return too_large
+    results = get_blockchain().create_transactions(to_pending_transactions(body))
+    return bulk_response(results)
+
+
+@app.post("/update_transactions/bulk")
+def update_transactions_bulk(body: list[PostTransactionRequest]):
+    too_large = bulk_too_large(body)
+    if too_large is not None:
+        return too_large
+    results = get_blockchain().add_transactions(to_pending_transactions(body))
+    return bulk_response(results)
+
+
 @app.delete("/delete_transaction")
 def delete_transaction():
     block_chain = get_blockchain()
-    block_chain.transaction_pool = []
+    block_chain.clear_transaction_pool()
 
     return {"message": "success"}
 
@@ -112,6 +325,11 @@ def start_mine():
     return {"message": "success"}
 
 
+@app.get("/mining/metrics")
+def get_mining_metrics():
+    return get_blockchain().mining_metrics.as_dict()
+
+
 @app.post("/consensus")
 def consensus():
     block_chain = get_blockchain()
@@ -129,11 +347,24 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port", default="5000", type=str)
+    parser.add_argument("-w", "--mining-workers", default=MINING_WORKERS, type=int)
+    parser.add_argument("-d", "--data-dir", default=None, type=str)
+    parser.add_argument("-s", "--seeds-file", default=None, type=str)
+    # 空のチェーンで起動するときに、このノードのスナップショットから始める
+    parser.add_argument("-b", "--bootstrap", default=None, type=str)
+    # 信頼するチェックポイントのブロックのハッシュ
+    parser.add_argument("-c", "--checkpoint", default=None, type=str)
 
     args = parser.parse_args()
     port = args.port
 
     app.state.port = port
+    app.state.mining_workers = args.mining_workers
+    app.state.data_dir = args.data_dir
+    if args.seeds_file:
+        app.state.seeds = load_seeds(args.seeds_file)
 
+    if args.bootstrap:
+        get_blockchain().bootstrap(args.bootstrap, args.checkpoint)
     get_blockchain().run()
     uvicorn.run(app, host="0.0.0.0", port=int(port))
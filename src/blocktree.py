@@ -0,0 +1,88 @@
+from models import Block
+
+
+class BlockNode:
+    hash: str
+    previous_hash: str
+    height: int
+    work: int
+    parent: "BlockNode | None"
+    # メインチェーン上のブロック本体はチェーン側に保持するため、
+    # 本体を持つのはメインチェーンから外れたブロックだけ
+    block: Block | None
+
+    def __init__(
+        self,
+        block_hash: str,
+        previous_hash: str,
+        parent: "BlockNode | None",
+        work: int,
+        block: Block | None = None,
+    ) -> None:
+        self.hash = block_hash
+        self.previous_hash = previous_hash
+        self.parent = parent
+        self.height = parent.height + 1 if parent is not None else 0
+        self.work = work + (parent.work if parent is not None else 0)
+        self.block = block
+
+
+class BlockTree:
+    # ハッシュ値をキーにした全ブロック(分岐を含む)の木と、累積ワークが最大の先端
+    _nodes: dict[str, BlockNode]
+    best_tip: BlockNode | None
+
+    def __init__(self) -> None:
+        self._nodes = {}
+        self.best_tip = None
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._nodes
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def get(self, block_hash: str) -> BlockNode | None:
+        return self._nodes.get(block_hash)
+
+    def add(
+        self,
+        block_hash: str,
+        previous_hash: str,
+        work: int,
+        block: Block | None = None,
+    ) -> BlockNode:
+        # 親が見つからないブロックは新しい根(ジェネシスブロック)として扱う
+        node = self._nodes.get(block_hash)
+        if node is not None:
+            return node
+
+        node = BlockNode(
+            block_hash=block_hash,
+            previous_hash=previous_hash,
+            parent=self._nodes.get(previous_hash),
+            work=work,
+            block=block,
+        )
+        self._nodes[block_hash] = node
+        if self.best_tip is None or node.work > self.best_tip.work:
+            self.best_tip = node
+        return node
+
+    def fork_path(
+        self, old_tip: BlockNode, new_tip: BlockNode
+    ) -> tuple[list[BlockNode], list[BlockNode]]:
+        # old_tip から共通の祖先まで戻るノード(先端から順)と、
+        # 共通の祖先から new_tip まで進むノード(古い順)を返す
+        detach = []
+        attach = []
+        old, new = old_tip, new_tip
+        while old is not new:
+            if old is not None and (new is None or old.height >= new.height):
+                detach.append(old)
+                old = old.parent
+            else:
+                attach.append(new)
+                new = new.parent
+        attach.reverse()
+        return detach, attach
@@ -0,0 +1,81 @@
+import math
+from collections import deque
+from functools import lru_cache
+
+# 難易度は PoW のハッシュ値の先頭に並ぶ 0 のビット数で表す
+INITIAL_DIFFICULTY = 12
+MIN_DIFFICULTY = 8
+MAX_DIFFICULTY = 128
+HASH_BITS = 256
+# 何ブロックごとに難易度を見直すか
+RETARGET_INTERVAL = 16
+# 目標とするブロックの間隔
+TARGET_BLOCK_SEC = 30
+# 1回の見直しで変える難易度の上限(ビット数)。ワークにして4倍まで
+MAX_RETARGET_STEP = 2
+# 新しいブロックのタイムスタンプは、直近のこの数のブロックの中央値より後であること
+# DifficultyTracker が保持する RETARGET_INTERVAL + 1 個以下にする
+MEDIAN_TIME_SPAN = 11
+
+
+@lru_cache(maxsize=None)
+def proof_target(difficulty: int) -> str:
+    # ハッシュ値(16進数の文字列)がこの文字列より小さければ PoW を満たす
+    # 同じ長さの16進数の文字列は数値と同じ順に並ぶため、整数に変換せずに比較できる
+    return format(1 << (HASH_BITS - difficulty), "064x")
+
+
+def valid_difficulty(difficulty: int) -> bool:
+    return MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY
+
+
+def meets_difficulty(guess_hash: str, difficulty: int) -> bool:
+    return guess_hash < proof_target(difficulty)
+
+
+def block_work(difficulty: int) -> int:
+    # 見つけるまでに必要なハッシュ計算回数の期待値
+    return 1 << difficulty
+
+
+def retarget(difficulty: int, timespan: float) -> int:
+    # 直近 RETARGET_INTERVAL 個のブロックの間隔が目標に近づくよう、2のべき単位で調整する
+    expected = TARGET_BLOCK_SEC * RETARGET_INTERVAL
+    step = round(math.log2(expected / max(timespan, 1e-3)))
+    step = max(-MAX_RETARGET_STEP, min(MAX_RETARGET_STEP, step))
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, difficulty + step))
+
+
+class DifficultyTracker:
+    # 直近のブロックのタイムスタンプと難易度を順に受け取り、次のブロックに求める難易度を返す
+    # height は次に受け取るブロックの高さ
+    height: int
+    difficulty: int
+    _timestamps: deque[float]
+
+    def __init__(self, height: int = 0) -> None:
+        self.height = height
+        self.difficulty = INITIAL_DIFFICULTY
+        self._timestamps = deque(maxlen=RETARGET_INTERVAL + 1)
+
+    def push(self, timestamp: float, difficulty: int) -> None:
+        self._timestamps.append(timestamp)
+        self.difficulty = difficulty
+        self.height += 1
+
+    def median_time(self) -> float | None:
+        # 受け取ったブロックがなければ None を返す
+        timestamps = sorted(list(self._timestamps)[-MEDIAN_TIME_SPAN:])
+        if not timestamps:
+            return None
+        return timestamps[len(timestamps) // 2]
+
+    def next_difficulty(self) -> int:
+        # ジェネシスブロックは作られた時刻がノードごとに異なるため、間隔の計算には使わない
+        if (
+            self.height % RETARGET_INTERVAL
+            or self.height < 2 * RETARGET_INTERVAL
+            or len(self._timestamps) <= RETARGET_INTERVAL
+        ):
+            return self.difficulty
+        return retarget(self.difficulty, self._timestamps[-1] - self._timestamps[0])
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_TIMEOUT_SEC = 10
+GATEWAY_CONNECT_TIMEOUT_SEC = 2
+GATEWAY_MAX_CONNECTIONS = 100
+GATEWAY_MAX_KEEPALIVE = 20
+# 同時に中継するリクエスト数の上限。超えた分は接続プールに積まずにここで待たせる
+GATEWAY_MAX_IN_FLIGHT = GATEWAY_MAX_CONNECTIONS
+GATEWAY_HEALTH_INTERVAL_SEC = 5
+# 失敗したゲートウェイはこの時間だけ候補から外す
+GATEWAY_DOWN_SEC = 10
+# リクエストがノードに届く前の失敗
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class GatewayClient:
+    # 1つ以上のゲートウェイノードへの非同期クライアント
+    # 接続はプールして使い回し、失敗したゲートウェイは一定時間外して次のゲートウェイに切り替える
+    gateways: list[str]
+    _client: httpx.AsyncClient | None
+    _down_until: dict[str, float]
+
+    def __init__(
+        self,
+        gateways: list[str],
+        max_in_flight: int = GATEWAY_MAX_IN_FLIGHT,
+    ) -> None:
+        self.gateways = [gateway.rstrip("/") for gateway in gateways]
+        self.max_in_flight = max_in_flight
+        self._client = None
+        self._semaphore = None
+        self._health_task = None
+        self._down_until = {gateway: 0.0 for gateway in self.gateways}
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                GATEWAY_TIMEOUT_SEC, connect=GATEWAY_CONNECT_TIMEOUT_SEC
+            ),
+            limits=httpx.Limits(
+                max_connections=GATEWAY_MAX_CONNECTIONS,
+                max_keepalive_connections=GATEWAY_MAX_KEEPALIVE,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._health_task = asyncio.create_task(self._check_health())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def healthy_gateways(self) -> list[str]:
+        # 正常なゲートウェイを先に、外しているものも最後の手段として後ろに並べる
+        now = time.monotonic()
+        return sorted(
+            self.gateways, key=lambda gateway: self._down_until[gateway] > now
+        )
+
+    def _mark_down(self, gateway: str, ex: Exception | str) -> None:
+        self._down_until[gateway] = time.monotonic() + GATEWAY_DOWN_SEC
+        logger.error({"action": "gateway_down", "gateway": gateway, "ex": str(ex)})
+
+    async def _check_health(self) -> None:
+        while True:
+            await asyncio.gather(
+                *(self._check_gateway(gateway) for gateway in self.gateways)
+            )
+            await asyncio.sleep(GATEWAY_HEALTH_INTERVAL_SEC)
+
+    async def _check_gateway(self, gateway: str) -> None:
+        try:
+            response = await self._client.get(
+                f"{gateway}/", timeout=GATEWAY_CONNECT_TIMEOUT_SEC
+            )
+            if response.status_code == 200:
+                self._down_until[gateway] = 0.0
+                return
+            self._mark_down(gateway, f"status {response.status_code}")
+        except httpx.HTTPError as ex:
+            self._mark_down(gateway, ex)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: dict = None,
+        json=None,
+        timeout: float = GATEWAY_TIMEOUT_SEC,
+    ) -> httpx.Response | None:
+        # 接続できなかった場合は次のゲートウェイで送り直す
+        # 送信後の失敗はノードに届いている可能性があるため、GET 以外は送り直さない
+        async with self._semaphore:
+            for gateway in self.healthy_gateways():
+                try:
+                    response = await self._client.request(
+                        method,
+                        f"{gateway}{path}",
+                        params=params,
+                        json=json,
+                        timeout=httpx.Timeout(
+                            timeout, connect=GATEWAY_CONNECT_TIMEOUT_SEC
+                        ),
+                    )
+                except CONNECT_ERRORS as ex:
+                    self._mark_down(gateway, ex)
+                    continue
+                except httpx.HTTPError as ex:
+                    self._mark_down(gateway, ex)
+                    if method == "GET":
+                        continue
+                    return None
+
+                if response.status_code >= 500 and method == "GET":
+                    self._mark_down(gateway, f"status {response.status_code}")
+                    continue
+                return response
+        return None
@@ -0,0 +1,99 @@
+from collections import defaultdict
+
+from mempool import transaction_id
+from models import Block
+
+# 何ブロックごとに索引をストアへ書き出すか
+HISTORY_SAVE_INTERVAL = 100
+HISTORY_PAGE_LIMIT = 100
+
+
+class HistoryIndex:
+    # メインチェーン上のトランザクションの位置 (ブロックの高さ, ブロック内の位置) を
+    # トランザクションIDとアドレスから引けるようにする
+    # どちらの一覧も高さの昇順に並ぶため、巻き戻しは末尾から取り除くだけで済む
+    height: int
+    _transactions: defaultdict[str, list[tuple[int, int]]]
+    _addresses: defaultdict[str, list[tuple[int, int]]]
+
+    def __init__(self) -> None:
+        self.height = 0
+        self._transactions = defaultdict(list)
+        self._addresses = defaultdict(list)
+
+    def apply_block(self, height: int, block: Block) -> None:
+        for index, transaction in enumerate(block.transactions):
+            ref = (height, index)
+            self._transactions[transaction_id(transaction)].append(ref)
+            for address in {
+                transaction.sender_blockchain_address,
+                transaction.recipient_blockchain_address,
+            }:
+                self._addresses[address].append(ref)
+        self.height = height + 1
+
+    def revert_block(self, height: int, block: Block) -> None:
+        # 先端のブロックから順に呼ぶこと
+        for transaction in reversed(block.transactions):
+            self._pop(self._transactions, transaction_id(transaction), height)
+            for address in {
+                transaction.sender_blockchain_address,
+                transaction.recipient_blockchain_address,
+            }:
+                self._pop(self._addresses, address, height)
+        self.height = height
+
+    def _pop(
+        self, refs: defaultdict[str, list[tuple[int, int]]], key: str, height: int
+    ) -> None:
+        if refs[key] and refs[key][-1][0] == height:
+            refs[key].pop()
+        if not refs[key]:
+            del refs[key]
+
+    def rebuild(self, chain: list[Block]) -> None:
+        self.height = 0
+        self._transactions = defaultdict(list)
+        self._addresses = defaultdict(list)
+        for height, block in enumerate(chain):
+            self.apply_block(height, block)
+
+    def locate(self, tx_id: str) -> list[tuple[int, int]]:
+        # IDは署名を含まない内容から作るため、同じ送金や報酬は同じIDになる
+        # どれを指すかは呼び出し元で選べるよう、すべての位置を新しい順に返す
+        return self._transactions.get(tx_id, [])[::-1]
+
+    def address_refs(
+        self, blockchain_address: str, offset: int = 0, limit: int = HISTORY_PAGE_LIMIT
+    ) -> tuple[int, list[tuple[int, int]]]:
+        # 新しい順に offset 件目から limit 件を返す。件数の合計も返す
+        refs = self._addresses.get(blockchain_address, [])
+        end = max(len(refs) - max(offset, 0), 0)
+        start = max(end - max(limit, 0), 0)
+        return len(refs), refs[start:end][::-1]
+
+    def snapshot(self, tip_hash: str) -> dict:
+        # tip_hash はストアの同じ高さのブロックと照合し、巻き戻された後の索引を使わないためのもの
+        return {
+            "height": self.height,
+            "tip_hash": tip_hash,
+            "transactions": self._transactions,
+            "addresses": self._addresses,
+        }
+
+    def restore(self, snapshot: dict) -> None:
+        self.height = snapshot["height"]
+        self._transactions = defaultdict(
+            list,
+            {
+                key: [tuple(ref) for ref in refs]
+                for key, refs in snapshot["transactions"].items()
+            },
+        )
+        self._addresses = defaultdict(
+            list,
+            {
+                key: [tuple(ref) for ref in refs]
+                for key, refs in snapshot["addresses"].items()
+            },
+        )
@@ -0,0 +1,89 @@
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+
+from models import Block, Transaction
+
+# 浮動小数点の誤差で残高がわずかに足りなくなる場合は許す
+BALANCE_TOLERANCE = 1e-9
+
+
+class BalanceIndex:
+    # アドレスごとの確定残高を保持する
+    _balances: defaultdict[str, float]
+
+    def __init__(self) -> None:
+        self._balances = defaultdict(float)
+
+    def apply_block(self, block: Block, sign: int = 1) -> None:
+        for transaction in block.transactions:
+            value = transaction.value * sign
+            self._balances[transaction.recipient_blockchain_address] += value
+            self._balances[transaction.sender_blockchain_address] -= value
+
+    def revert_block(self, block: Block) -> None:
+        # 送金を逆向きに当てて元に戻す。ブロックの内容だけで戻せるため、
+        # ストアから読み込んだブロックも作り直さずに外せる
+        self.apply_block(block, sign=-1)
+
+    def rebuild(
+        self, chain: Iterable[Block], balances: dict[str, float] | None = None
+    ) -> None:
+        # balances を渡した場合は、その残高に chain のブロックを順に適用する
+        self._balances = defaultdict(float, balances or {})
+        for block in chain:
+            self.apply_block(block)
+
+    def balance(self, blockchain_address: str) -> float:
+        return self._balances.get(blockchain_address, 0.0)
+
+    def snapshot(self) -> dict[str, float]:
+        return dict(self._balances)
+
+    def copy(self) -> "BalanceIndex":
+        balance_index = BalanceIndex()
+        balance_index._balances = defaultdict(float, self._balances)
+        return balance_index
+
+
+class BalanceView:
+    # 元の残高を変更せずに、トランザクションを順に当てた後の残高を求める
+    # 変更のあったアドレスだけを持つため、ブロックの検証やマイニングの準備で使い捨てにできる
+    _base: Callable[[str], float]
+    _changes: dict[str, float]
+
+    def __init__(self, base: Callable[[str], float]) -> None:
+        self._base = base
+        self._changes = {}
+
+    def balance(self, blockchain_address: str) -> float:
+        if blockchain_address in self._changes:
+            return self._changes[blockchain_address]
+        return self._base(blockchain_address)
+
+    def can_spend(self, transaction: Transaction) -> bool:
+        return (
+            transaction.value >= 0
+            and self.balance(transaction.sender_blockchain_address) + BALANCE_TOLERANCE
+            >= transaction.value
+        )
+
+    def apply_transaction(self, transaction: Transaction, sign: int = 1) -> None:
+        value = transaction.value * sign
+        recipient = transaction.recipient_blockchain_address
+        sender = transaction.sender_blockchain_address
+        self._changes[recipient] = self.balance(recipient) + value
+        self._changes[sender] = self.balance(sender) - value
+
+    def revert_block(self, block: Block) -> None:
+        for transaction in reversed(block.transactions):
+            self.apply_transaction(transaction, sign=-1)
+
+    def changes(self) -> dict[str, float]:
+        return dict(self._changes)
+
+    def matches(self, balances: dict[str, float]) -> bool:
+        # 残高が 0 のアドレスは、片方にしかなくても一致とみなす
+        return all(
+            abs(self.balance(address) - balances.get(address, 0.0)) <= BALANCE_TOLERANCE
+            for address in self._changes.keys() | balances.keys()
+        )
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+from collections import defaultdict
+
+from models import PendingTransaction, SignedTransaction, Transaction
+
+logger = logging.getLogger(__name__)
+
+MEMPOOL_MAX_SIZE = 10_000
+BLOCK_MAX_TRANSACTIONS = 1_000
+# トランザクションIDに含める送金の内容。ブロック中の公開鍵と署名は含めない
+TRANSACTION_FIELDS = frozenset(Transaction.model_fields)
+
+
+def transaction_id(transaction: Transaction, signature: str | None = None) -> str:
+    sha256 = hashlib.sha256(
+        transaction.model_dump_json(include=TRANSACTION_FIELDS).encode()
+    )
+    if signature:
+        sha256.update(signature.encode())
+    return sha256.hexdigest()
+
+
+def content_key(transaction: SignedTransaction) -> str:
+    # ブロック中のトランザクションは署名を持つため、プールのエントリーと同じIDで照合できる
+    return transaction_id(transaction, transaction.signature)
+
+
+class Mempool:
+    # 未承認トランザクションをIDで管理する。辞書の挿入順がそのまま到着順になる
+    max_size: int
+    _entries: dict[str, PendingTransaction]
+    _by_sender: defaultdict[str, dict[str, None]]
+    _pending_spend: defaultdict[str, float]
+    # 前回 drain_changes を呼んでから変わったエントリー。削除は None で表す
+    _changes: dict[str, PendingTransaction | None]
+    _cleared: bool
+
+    def __init__(self, max_size: int = MEMPOOL_MAX_SIZE) -> None:
+        self.max_size = max_size
+        self._entries = {}
+        self._by_sender = defaultdict(dict)
+        # 送信者ごとの未確定の送金額の合計。残高確認のたびに合計し直さない
+        self._pending_spend = defaultdict(float)
+        self._changes = {}
+        self._cleared = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._entries
+
+    def entries(self) -> list[PendingTransaction]:
+        return list(self._entries.values())
+
+    def transactions(self) -> list[SignedTransaction]:
+        # ブロックにそのまま含められるよう、公開鍵と署名を付けた形で返す
+        return [entry.signed() for entry in self._entries.values()]
+
+    def add(self, entry: PendingTransaction) -> str | None:
+        # 追加できた場合はIDを返し、重複や上限超過で追加しなかった場合は None を返す
+        tx_id = transaction_id(entry.transaction, entry.signature)
+        if tx_id in self._entries:
+            return None
+
+        sender = entry.transaction.sender_blockchain_address
+        if len(self._entries) >= self.max_size and not self._evict_for(sender):
+            logger.error({"action": "mempool_add", "error": "full", "sender": sender})
+            return None
+
+        self._entries[tx_id] = entry
+        self._by_sender[sender][tx_id] = None
+        self._pending_spend[sender] += entry.transaction.value
+        self._changes[tx_id] = entry
+        return tx_id
+
+    def _evict_for(self, sender: str) -> bool:
+        # 一番多くのトランザクションを溜めている送信者の最新のものを追い出す
+        # 新しいトランザクションの送信者自身がそうであれば追加しない
+        if not self._by_sender:
+            return False
+        largest_sender = max(self._by_sender, key=lambda s: len(self._by_sender[s]))
+        if len(self._by_sender[sender]) >= len(self._by_sender[largest_sender]):
+            return False
+        newest_tx_id = next(reversed(self._by_sender[largest_sender]))
+        self.remove(newest_tx_id)
+        return True
+
+    def remove(self, tx_id: str) -> PendingTransaction | None:
+        entry = self._entries.pop(tx_id, None)
+        if entry is None:
+            return None
+
+        sender = entry.transaction.sender_blockchain_address
+        del self._by_sender[sender][tx_id]
+        self._pending_spend[sender] -= entry.transaction.value
+        if not self._by_sender[sender]:
+            del self._by_sender[sender]
+            del self._pending_spend[sender]
+
+        self._changes[tx_id] = None
+        return entry
+
+    def remove_transactions(self, transactions: list[SignedTransaction]) -> None:
+        # ブロックに含まれたトランザクションを、署名まで同じエントリーだけ取り除く
+        for transaction in transactions:
+            self.remove(content_key(transaction))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_sender.clear()
+        self._pending_spend.clear()
+        self._changes.clear()
+        self._cleared = True
+
+    def drain_changes(self) -> tuple[bool, dict[str, PendingTransaction | None]]:
+        # 空にされたかどうかと、その後に変わったエントリーを返して記録をリセットする
+        cleared, changes = self._cleared, self._changes
+        self._cleared = False
+        self._changes = {}
+        return cleared, changes
+
+    def entries_by_id(self) -> dict[str, PendingTransaction]:
+        return dict(self._entries)
+
+    def pending_spend(self, blockchain_address: str) -> float:
+        return self._pending_spend.get(blockchain_address, 0.0)
@@ -0,0 +1,74 @@
+import hashlib
+
+from models import BlockHeader, Transaction
+
+# 葉と内部ノードを区別するため、内部ノードは先頭に1バイト付けてハッシュする
+NODE_PREFIX = b"\x01"
+EMPTY_ROOT = hashlib.sha256(b"").hexdigest()
+
+
+def header_hash(header: BlockHeader) -> str:
+    # ブロックのハッシュはヘッダーだけから求める
+    # PoW もタイムスタンプを含めたこのハッシュに対して行い、中継で時刻を書き換えさせない
+    return hashlib.sha256(header.model_dump_json().encode()).hexdigest()
+
+
+def _parent(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def merkle_leaf(transaction: Transaction) -> str:
+    # 葉は公開鍵と署名も含めたトランザクション全体のハッシュ
+    # ブロックのハッシュが署名まで固定するため、中継で署名を差し替えられない
+    return hashlib.sha256(transaction.model_dump_json().encode()).hexdigest()
+
+
+def _levels(transactions: list[Transaction]) -> list[list[bytes]]:
+    # 奇数個の段では最後のノードを複製せずにそのまま上の段へ上げる
+    level = [bytes.fromhex(merkle_leaf(t)) for t in transactions]
+    levels = [level]
+    while len(level) > 1:
+        level = [
+            _parent(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+        levels.append(level)
+    return levels
+
+
+def merkle_root(transactions: list[Transaction]) -> str:
+    if not transactions:
+        return EMPTY_ROOT
+    return _levels(transactions)[-1][0].hex()
+
+
+def merkle_proof(transactions: list[Transaction], index: int) -> list[dict]:
+    # 葉から根までの兄弟ノードを下から順に並べる
+    proof = []
+    for level in _levels(transactions)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(
+                {
+                    "hash": level[sibling].hex(),
+                    "position": "left" if sibling < index else "right",
+                }
+            )
+        index //= 2
+    return proof
+
+
+def verify_merkle_proof(tx_id: str, proof: list[dict], root: str) -> bool:
+    try:
+        node = bytes.fromhex(tx_id)
+        for step in proof:
+            sibling = bytes.fromhex(step["hash"])
+            if step["position"] == "left":
+                node = _parent(sibling, node)
+            elif step["position"] == "right":
+                node = _parent(node, sibling)
+            else:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return node.hex() == root
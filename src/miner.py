@@ -0,0 +1,261 @@
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from difficulty import proof_target
+from merkle import merkle_root
+from models import BlockHeader, Transaction
+
+logger = logging.getLogger(__name__)
+
+# ワーカーが停止フラグを確認する間隔(nonceの試行回数)
+MINING_CHECK_INTERVAL = 2_000
+# キャンセル要求を確認する間隔
+MINING_CANCEL_POLL_SEC = 0.005
+
+NONCE_PREFIX = b'"nonce":'
+NONCE_SUFFIX = b',"previous_hash":'
+NONCE_SEPARATOR = NONCE_PREFIX + b"0" + NONCE_SUFFIX
+
+_stop_event = None
+
+
+class ProofTemplate:
+    # ヘッダーのシリアライズ結果を nonce の前後で分割して保持する
+    # prefix までの SHA-256 の状態をコピーして使い回す
+    # ヘッダーはマークルルートだけを含むため、長さはトランザクション数に依存しない
+    prefix: bytes
+    suffix: bytes
+
+    def __init__(self, prefix: bytes, suffix: bytes) -> None:
+        self.prefix = prefix
+        self.suffix = suffix
+        self._prefix_state = hashlib.sha256(prefix)
+
+    @classmethod
+    def from_header(cls, header: BlockHeader) -> "ProofTemplate":
+        # merkle.header_hash と同じヘッダーを nonce を 0 にして一度だけシリアライズする
+        serialized = header.model_copy(update={"nonce": 0}).model_dump_json().encode()
+        head, separator, tail = serialized.rpartition(NONCE_SEPARATOR)
+        if not separator:
+            raise ValueError("nonce field not found in serialized header")
+        return cls(
+            prefix=head + NONCE_PREFIX,
+            suffix=NONCE_SUFFIX + tail,
+        )
+
+    def hash(self, nonce: int) -> str:
+        sha256 = self._prefix_state.copy()
+        sha256.update(str(nonce).encode() + self.suffix)
+        return sha256.hexdigest()
+
+
+def _init_worker(stop_event) -> None:
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search_nonce(
+    prefix: bytes,
+    suffix: bytes,
+    difficulty: int,
+    start: int,
+    step: int,
+) -> tuple[int | None, int]:
+    # start, start + step, start + 2 * step ... の順に試す
+    # 見つかった nonce と試行回数を返す
+    template = ProofTemplate(prefix, suffix)
+    target = proof_target(difficulty)
+    nonce = start
+    tries = 0
+    while not _stop_event.is_set():
+        for _ in range(MINING_CHECK_INTERVAL):
+            tries += 1
+            if template.hash(nonce) < target:
+                _stop_event.set()
+                return nonce, tries
+            nonce += step
+    return None, tries
+
+
+class MiningJob:
+    transactions: list[Transaction]
+    merkle_root: str
+    previous_hash: str
+    difficulty: int
+    # PoW はタイムスタンプも含めたヘッダーに対して行うため、探索の前に決めておく
+    timestamp: float
+    hashes: int
+    _cancel_event: threading.Event
+
+    def __init__(
+        self,
+        transactions: list[Transaction],
+        previous_hash: str,
+        difficulty: int,
+        timestamp: float = None,
+    ) -> None:
+        self.transactions = transactions
+        self.merkle_root = merkle_root(transactions)
+        self.previous_hash = previous_hash
+        self.difficulty = difficulty
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.hashes = 0
+        self._cancel_event = threading.Event()
+
+    def header(self, nonce: int = 0) -> BlockHeader:
+        return BlockHeader(
+            timestamp=self.timestamp,
+            merkle_root=self.merkle_root,
+            nonce=nonce,
+            previous_hash=self.previous_hash,
+            difficulty=self.difficulty,
+        )
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+
+class MiningMetrics:
+    hashes: int
+    wasted_hashes: int
+    mined_blocks: int
+    aborted_jobs: int
+
+    def __init__(self) -> None:
+        self.hashes = 0
+        self.wasted_hashes = 0
+        self.mined_blocks = 0
+        self.aborted_jobs = 0
+        self._lock = threading.Lock()
+
+    def record(self, job: MiningJob, mined: bool) -> None:
+        with self._lock:
+            self.hashes += job.hashes
+            if mined:
+                self.mined_blocks += 1
+            else:
+                self.wasted_hashes += job.hashes
+                self.aborted_jobs += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "hashes": self.hashes,
+                "wasted_hashes": self.wasted_hashes,
+                "mined_blocks": self.mined_blocks,
+                "aborted_jobs": self.aborted_jobs,
+            }
+
+
+class MiningEngine(ABC):
+    @abstractmethod
+    def search(self, job: MiningJob) -> int | None:
+        # job がキャンセルされた場合は None を返す
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class SerialMiningEngine(MiningEngine):
+    def search(self, job: MiningJob) -> int | None:
+        template = ProofTemplate.from_header(job.header())
+        target = proof_target(job.difficulty)
+        nonce = 0
+        while not job.cancelled:
+            for _ in range(MINING_CHECK_INTERVAL):
+                if template.hash(nonce) < target:
+                    job.hashes += nonce + 1
+                    return nonce
+                nonce += 1
+        job.hashes += nonce
+        return None
+
+
+class ProcessPoolMiningEngine(MiningEngine):
+    workers: int
+    _executor: ProcessPoolExecutor | None
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self._stop_event,),
+            )
+        return self._executor
+
+    def search(self, job: MiningJob) -> int | None:
+        executor = self._get_executor()
+        template = ProofTemplate.from_header(job.header())
+        self._stop_event.clear()
+        futures = [
+            executor.submit(
+                _search_nonce,
+                template.prefix,
+                template.suffix,
+                job.difficulty,
+                start,
+                self.workers,
+            )
+            for start in range(self.workers)
+        ]
+
+        nonce = None
+        pending = set(futures)
+        try:
+            while nonce is None and pending and not job.cancelled:
+                done, pending = wait(
+                    pending,
+                    timeout=MINING_CANCEL_POLL_SEC,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    found, _ = future.result()
+                    if found is not None:
+                        nonce = found
+                        break
+        finally:
+            # 見つかった時点またはキャンセル時に全ワーカーを止め、終了を待つ
+            self._stop_event.set()
+            wait(futures)
+            job.hashes += sum(
+                future.result()[1] for future in futures if not future.exception()
+            )
+
+        logger.info(
+            {
+                "action": "search",
+                "workers": self.workers,
+                "nonce": nonce,
+                "cancelled": job.cancelled,
+            }
+        )
+        return nonce
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def create_mining_engine(workers: int | None) -> MiningEngine:
+    if workers is None or workers <= 1:
+        return SerialMiningEngine()
+    return ProcessPoolMiningEngine(workers)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class Transaction(BaseModel):
@@ -7,11 +7,91 @@ class Transaction(BaseModel):
     value: float
 
 
+class SignedTransaction(Transaction):
+    # ブロックに含めるトランザクション。公開鍵と署名もマークルルートに含め、
+    # ブロックを受け取ったノードが送信者の署名を確かめられるようにする
+    # マイニング報酬は署名を持たない
+    sender_public_key: str | None = None
+    signature: str | None = None
+
+    def unsigned(self) -> Transaction:
+        # 署名の対象になる送金の内容
+        return Transaction(
+            sender_blockchain_address=self.sender_blockchain_address,
+            recipient_blockchain_address=self.recipient_blockchain_address,
+            value=self.value,
+        )
+
+
+class BlockHeader(BaseModel):
+    timestamp: float
+    merkle_root: str
+    nonce: int
+    previous_hash: str
+    difficulty: int
+
+
 class Block(BaseModel):
     timestamp: float
-    transactions: list[Transaction]
+    transactions: list[SignedTransaction]
     nonce: int
     previous_hash: str
+    # トランザクションのマークルルート。ブロックのハッシュと PoW はヘッダーだけから求める
+    merkle_root: str
+    # PoW のハッシュ値の先頭に並ぶ 0 のビット数
+    difficulty: int
+    # チェーンに追加されたブロックは変更されないため、計算したハッシュ値を保持しておく
+    _hash: str | None = PrivateAttr(default=None)
+
+    def header(self) -> BlockHeader:
+        return BlockHeader(
+            timestamp=self.timestamp,
+            merkle_root=self.merkle_root,
+            nonce=self.nonce,
+            previous_hash=self.previous_hash,
+            difficulty=self.difficulty,
+        )
+
+
+class PendingTransaction(BaseModel):
+    # プールに保持するトランザクション。ブロックから戻したものも、ブロックにあった公開鍵と署名を持つ
+    transaction: Transaction
+    sender_public_key: str | None = None
+    signature: str | None = None
+    # ブロックに含める形は何度も参照されるため、一度だけ作って保持しておく
+    _signed: SignedTransaction | None = PrivateAttr(default=None)
+
+    def signed(self) -> SignedTransaction:
+        if self._signed is None:
+            self._signed = SignedTransaction(
+                **self.transaction.model_dump(),
+                sender_public_key=self.sender_public_key,
+                signature=self.signature,
+            )
+        return self._signed
+
+
+class PrefilledTransaction(BaseModel):
+    index: int
+    transaction: SignedTransaction
+
+
+class CompactBlock(BaseModel):
+    # 新しいブロックの通知。トランザクションは受信側のプールにあると見込んで短いIDだけを送り、
+    # プールにないマイニング報酬などは位置と本体をそのまま送る
+    header: BlockHeader
+    height: int
+    # 通知を送ったノード。足りないトランザクションはここに問い合わせる
+    node: str
+    short_ids: list[str]
+    prefilled: list[PrefilledTransaction]
+
+
+class StateSnapshot(BaseModel):
+    # height のブロックまでを適用した残高と、そのブロックのハッシュ
+    height: int
+    block_hash: str
+    balances: dict[str, float]
 
 
 class BlockChainCache(BaseModel):
@@ -0,0 +1,209 @@
+import logging
+import queue
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from models import Block, StateSnapshot
+from wire import (
+    MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    STATE_MEDIA_TYPE,
+    decode_state_snapshot,
+    iter_decode_blocks,
+)
+
+logger = logging.getLogger(__name__)
+
+PEER_TIMEOUT_SEC = 3
+PEER_RETRIES = 2
+PEER_RETRY_BACKOFF_SEC = 0.5
+PEER_WORKERS = 8
+PEER_BACKLOG_SIZE = 1000
+# ノードごとに保持しておく接続数
+PEER_POOL_MAXSIZE = 4
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class PeerClient:
+    # 近隣ノードへの通信をまとめるクライアント
+    # 送信はキューに積んでワーカースレッドが並行に処理するため、呼び出し元はすぐに戻る
+    timeout: float
+    retries: int
+    _backlog: queue.Queue
+
+    def __init__(
+        self,
+        workers: int = PEER_WORKERS,
+        timeout: float = PEER_TIMEOUT_SEC,
+        retries: int = PEER_RETRIES,
+        backlog_size: int = PEER_BACKLOG_SIZE,
+    ) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self._backlog = queue.Queue(maxsize=backlog_size)
+        self._local = threading.local()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="peer-query"
+        )
+
+    def _session(self) -> requests.Session:
+        # requests.Session はスレッド間で共有しないため、スレッドごとに持つ
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=PEER_POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def _start_workers(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"peer-client-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            method, node, path, body = self._backlog.get()
+            try:
+                self.request(method, node, path, json=body)
+            finally:
+                self._backlog.task_done()
+
+    def request(
+        self,
+        method: str,
+        node: str,
+        path: str,
+        params: dict = None,
+        json: dict = None,
+        headers: dict = None,
+        stream: bool = False,
+    ) -> requests.Response | None:
+        # 接続エラーや5xxは少し待ってから再送する
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._session().request(
+                    method,
+                    f"http://{node}{path}",
+                    params=params,
+                    json=json,
+                    headers=headers,
+                    stream=stream,
+                    timeout=self.timeout,
+                )
+                if response.status_code < 500:
+                    return response
+            except requests.RequestException as ex:
+                logger.error(
+                    {
+                        "action": "peer_request",
+                        "node": node,
+                        "path": path,
+                        "attempt": attempt,
+                        "ex": str(ex),
+                    }
+                )
+            if attempt < self.retries:
+                time.sleep(PEER_RETRY_BACKOFF_SEC * (attempt + 1))
+        return None
+
+    def get_json(self, node: str, path: str, params: dict = None) -> dict | None:
+        response = self.request("GET", node, path, params=params)
+        if response is None or response.status_code != 200:
+            return None
+        return response.json()
+
+    def get_state_snapshot(self, node: str) -> StateSnapshot | None:
+        response = self.request(
+            "GET", node, "/state/snapshot", headers={"Accept": STATE_MEDIA_TYPE}
+        )
+        if response is None or response.status_code != 200:
+            return None
+        try:
+            return decode_state_snapshot(response.content)
+        except ValueError as ex:
+            logger.error({"action": "get_state_snapshot", "node": node, "ex": str(ex)})
+            return None
+
+    def iter_blocks(
+        self, node: str, path: str, params: dict = None
+    ) -> Iterator[Block] | None:
+        # バイナリ形式を優先して要求し、届いた順にブロックを返す
+        # 対応していないノードからは NDJSON か JSON で受け取る
+        response = self.request(
+            "GET",
+            node,
+            path,
+            params=params,
+            headers={"Accept": f"{MEDIA_TYPE}, {NDJSON_MEDIA_TYPE};q=0.9"},
+            stream=True,
+        )
+        if response is None:
+            return None
+        if response.status_code != 200:
+            response.close()
+            return None
+        return self._iter_response_blocks(node, response)
+
+    def _iter_response_blocks(
+        self, node: str, response: requests.Response
+    ) -> Iterator[Block]:
+        content_type = response.headers.get("content-type", "")
+        with response:
+            try:
+                if content_type.startswith(MEDIA_TYPE):
+                    yield from iter_decode_blocks(
+                        response.iter_content(STREAM_CHUNK_SIZE)
+                    )
+                elif content_type.startswith(NDJSON_MEDIA_TYPE):
+                    for line in response.iter_lines():
+                        if line:
+                            yield Block.model_validate_json(line)
+                else:
+                    response_json = response.json()
+                    blocks = response_json.get("blocks", response_json.get("chain"))
+                    for block in blocks:
+                        yield Block.model_validate(block)
+            except (requests.RequestException, ValueError) as ex:
+                # 途中で切れた場合はそこまでに届いたブロックだけを使う
+                logger.error({"action": "iter_blocks", "node": node, "ex": str(ex)})
+
+    def gather_json(
+        self, nodes: list[str], path: str, params: dict = None
+    ) -> dict[str, dict | None]:
+        # 全ノードに並行に問い合わせ、ノードごとの結果を返す
+        results = self._executor.map(
+            lambda node: self.get_json(node, path, params=params), nodes
+        )
+        return dict(zip(nodes, results))
+
+    def broadcast(
+        self, nodes: list[str], method: str, path: str, json: dict = None
+    ) -> None:
+        self._start_workers()
+        for node in nodes:
+            try:
+                self._backlog.put_nowait((method, node, path, json))
+            except queue.Full:
+                logger.error(
+                    {"action": "broadcast", "error": "backlog_full", "node": node}
+                )
+
+    def join(self) -> None:
+        # キューに積んだ送信がすべて終わるまで待つ
+        self._backlog.join()
@@ -0,0 +1,76 @@
+from collections.abc import Iterable
+
+from mempool import content_key
+from models import (
+    Block,
+    BlockHeader,
+    CompactBlock,
+    PrefilledTransaction,
+    SignedTransaction,
+)
+
+# 短いIDの長さ(16進数の文字数)。48ビットあれば1ブロック分の照合で衝突はまず起きない
+# 衝突した場合はマークルルートが合わなくなるため、送信元からブロック全体を同期し直す
+SHORT_ID_LENGTH = 12
+
+RELAY_ACCEPTED = "accepted"
+RELAY_KNOWN = "known"
+# 送信元からの同期を別のスレッドに任せた
+RELAY_QUEUED = "queued"
+RELAY_REJECTED = "rejected"
+
+
+def short_id(transaction: SignedTransaction) -> str:
+    # 内容と署名から求める。同じ内容でも署名の異なるプールのエントリーとは区別する
+    return content_key(transaction)[:SHORT_ID_LENGTH]
+
+
+def compact_block(
+    block: Block, height: int, node: str, prefilled: Iterable[int]
+) -> CompactBlock:
+    # prefilled の位置のトランザクションだけ本体を送り、残りは短いIDにする
+    prefilled = set(prefilled)
+    return CompactBlock(
+        header=block.header(),
+        height=height,
+        node=node,
+        short_ids=[
+            short_id(transaction)
+            for index, transaction in enumerate(block.transactions)
+            if index not in prefilled
+        ],
+        prefilled=[
+            PrefilledTransaction(index=index, transaction=block.transactions[index])
+            for index in sorted(prefilled)
+        ],
+    )
+
+
+def reconstruct_transactions(
+    compact: CompactBlock, pool: Iterable[SignedTransaction]
+) -> tuple[list[SignedTransaction | None], list[int]]:
+    # プールのトランザクションでブロックのトランザクションを並べ、見つからなかった位置を返す
+    transactions = [None] * (len(compact.short_ids) + len(compact.prefilled))
+    for prefilled in compact.prefilled:
+        if (
+            not 0 <= prefilled.index < len(transactions)
+            or transactions[prefilled.index] is not None
+        ):
+            raise ValueError("invalid prefilled index")
+        transactions[prefilled.index] = prefilled.transaction
+
+    candidates = {short_id(transaction): transaction for transaction in pool}
+    short_ids = iter(compact.short_ids)
+    missing = []
+    for index, transaction in enumerate(transactions):
+        if transaction is not None:
+            continue
+        transaction = candidates.get(next(short_ids))
+        if transaction is None:
+            missing.append(index)
+        transactions[index] = transaction
+    return transactions, missing
+
+
+def assemble_block(header: BlockHeader, transactions: list[SignedTransaction]) -> Block:
+    return Block(transactions=transactions, **header.model_dump())
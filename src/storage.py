@@ -0,0 +1,547 @@
+import json
+import logging
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator, Sequence
+from typing import BinaryIO
+
+from pydantic import TypeAdapter
+
+from mempool import transaction_id
+from merkle import header_hash
+from models import Block, PendingTransaction, StateSnapshot
+from wire import decode_state_snapshot, encode_state_snapshot
+
+logger = logging.getLogger(__name__)
+
+BLOCKS_FILE = "blocks.ndjson"
+INDEX_FILE = "blocks.idx"
+POOL_FILE = "pool.ndjson"
+# 以前のバージョンがプール全体を書き出していたファイル
+LEGACY_POOL_FILE = "pool.json"
+HISTORY_FILE = "history.json"
+STATE_FILE = "state.bin"
+CHECKPOINT_FILE = "checkpoint.bin"
+PREFIX_SUFFIX = ".prefix"
+
+# インデックスには各ブロックの先頭オフセット、ハッシュ値、タイムスタンプと難易度を固定長で並べる
+# 起動時の累積ワークや難易度の計算にブロック本体を読まなくて済む
+INDEX_ENTRY = struct.Struct("<Q32sdB")
+BLOCK_CACHE_SIZE = 256
+# truncate で外したブロックの行はファイルに残し、その後ろにこの行を書いて外した高さを記録する
+# 起動時にインデックスより後ろの行を取り込む際、外したブロックを取り込まないために使う
+TRUNCATE_RECORD_PREFIX = b'{"truncate":'
+# 1ブロックを読むときの最初の読み込みサイズと、連続して読むときの読み込み単位
+LINE_READ_SIZE = 64 * 1024
+ITER_READ_SIZE = 1024 * 1024
+# プールのログの行数が残っているエントリーの倍とこの数を越えたら書き直す
+POOL_LOG_COMPACT_MIN = 1_000
+
+pending_list_adapter = TypeAdapter(list[PendingTransaction])
+
+
+def _read_line(blocks_file: BinaryIO, offset: int, size: int) -> bytes:
+    # size は行の長さの見込み。外したブロックの行が後ろに続いていることがあるため改行で切る
+    data = b""
+    while True:
+        chunk = os.pread(blocks_file.fileno(), max(size, 1), offset + len(data))
+        if not chunk:
+            raise ValueError("unterminated block line")
+        end = chunk.find(b"\n")
+        if end >= 0:
+            return data + chunk[: end + 1]
+        data += chunk
+        size = LINE_READ_SIZE
+
+
+def _iter_lines(positions: Iterable[tuple[BinaryIO, int]]) -> Iterator[bytes]:
+    # (ファイル, オフセット) の順に1行ずつ読む。続いている行はまとめて読み込む
+    current = None
+    buffer = b""
+    # buffer の先頭のファイル上のオフセット
+    base = 0
+    for blocks_file, offset in positions:
+        if blocks_file is not current or not base <= offset <= base + len(buffer):
+            current, buffer, base = blocks_file, b"", offset
+        position = offset - base
+        end = buffer.find(b"\n", position)
+        while end < 0:
+            chunk = os.pread(current.fileno(), ITER_READ_SIZE, base + len(buffer))
+            if not chunk:
+                return
+            buffer = buffer[position:] + chunk
+            base += position
+            position = 0
+            end = buffer.find(b"\n")
+        yield buffer[position : end + 1]
+
+
+class StoreGeneration:
+    # truncate と swap_prefix で書き換える前のインデックスを、読み取り中のビューのために残す
+    # 書き換えた時点で truncated_at 以降の古いエントリーを tail に移し、next に次の世代をつなぐ
+    # どのビューからも参照されなくなった世代は、元のファイルと一緒に解放される
+    blocks_file: BinaryIO
+    truncated_at: int | None
+    tail: tuple[array, list[bytes], array, array] | None
+    next: "StoreGeneration | None"
+
+    def __init__(self, blocks_file: BinaryIO) -> None:
+        self.blocks_file = blocks_file
+        self.truncated_at = None
+        self.tail = None
+        self.next = None
+
+
+class BlockStore(Sequence):
+    # ブロックを1行1ブロックのJSONとして追記していくストア
+    # 起動時はオフセットのインデックスだけを読み込み、ブロック本体は参照時に読む
+    directory: str
+    _offsets: array
+    _hashes: list[bytes]
+    _timestamps: array
+    _difficulties: array
+    # ファイルの末尾。truncate で外したブロックの行も含む
+    _size: int
+    # 今のファイルのオフセットごとのブロック。オフセットは書き換えないため巻き戻しても消さない
+    _cache: OrderedDict[int, Block]
+    # ロックを取らないビューの読み取りスレッドと書き込み側の両方がキャッシュを更新する
+    _cache_lock: threading.Lock
+    _generation: StoreGeneration
+    # write_prefix で書き出したファイルの各行のオフセットとサイズ
+    _prefix: tuple[array, int] | None
+    # プールのログに書いた行数
+    pool_records: int
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._blocks_path = os.path.join(directory, BLOCKS_FILE)
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        self._pool_path = os.path.join(directory, POOL_FILE)
+        self._legacy_pool_path = os.path.join(directory, LEGACY_POOL_FILE)
+        self._history_path = os.path.join(directory, HISTORY_FILE)
+        self._state_path = os.path.join(directory, STATE_FILE)
+        self._checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+        self._prefix_path = self._blocks_path + PREFIX_SUFFIX
+        self._prefix = None
+        self.pool_records = 0
+
+        self._blocks_file = open(self._blocks_path, "a+b")
+        self._index_file = open(self._index_path, "a+b")
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._generation = StoreGeneration(self._blocks_file)
+        self._recover()
+
+    def _recover(self) -> None:
+        self._size = os.path.getsize(self._blocks_path)
+        with open(self._index_path, "rb") as f:
+            data = f.read()
+        data = data[: len(data) - len(data) % INDEX_ENTRY.size]
+        entries = list(INDEX_ENTRY.iter_unpack(data))
+        offsets = array("Q", (entry[0] for entry in entries))
+        hashes = [entry[1] for entry in entries]
+        timestamps = array("d", (entry[2] for entry in entries))
+        difficulties = array("B", (entry[3] for entry in entries))
+        columns = (offsets, hashes, timestamps, difficulties)
+
+        # インデックスより後ろにデータが残っていれば、完全な行だけ取り込み途中の行は捨てる
+        while offsets and offsets[-1] >= self._size:
+            for column in columns:
+                column.pop()
+        position = 0
+        if offsets:
+            position = offsets[-1]
+            for column in columns:
+                column.pop()
+        with open(self._blocks_path, "rb") as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if line.startswith(TRUNCATE_RECORD_PREFIX):
+                    height = json.loads(line)["truncate"]
+                    for column in columns:
+                        del column[height:]
+                    position += len(line)
+                    continue
+                block = Block.model_validate_json(line)
+                offsets.append(position)
+                hashes.append(bytes.fromhex(header_hash(block.header())))
+                timestamps.append(block.timestamp)
+                difficulties.append(block.difficulty)
+                position += len(line)
+
+        if position != self._size:
+            logger.error(
+                {"action": "recover", "truncated_bytes": self._size - position}
+            )
+            self._blocks_file.truncate(position)
+            self._size = position
+        self._offsets = offsets
+        self._hashes = hashes
+        self._timestamps = timestamps
+        self._difficulties = difficulties
+        self._write_index()
+
+    def _write_index(self) -> None:
+        self._index_file.truncate(0)
+        self._index_file.write(
+            b"".join(
+                map(
+                    INDEX_ENTRY.pack,
+                    self._offsets,
+                    self._hashes,
+                    self._timestamps,
+                    self._difficulties,
+                )
+            )
+        )
+        self._index_file.flush()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+        offset = self._offsets[index]
+        end = self._offsets[index + 1] if index + 1 < len(self) else self._size
+        return self._load(self._blocks_file, offset, self._hashes[index], end - offset)
+
+    def __iter__(self) -> Iterator[Block]:
+        return self.iter_range()
+
+    def _load(
+        self, blocks_file: BinaryIO, offset: int, block_hash: bytes, size: int
+    ) -> Block:
+        # size は行の長さの見込み。今のファイルのブロックだけをキャッシュする
+        with self._cache_lock:
+            if blocks_file is self._blocks_file and offset in self._cache:
+                self._cache.move_to_end(offset)
+                return self._cache[offset]
+        # ファイルの読み込みと解析はロックの外で行う
+        block = Block.model_validate_json(_read_line(blocks_file, offset, size))
+        block._hash = block_hash.hex()
+        with self._cache_lock:
+            # 読んでいる間に swap_prefix でファイルが替わっていればキャッシュしない
+            if blocks_file is self._blocks_file:
+                self._cache[offset] = block
+                if len(self._cache) > BLOCK_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return block
+
+    def iter_lines(self, start: int = 0, stop: int | None = None) -> Iterator[bytes]:
+        # 範囲の先頭から、続いている行はまとめて読む
+        blocks_file = self._blocks_file
+        return _iter_lines(
+            (blocks_file, offset) for offset in self._offsets[start:stop]
+        )
+
+    def iter_range(self, start: int = 0, stop: int | None = None) -> Iterator[Block]:
+        hashes = self._hashes[start:stop]
+        for block_hash, line in zip(hashes, self.iter_lines(start, stop)):
+            block = Block.model_validate_json(line)
+            block._hash = block_hash.hex()
+            yield block
+
+    def hash_at(self, index: int) -> str:
+        return self._hashes[index].hex()
+
+    def timestamp_at(self, index: int) -> float:
+        return self._timestamps[index]
+
+    def difficulty_at(self, index: int) -> int:
+        return self._difficulties[index]
+
+    def view(self, length: int | None = None) -> "StoreView":
+        # 先頭 length 個のブロックを、この後の truncate や swap_prefix の影響を受けずに読むビュー
+        return StoreView(
+            self, self._generation, len(self) if length is None else length
+        )
+
+    def append(self, block: Block) -> None:
+        self.extend([block])
+
+    def extend(self, blocks: list[Block]) -> None:
+        # 本体をまとめて書いて1回だけ fsync し、その後でインデックスを伸ばす
+        entries = []
+        for block in blocks:
+            serialized = block.model_dump_json().encode() + b"\n"
+            block_hash = bytes.fromhex(header_hash(block.header()))
+            self._blocks_file.write(serialized)
+            entries.append((block, block_hash, len(serialized)))
+        if not entries:
+            return
+        self._blocks_file.flush()
+        os.fsync(self._blocks_file.fileno())
+
+        for block, block_hash, size in entries:
+            self._index_file.write(
+                INDEX_ENTRY.pack(
+                    self._size, block_hash, block.timestamp, block.difficulty
+                )
+            )
+            block._hash = block_hash.hex()
+            self._offsets.append(self._size)
+            self._hashes.append(block_hash)
+            self._timestamps.append(block.timestamp)
+            self._difficulties.append(block.difficulty)
+            self._size += size
+        self._index_file.flush()
+
+    def write_prefix(self, blocks: Iterable[Block]) -> None:
+        # チェーンの先頭から置き換えるブロックを別のファイルに書き出す
+        # ハッシュが今のブロックと同じことは呼び出し元で確認しておく
+        # 書き出している間もストアはそのまま読み書きできる
+        offsets = array("Q")
+        position = 0
+        try:
+            with open(self._prefix_path, "wb") as f:
+                for block in blocks:
+                    line = block.model_dump_json().encode() + b"\n"
+                    f.write(line)
+                    offsets.append(position)
+                    position += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(self._prefix_path)
+            raise
+        self._prefix = (offsets, position)
+
+    def swap_prefix(self) -> None:
+        # write_prefix で書き出したブロックに、それより後ろのブロックを続けてファイルを差し替える
+        # 外したブロックの行は書き出さない
+        # 差し替える前のファイルは閉じず、それを読んでいるビューが無くなったときに解放する
+        offsets, position = self._prefix
+        with open(self._prefix_path, "ab") as f:
+            for line in self.iter_lines(len(offsets)):
+                offsets.append(position)
+                position += len(line)
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._prefix_path, self._blocks_path)
+        blocks_file = open(self._blocks_path, "a+b")
+        self._next_generation(0, blocks_file)
+        with self._cache_lock:
+            self._blocks_file = blocks_file
+            self._cache = OrderedDict()
+        self._offsets = offsets
+        self._size = position
+        self._prefix = None
+        self._write_index()
+
+    def truncate(self, height: int) -> None:
+        # height 番目以降のブロックを外す
+        # ファイルは切り詰めずに外したことだけを追記するため、外したブロックのオフセットは
+        # 書き換わらず、巻き戻す前のビューはそのまま読み続けられる
+        if height >= len(self):
+            return
+        record = TRUNCATE_RECORD_PREFIX + str(height).encode() + b"}\n"
+        self._blocks_file.write(record)
+        self._blocks_file.flush()
+        self._size += len(record)
+        self._next_generation(height, self._blocks_file)
+        del self._offsets[height:]
+        del self._hashes[height:]
+        del self._timestamps[height:]
+        del self._difficulties[height:]
+        self._index_file.truncate(height * INDEX_ENTRY.size)
+
+    def _next_generation(self, height: int, blocks_file: BinaryIO) -> None:
+        # height 以降の今のエントリーを世代に残してから、インデックスを書き換える
+        generation = self._generation
+        generation.tail = (
+            self._offsets[height:],
+            self._hashes[height:],
+            self._timestamps[height:],
+            self._difficulties[height:],
+        )
+        generation.next = StoreGeneration(blocks_file)
+        # ビューは truncated_at を見てから tail と next を読むため、最後に設定する
+        generation.truncated_at = height
+        self._generation = generation.next
+
+    def load_pool(self) -> list[PendingTransaction]:
+        # 追加と削除を1行ずつ記録したログを先頭から当て直す
+        if not os.path.exists(self._pool_path):
+            return self._load_legacy_pool()
+        entries = {}
+        records = 0
+        with open(self._pool_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 書き込み途中で止まった行
+                    break
+                record = json.loads(line)
+                if record.get("entry") is None:
+                    entries.pop(record["id"], None)
+                else:
+                    entries[record["id"]] = PendingTransaction.model_validate(
+                        record["entry"]
+                    )
+                records += 1
+        self.pool_records = records
+        return list(entries.values())
+
+    def _load_legacy_pool(self) -> list[PendingTransaction]:
+        if not os.path.exists(self._legacy_pool_path):
+            return []
+        with open(self._legacy_pool_path, "rb") as f:
+            entries = pending_list_adapter.validate_json(f.read())
+        self.save_pool({transaction_id(e.transaction, e.signature): e for e in entries})
+        os.remove(self._legacy_pool_path)
+        return entries
+
+    def _pool_record(self, tx_id: str, entry: PendingTransaction | None) -> bytes:
+        record = {"id": tx_id, "entry": entry and entry.model_dump(mode="json")}
+        return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+    def append_pool(self, changes: dict[str, PendingTransaction | None]) -> None:
+        # 前回から変わったエントリーだけを追記する
+        self.pool_records += len(changes)
+        with open(self._pool_path, "ab") as f:
+            f.write(b"".join(self._pool_record(*change) for change in changes.items()))
+
+    def save_pool(self, entries: dict[str, PendingTransaction]) -> None:
+        # 残っているエントリーだけでログを書き直す
+        tmp_path = f"{self._pool_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(self._pool_record(*entry) for entry in entries.items()))
+        os.replace(tmp_path, self._pool_path)
+        self.pool_records = len(entries)
+
+    def load_history(self) -> dict | None:
+        if not os.path.exists(self._history_path):
+            return None
+        with open(self._history_path, "rb") as f:
+            return json.load(f)
+
+    def save_history(self, snapshot: dict) -> None:
+        tmp_path = f"{self._history_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_path, self._history_path)
+
+    def _load_snapshot(self, path: str) -> StateSnapshot | None:
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return decode_state_snapshot(f.read())
+
+    def _save_snapshot(self, path: str, snapshot: StateSnapshot) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encode_state_snapshot(snapshot))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_state_snapshot(self) -> StateSnapshot | None:
+        return self._load_snapshot(self._state_path)
+
+    def save_state_snapshot(self, snapshot: StateSnapshot) -> None:
+        self._save_snapshot(self._state_path, snapshot)
+
+    def load_checkpoint(self) -> StateSnapshot | None:
+        # 検証が終わっていないチェックポイント。これ以前のブロックはヘッダーしか持たない
+        return self._load_snapshot(self._checkpoint_path)
+
+    def save_checkpoint(self, snapshot: StateSnapshot) -> None:
+        self._save_snapshot(self._checkpoint_path, snapshot)
+
+    def clear_checkpoint(self) -> None:
+        if os.path.exists(self._checkpoint_path):
+            os.remove(self._checkpoint_path)
+
+    def close(self) -> None:
+        self._blocks_file.close()
+        self._index_file.close()
+
+
+class StoreView(Sequence):
+    # ストアの先頭 length 個のブロックを、作った時点の内容のまま読む
+    # ストアの今のエントリーを読んだ後で世代をたどり、作った後に書き換えられていれば
+    # 世代に残した古いエントリーを使う
+    _store: BlockStore
+    _generation: StoreGeneration
+    _length: int
+
+    def __init__(
+        self, store: BlockStore, generation: StoreGeneration, length: int
+    ) -> None:
+        self._store = store
+        self._generation = generation
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _entry(self, index: int) -> tuple[BinaryIO, int, bytes, float, int]:
+        store = self._store
+        try:
+            entry = (
+                store._offsets[index],
+                store._hashes[index],
+                store._timestamps[index],
+                store._difficulties[index],
+            )
+        except IndexError:
+            entry = None
+        generation = self._generation
+        while generation.truncated_at is not None:
+            if index >= generation.truncated_at:
+                position = index - generation.truncated_at
+                entry = tuple(column[position] for column in generation.tail)
+                return (generation.blocks_file, *entry)
+            generation = generation.next
+        return (generation.blocks_file, *entry)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+        blocks_file, offset, block_hash, _, _ = self._entry(index)
+        size = LINE_READ_SIZE
+        if index + 1 < len(self):
+            next_file, next_offset, _, _, _ = self._entry(index + 1)
+            if next_file is blocks_file and next_offset > offset:
+                size = next_offset - offset
+        return self._store._load(blocks_file, offset, block_hash, size)
+
+    def __iter__(self) -> Iterator[Block]:
+        return self.iter_range()
+
+    def iter_lines(self, start: int = 0, stop: int | None = None) -> Iterator[bytes]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        return _iter_lines(self._entry(index)[:2] for index in range(start, stop))
+
+    def iter_range(self, start: int = 0, stop: int | None = None) -> Iterator[Block]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        for index, line in zip(range(start, stop), self.iter_lines(start, stop)):
+            block = Block.model_validate_json(line)
+            block._hash = self.hash_at(index)
+            yield block
+
+    def hash_at(self, index: int) -> str:
+        return self._entry(index)[2].hex()
+
+    def timestamp_at(self, index: int) -> float:
+        return self._entry(index)[3]
+
+    def difficulty_at(self, index: int) -> int:
+        return self._entry(index)[4]
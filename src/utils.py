@@ -1,14 +1,23 @@
+import asyncio
 import logging
 import re
 import socket
+import threading
+import time
 
 from models import Block
 
 logger = logging.getLogger(__name__)
 RE_IP = re.compile(
-    r"(?P<prefix_host>^\d{1,3}\.\d{1.3}\.\d{1,3}\.)(?P<last_ip>\d{1,3}$)"
+    r"(?P<prefix_host>^\d{1,3}\.\d{1,3}\.\d{1,3}\.)(?P<last_ip>\d{1,3}$)"
 )
 
+DISCOVERY_TIMEOUT_SEC = 0.3
+DISCOVERY_CONCURRENCY = 512
+DISCOVERY_ALIVE_TTL_SEC = 20
+DISCOVERY_DEAD_TTL_SEC = 20
+DISCOVERY_DEAD_TTL_MAX_SEC = 600
+
 
 def pprint(chains: list[Block]) -> None:
     for index, chain in enumerate(chains):
@@ -18,22 +27,110 @@ def pprint(chains: list[Block]) -> None:
     print(f"{"*"*25}")
 
 
-def is_found_host(target: str, port: int):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.settimeout(1)
-        try:
-            sock.connect((target, port))
+async def probe_host(target: str, port: int, timeout: float) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(target, port), timeout
+        )
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+def load_seeds(path: str) -> list[str]:
+    # 1行に1つ "host:port" を書いたファイルを読む。# 以降はコメント
+    seeds = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            # 書式の誤った行は探索のスレッドで parse_address が失敗するため読み飛ばす
+            if not valid_address(line):
+                logger.warning({"action": "load_seeds", "invalid_seed": line})
+                continue
+            seeds.append(line)
+    return seeds
+
+
+class NeighbourDiscovery:
+    # ホストの生存確認を並行に行い、結果を一定時間キャッシュする
+    # 応答のなかったアドレスは失敗が続くほど再確認の間隔を空ける
+    timeout: float
+    concurrency: int
+    alive_ttl: float
+    dead_ttl: float
+    dead_ttl_max: float
+    _cache: dict[tuple[str, int], tuple[bool, float, int]]
+
+    def __init__(
+        self,
+        timeout: float = DISCOVERY_TIMEOUT_SEC,
+        concurrency: int = DISCOVERY_CONCURRENCY,
+        alive_ttl: float = DISCOVERY_ALIVE_TTL_SEC,
+        dead_ttl: float = DISCOVERY_DEAD_TTL_SEC,
+        dead_ttl_max: float = DISCOVERY_DEAD_TTL_MAX_SEC,
+    ) -> None:
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.alive_ttl = alive_ttl
+        self.dead_ttl = dead_ttl
+        self.dead_ttl_max = dead_ttl_max
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _is_due(self, address: tuple[str, int], now: float) -> bool:
+        cached = self._cache.get(address)
+        if cached is None:
             return True
-        except Exception as ex:
-            logger.error(
-                {
-                    "action": "is_found_host",
-                    "target": target,
-                    "port": port,
-                    "ex": str(ex),
-                }
-            )
-            return False
+        alive, checked_at, failures = cached
+        if alive:
+            return now - checked_at >= self.alive_ttl
+        ttl = min(self.dead_ttl * 2 ** (failures - 1), self.dead_ttl_max)
+        return now - checked_at >= ttl
+
+    async def _probe_many(self, addresses: list[tuple[str, int]]) -> list[bool]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe(address: tuple[str, int]) -> bool:
+            async with semaphore:
+                return await probe_host(*address, timeout=self.timeout)
+
+        return await asyncio.gather(*(probe(address) for address in addresses))
+
+    def probe(self, addresses: list[tuple[str, int]]) -> dict[tuple[str, int], bool]:
+        now = time.monotonic()
+        with self._lock:
+            due = [address for address in addresses if self._is_due(address, now)]
+        if due:
+            results = asyncio.run(self._probe_many(due))
+            with self._lock:
+                for address, alive in zip(due, results):
+                    _, _, failures = self._cache.get(address, (False, 0.0, 0))
+                    self._cache[address] = (
+                        alive,
+                        now,
+                        0 if alive else failures + 1,
+                    )
+        with self._lock:
+            return {address: self._cache[address][0] for address in addresses}
+
+
+default_discovery = NeighbourDiscovery()
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def valid_address(address: str) -> bool:
+    try:
+        host, port = parse_address(address)
+    except ValueError:
+        return False
+    return bool(host) and 0 < port < 65536
 
 
 def find_neighbours(
@@ -43,29 +140,36 @@ def find_neighbours(
     end_ip_range,
     start_port,
     end_port,
+    seeds: list[str] = None,
+    discovery: NeighbourDiscovery = None,
 ):
+    discovery = discovery or default_discovery
     address = f"{my_host}:{my_port}"
+
+    candidates = []
     m = RE_IP.search(my_host)
-    if not m:
+    if m:
+        prefix_host = m.group("prefix_host")
+        last_ip = m.group("last_ip")
+        for guess_port in range(start_port, end_port):
+            for ip_range in range(start_ip_range, end_ip_range):
+                guess_host = f"{prefix_host}{int(last_ip) + int(ip_range)}"
+                candidates.append(f"{guess_host}:{guess_port}")
+    elif not seeds:
         return None
 
-    prefix_host = m.group("prefix_host")
-    last_ip = m.group("last_ip")
-
-    neighbours = []
-    for guess_port in range(start_port, end_port):
-        for ip_range in range(start_ip_range, end_ip_range):
-            guess_host = f"{prefix_host}{int(last_ip) + int(ip_range)}"
-            guess_address = f"{guess_host}:{guess_port}"
-            if is_found_host(guess_host, guess_port) and not guess_address == address:
-                neighbours.append(guess_address)
+    for seed in seeds or []:
+        if seed not in candidates:
+            candidates.append(seed)
+    candidates = [c for c in candidates if c != address]
 
-    return neighbours
+    alive = discovery.probe([parse_address(c) for c in candidates])
+    return [c for c in candidates if alive[parse_address(c)]]
 
 
 def get_host() -> str:
     try:
         return socket.gethostbyname(socket.gethostname())
     except Exception as ex:
-        logger.error("action: get_host}", str(ex))
+        logger.error({"action": "get_host", "ex": str(ex)})
         return "127.0.0.1"
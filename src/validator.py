@@ -0,0 +1,301 @@
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+from difficulty import DifficultyTracker, meets_difficulty, valid_difficulty
+from merkle import header_hash, merkle_root
+from models import Block, BlockHeader
+from verifier import SignatureVerifier
+from wallet import blockchain_address_from_public_key
+from wire import decode_block, encode_block
+
+logger = logging.getLogger(__name__)
+
+VALIDATE_WORKERS = os.cpu_count()
+# 検証の手間はトランザクション数にほぼ比例するため、合計がこれより少なければ
+# プロセスに分けずにその場で検証する
+VALIDATE_BATCH_MIN_TRANSACTIONS = 2_000
+# 1つのワーカーにまとめて渡すブロック数
+VALIDATE_CHUNK_SIZE = 256
+
+INVALID_LINK = "previous_hash"
+INVALID_DIFFICULTY = "difficulty"
+INVALID_MERKLE_ROOT = "merkle_root"
+INVALID_PROOF = "proof"
+INVALID_STATE = "state"
+INVALID_TIMESTAMP = "timestamp"
+INVALID_SIGNATURE = "signature"
+
+# マイニング報酬の送信者。報酬は署名を持たず、ブロックの先頭に1件だけ置ける
+MINING_SENDER = "THE BLOCKCHAIN"
+
+# ブロックのタイムスタンプは、受け取った時刻からこれより先であってはならない
+MAX_FUTURE_BLOCK_SEC = 300
+
+
+def check_header_proof(
+    header: BlockHeader | Block, block_hash: str = None
+) -> str | None:
+    # ヘッダーのハッシュが自身の難易度の PoW を満たすこと。不正な場合はその理由を返す
+    # ハッシュを求めてあれば block_hash に渡す
+    if isinstance(header, Block):
+        header = header.header()
+    if not valid_difficulty(header.difficulty):
+        return INVALID_DIFFICULTY
+    if block_hash is None:
+        block_hash = header_hash(header)
+    if not meets_difficulty(block_hash, header.difficulty):
+        return INVALID_PROOF
+    return None
+
+
+def check_block_proof(block: Block, block_hash: str = None) -> str | None:
+    # マークルルートがトランザクションと一致し、ヘッダーが自身の難易度の PoW を満たすこと
+    # 難易度がチェーンの規則どおりかは、前のブロックと合わせて順に確認する
+    # 不正な場合はその理由を返す
+    if not valid_difficulty(block.difficulty):
+        return INVALID_DIFFICULTY
+    if block.merkle_root != merkle_root(block.transactions):
+        return INVALID_MERKLE_ROOT
+    return check_header_proof(block, block_hash)
+
+
+def check_block_signatures(block: Block, verifier: SignatureVerifier) -> str | None:
+    # マイニング報酬以外のトランザクションは、送信者のアドレスに対応する公開鍵で署名されていること
+    # 報酬の位置と金額は残高と合わせて確認する
+    items = []
+    for transaction in block.transactions:
+        if transaction.sender_blockchain_address == MINING_SENDER:
+            continue
+        if transaction.sender_public_key is None or transaction.signature is None:
+            return INVALID_SIGNATURE
+        try:
+            address = blockchain_address_from_public_key(transaction.sender_public_key)
+        except (TypeError, ValueError):
+            return INVALID_SIGNATURE
+        if address != transaction.sender_blockchain_address:
+            return INVALID_SIGNATURE
+        items.append(
+            (
+                transaction.sender_public_key,
+                transaction.signature,
+                transaction.unsigned(),
+            )
+        )
+    if not all(verifier.verify_batch(items)):
+        return INVALID_SIGNATURE
+    return None
+
+
+def check_timestamp(
+    timestamp: float, difficulty: DifficultyTracker, now: float
+) -> str | None:
+    # 直近のブロックのタイムスタンプの中央値より後で、受け取った時刻 now から
+    # MAX_FUTURE_BLOCK_SEC 以内であること
+    median_time = difficulty.median_time()
+    if median_time is not None and timestamp <= median_time:
+        return INVALID_TIMESTAMP
+    if timestamp > now + MAX_FUTURE_BLOCK_SEC:
+        return INVALID_TIMESTAMP
+    return None
+
+
+def _check_blocks(
+    blocks: list[Block], start_height: int, verifier: SignatureVerifier
+) -> tuple[list[str], int | None, str | None]:
+    # 各ブロックのハッシュを求め、最初に不正だったブロックの位置と理由を返す
+    # 高さ 0 のジェネシスブロックは PoW を満たさないため検証しない
+    hashes = []
+    for index, block in enumerate(blocks):
+        block_hash = header_hash(block.header())
+        if start_height + index > 0:
+            reason = check_block_proof(block, block_hash)
+            if reason is None:
+                reason = check_block_signatures(block, verifier)
+            if reason is not None:
+                return hashes, index, reason
+        hashes.append(block_hash)
+    return hashes, None, None
+
+
+# ワーカープロセスごとに1つ作り、同じプロセスに届いたチャンクで使い回す
+_signature_verifier = None
+
+
+def _init_worker() -> None:
+    global _signature_verifier
+    _signature_verifier = SignatureVerifier(workers=1)
+
+
+def _check_chunk(
+    payloads: list[bytes], start_height: int
+) -> tuple[list[str], int | None, str | None]:
+    # ワーカーへはモデルを pickle するより軽いバイナリ形式で渡す
+    blocks = [decode_block(payload) for payload in payloads]
+    return _check_blocks(blocks, start_height, _signature_verifier)
+
+
+class ValidationResult:
+    valid: bool
+    # 不正だったブロックの高さと理由
+    height: int | None
+    reason: str | None
+    # 検証を通ったブロックのハッシュ
+    hashes: list[str]
+
+    def __init__(
+        self,
+        hashes: list[str],
+        height: int | None = None,
+        reason: str | None = None,
+    ) -> None:
+        self.valid = reason is None
+        self.height = height
+        self.reason = reason
+        self.hashes = hashes
+
+
+class ChainValidator:
+    # 連続したブロックを次の3段階で検証する
+    # 1. マークルルートと PoW、署名の確認: ブロックごとに独立なので、チャンクに分けて各プロセスで行う
+    # 2. previous_hash のつながりと難易度、タイムスタンプ: 1で求めたハッシュと
+    #    直前のブロックのタイムスタンプを使い、先頭から順に確認する
+    # 3. 残高などの状態の確認: 呼び出し元から渡された関数で、先頭から順に適用する
+    # 2と3はチャンクの結果が届いた順に行い、最初に不正なブロックが見つかった時点で残りを取り消す
+    workers: int
+    # プロセスに分けずに検証するときに使う。ノードの検証器を渡せば、
+    # プールへの追加時に検証済みの署名は検証し直さない
+    signature_verifier: SignatureVerifier
+    _executor: ProcessPoolExecutor | None
+
+    def __init__(
+        self,
+        workers: int = VALIDATE_WORKERS,
+        signature_verifier: SignatureVerifier = None,
+    ) -> None:
+        self.workers = workers or 1
+        self.signature_verifier = signature_verifier or SignatureVerifier(workers=1)
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    def _iter_checks(self, blocks: list[Block], start_height: int):
+        transactions = sum(len(block.transactions) for block in blocks)
+        if transactions < VALIDATE_BATCH_MIN_TRANSACTIONS or self.workers <= 1:
+            yield 0, _check_blocks(blocks, start_height, self.signature_verifier)
+            return
+
+        # 難易度が範囲外のブロックはワイヤ形式に符号化する前に見つけておく
+        # その手前までをワーカーに渡し、そこから先はその場で検証する
+        encodable = next(
+            (
+                index
+                for index, block in enumerate(blocks)
+                if not valid_difficulty(block.difficulty)
+            ),
+            len(blocks),
+        )
+        chunk_size = max(1, min(VALIDATE_CHUNK_SIZE, -(-encodable // self.workers)))
+        executor = self._get_executor()
+        futures = []
+        for start in range(0, encodable, chunk_size):
+            chunk = blocks[start : min(start + chunk_size, encodable)]
+            payloads = [encode_block(block) for block in chunk]
+            futures.append(
+                (start, executor.submit(_check_chunk, payloads, start_height + start))
+            )
+        try:
+            for start, future in futures:
+                yield start, future.result()
+        finally:
+            for _, future in futures:
+                future.cancel()
+        if encodable < len(blocks):
+            yield encodable, _check_blocks(
+                blocks[encodable:], start_height + encodable, self.signature_verifier
+            )
+
+    def validate(
+        self,
+        blocks: list[Block],
+        start_height: int,
+        previous_hash: str | None,
+        difficulty: DifficultyTracker,
+        check_state: Callable[[Block], bool] = None,
+    ) -> ValidationResult:
+        # blocks[0] の高さを start_height とし、その直前のブロックのハッシュを previous_hash に、
+        # 直前のブロックまでを受け取った DifficultyTracker を difficulty に渡す
+        now = time.time()
+        hashes = []
+        for start, (chunk_hashes, failed, reason) in self._iter_checks(
+            blocks, start_height
+        ):
+            for offset, block_hash in enumerate(chunk_hashes):
+                index = start + offset
+                height = start_height + index
+                block = blocks[index]
+                if height > 0:
+                    if block.previous_hash != previous_hash:
+                        return self._invalid(hashes, height, INVALID_LINK)
+                    if block.difficulty != difficulty.next_difficulty():
+                        return self._invalid(hashes, height, INVALID_DIFFICULTY)
+                    if check_timestamp(block.timestamp, difficulty, now) is not None:
+                        return self._invalid(hashes, height, INVALID_TIMESTAMP)
+                    if check_state is not None and not check_state(block):
+                        return self._invalid(hashes, height, INVALID_STATE)
+                difficulty.push(block.timestamp, block.difficulty)
+                # 求めたハッシュはブロックに保持し、チェーンへの追加時に計算し直さない
+                block._hash = block_hash
+                hashes.append(block_hash)
+                previous_hash = block_hash
+            if failed is not None:
+                return self._invalid(hashes, start_height + start + failed, reason)
+        return ValidationResult(hashes)
+
+    def validate_headers(
+        self,
+        headers: list[BlockHeader],
+        start_height: int,
+        previous_hash: str | None,
+        difficulty: DifficultyTracker,
+    ) -> ValidationResult:
+        # トランザクションを持たないヘッダーだけの検証。PoW とつながり、難易度を先頭から順に確認する
+        # 1つあたりの手間が小さいため、プロセスには分けない
+        now = time.time()
+        hashes = []
+        for index, header in enumerate(headers):
+            height = start_height + index
+            block_hash = header_hash(header)
+            if height > 0:
+                reason = check_header_proof(header, block_hash)
+                if reason is None and header.previous_hash != previous_hash:
+                    reason = INVALID_LINK
+                if reason is None and header.difficulty != difficulty.next_difficulty():
+                    reason = INVALID_DIFFICULTY
+                if reason is None:
+                    reason = check_timestamp(header.timestamp, difficulty, now)
+                if reason is not None:
+                    return self._invalid(hashes, height, reason)
+            difficulty.push(header.timestamp, header.difficulty)
+            previous_hash = block_hash
+            hashes.append(block_hash)
+        return ValidationResult(hashes)
+
+    def _invalid(self, hashes: list[str], height: int, reason: str) -> ValidationResult:
+        logger.error({"action": "validate_chain", "height": height, "reason": reason})
+        return ValidationResult(hashes, height, reason)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
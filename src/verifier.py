@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from ecdsa import BadSignatureError, NIST256p, VerifyingKey
+from ecdsa.ellipticcurve import PointJacobi
+from ecdsa.errors import MalformedPointError
+
+from models import Transaction
+
+logger = logging.getLogger(__name__)
+
+VERIFYING_KEY_CACHE_SIZE = 4096
+VERIFIED_CACHE_SIZE = 100_000
+VERIFY_WORKERS = os.cpu_count()
+# これより少ない件数ならプロセスに分けずにその場で検証する
+VERIFY_BATCH_MIN = 64
+
+
+@lru_cache(maxsize=VERIFYING_KEY_CACHE_SIZE)
+def load_verifying_key(public_key: str) -> VerifyingKey:
+    verifying_key = VerifyingKey.from_string(bytes.fromhex(public_key), curve=NIST256p)
+    # 同じ公開鍵で何度も検証するため、点の倍算テーブルを事前に計算しておく
+    # from_string で作った点は位数を持たず precompute() できないため、位数付きの点に置き換える
+    point = verifying_key.pubkey.point
+    verifying_key.pubkey.point = PointJacobi(
+        NIST256p.curve, point.x(), point.y(), 1, NIST256p.order, generator=True
+    )
+    verifying_key.pubkey.point * 2
+    return verifying_key
+
+
+def transaction_message(transaction: Transaction) -> bytes:
+    sha256 = hashlib.sha256()
+    sha256.update(str(transaction).encode("utf-8"))
+    return sha256.digest()
+
+
+def verify_message(public_key: str, signature: str, message: bytes) -> bool:
+    try:
+        return load_verifying_key(public_key).verify(bytes.fromhex(signature), message)
+    except (BadSignatureError, MalformedPointError, TypeError, ValueError):
+        # TypeError は無限遠点などの座標を持たない公開鍵で発生する
+        return False
+
+
+def _verify_chunk(items: list[tuple[str, str, bytes]]) -> list[bool]:
+    return [verify_message(*item) for item in items]
+
+
+class SignatureVerifier:
+    # 検証済みの (トランザクション, 署名, 公開鍵) を覚えておき、
+    # ゴシップで同じトランザクションが届いても再検証しない
+    workers: int
+    _verified: OrderedDict[bytes, None]
+    _executor: ProcessPoolExecutor | None
+
+    def __init__(
+        self,
+        workers: int = VERIFY_WORKERS,
+        cache_size: int = VERIFIED_CACHE_SIZE,
+    ) -> None:
+        self.workers = workers or 1
+        self.cache_size = cache_size
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _cache_key(self, public_key: str, signature: str, message: bytes) -> bytes:
+        return hashlib.sha256(
+            message + bytes.fromhex(signature) + bytes.fromhex(public_key)
+        ).digest()
+
+    def _is_verified(self, key: bytes) -> bool:
+        with self._lock:
+            if key in self._verified:
+                self._verified.move_to_end(key)
+                return True
+            return False
+
+    def _remember(self, key: bytes) -> None:
+        with self._lock:
+            self._verified[key] = None
+            if len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+
+    def verify(self, public_key: str, signature: str, transaction: Transaction) -> bool:
+        return self.verify_batch([(public_key, signature, transaction)])[0]
+
+    def verify_batch(self, items: list[tuple[str, str, Transaction]]) -> list[bool]:
+        results = [False] * len(items)
+        pending = []
+        for index, (public_key, signature, transaction) in enumerate(items):
+            message = transaction_message(transaction)
+            try:
+                key = self._cache_key(public_key, signature, message)
+            except (TypeError, ValueError):
+                continue
+            if self._is_verified(key):
+                results[index] = True
+            else:
+                pending.append((index, key, (public_key, signature, message)))
+
+        if len(pending) < VERIFY_BATCH_MIN or self.workers <= 1:
+            verified = _verify_chunk([item for _, _, item in pending])
+        else:
+            verified = self._verify_parallel([item for _, _, item in pending])
+
+        for (index, key, _), is_verified in zip(pending, verified):
+            results[index] = is_verified
+            if is_verified:
+                self._remember(key)
+        return results
+
+    def _verify_parallel(self, items: list[tuple[str, str, bytes]]) -> list[bool]:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        chunk_size = -(-len(items) // self.workers)
+        chunks = [
+            items[start : start + chunk_size]
+            for start in range(0, len(items), chunk_size)
+        ]
+        results = []
+        for chunk_results in self._executor.map(_verify_chunk, chunks):
+            results.extend(chunk_results)
+        logger.info({"action": "verify_parallel", "transactions": len(items)})
+        return results
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
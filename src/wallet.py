@@ -1,6 +1,8 @@
-import binascii
-import codecs
 import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 import base58
 from ecdsa import NIST256p, SigningKey, VerifyingKey
@@ -8,14 +10,20 @@ from ecdsa import NIST256p, SigningKey, VerifyingKey
 from models import Transaction
 from utils import pprint
 
+NETWORK_BYTE = b"\x00"
+ADDRESS_CACHE_SIZE = 65_536
+WALLET_WORKERS = os.cpu_count()
+# これより少ない件数ならプロセスに分けずにその場で作る
+WALLET_BATCH_MIN = 64
+
 
 class Wallet:
     _private_key: SigningKey
     _public_key: VerifyingKey
     _blockchain_address: str
 
-    def __init__(self) -> None:
-        self._private_key = SigningKey.generate(curve=NIST256p)
+    def __init__(self, private_key: SigningKey = None) -> None:
+        self._private_key = private_key or SigningKey.generate(curve=NIST256p)
         self._public_key = self._private_key.get_verifying_key()
         self._blockchain_address = self.generate_blockchain_address()
 
@@ -33,43 +41,70 @@ class Wallet:
         return self._blockchain_address
 
     def generate_blockchain_address(self) -> str:
-        # 2.公開鍵をsha256でハッシュ化
-        public_key_bytes = self._public_key.to_string()
-        sha256_bpk = hashlib.sha256(public_key_bytes)
-        sha256_bpk_digest = sha256_bpk.digest()
-
-        # 3.Ripemd160を使用してSHA-256をハッシュか
-        ripemd160_bpk = hashlib.new("ripemd160")
-        ripemd160_bpk.update(sha256_bpk_digest)
-        ripemd160_bpk_digest = ripemd160_bpk.digest()
-        ripemd160_bpk_hex = codecs.encode(ripemd160_bpk_digest, "hex")
-
-        # 4.ネットワークバイトを追加
-        network_byte = b"00"
-        network_bitcoin_public_key = network_byte + ripemd160_bpk_hex
-        network_bitcoin_public_key_bytes = codecs.decode(
-            network_bitcoin_public_key, "hex"
-        )
+        return blockchain_address_from_public_key(self.public_key)
 
-        # 5.二重にSHA256でハッシュ化
-        sha256_bpk = hashlib.sha256(network_bitcoin_public_key_bytes)
-        sha256_bpk_digest = sha256_bpk.digest()
-        sha256_double_bpk = hashlib.sha256(sha256_bpk_digest)
-        sha256_double_bpk_digest = sha256_double_bpk.digest()
-        sha256_hex = codecs.encode(sha256_double_bpk_digest, "hex")
+    def as_dict(self) -> dict:
+        return {
+            "private_key": self.private_key,
+            "public_key": self.public_key,
+            "blockchain_address": self.blockchain_address,
+        }
 
-        # 6.チェックサムを取得
-        checksum = sha256_hex[:8]
 
-        # 7.公開鍵とチェックサムを結合する
-        address_hex = (network_bitcoin_public_key + checksum).decode("utf-8")
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def blockchain_address_from_public_key(public_key: str) -> str:
+    # 1.公開鍵(16進数)をバイト列に戻す。不正な値なら ValueError
+    public_key_bytes = bytes.fromhex(public_key)
+
+    # 2.公開鍵をsha256でハッシュ化し、3.Ripemd160でハッシュ化
+    ripemd160_bpk = hashlib.new("ripemd160")
+    ripemd160_bpk.update(hashlib.sha256(public_key_bytes).digest())
+
+    # 4.ネットワークバイトを追加
+    network_public_key = NETWORK_BYTE + ripemd160_bpk.digest()
+
+    # 5.二重にSHA256でハッシュ化し、6.先頭4バイトをチェックサムにする
+    checksum = hashlib.sha256(hashlib.sha256(network_public_key).digest()).digest()[:4]
+
+    # 7.公開鍵とチェックサムを結合し、8.Base58でエンコード
+    return base58.b58encode(network_public_key + checksum).decode("utf-8")
 
-        # 8.Base58でエンコード
-        blockchain_address = base58.b58encode(binascii.unhexlify(address_hex)).decode(
-            "utf-8"
-        )
 
-        return blockchain_address
+def _generate_wallet_chunk(count: int) -> list[dict]:
+    return [Wallet().as_dict() for _ in range(count)]
+
+
+class WalletFactory:
+    # 鍵の生成は CPU を使うため、まとめて作る場合はプロセスに分けて並行に作る
+    workers: int
+    _executor: ProcessPoolExecutor | None
+
+    def __init__(self, workers: int = WALLET_WORKERS) -> None:
+        self.workers = workers or 1
+        self._executor = None
+
+    def generate(self, count: int) -> list[dict]:
+        if count < WALLET_BATCH_MIN or self.workers <= 1:
+            return _generate_wallet_chunk(count)
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        chunk_size = -(-count // self.workers)
+        chunks = [
+            min(chunk_size, count - start) for start in range(0, count, chunk_size)
+        ]
+        wallets = []
+        for chunk in self._executor.map(_generate_wallet_chunk, chunks):
+            wallets.extend(chunk)
+        return wallets
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
 
 
 class Singature:
@@ -88,16 +123,36 @@ class Singature:
         self.transaction = transaction
 
     def generate_signature(self) -> str:
-        sha256 = hashlib.sha256()
-        sha256.update(str(self.transaction).encode("utf-8"))
-        message = sha256.digest()
-
         private_key = SigningKey.from_string(
             bytes().fromhex(self.sender_private_key), curve=NIST256p
         )
-        private_key_sign: bytes = private_key.sign(message)
-        signature = private_key_sign.hex()
-        return signature
+        return sign_transaction(private_key, self.transaction)
+
+
+def sign_transaction(private_key: SigningKey, transaction: Transaction) -> str:
+    sha256 = hashlib.sha256()
+    sha256.update(str(transaction).encode("utf-8"))
+    message = sha256.digest()
+
+    private_key_sign: bytes = private_key.sign(message)
+    signature = private_key_sign.hex()
+    return signature
+
+
+def generate_signatures(items: list[tuple[str, Transaction]]) -> list[str]:
+    # (秘密鍵, トランザクション) をまとめて署名する
+    # 秘密鍵の読み込みは公開鍵の計算を伴うため、同じ送信者の鍵は一度だけ読み込んで使い回す
+    private_keys = {}
+    signatures = []
+    for sender_private_key, transaction in items:
+        private_key = private_keys.get(sender_private_key)
+        if private_key is None:
+            private_key = SigningKey.from_string(
+                bytes().fromhex(sender_private_key), curve=NIST256p
+            )
+            private_keys[sender_private_key] = private_key
+        signatures.append(sign_transaction(private_key, transaction))
+    return signatures
 
 
 if __name__ == "__main__":
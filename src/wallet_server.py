@@ -1,19 +1,55 @@
-import urllib
-import urllib.parse
+from contextlib import asynccontextmanager
 
-import requests
 from fastapi import FastAPI, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 
-from models import PostTransactionRequest, PostWalletTransactionRequest, Transaction
-from wallet import Singature, Wallet
-
-app = FastAPI()
-app.state.gateway = 8080
+from gateway import GatewayClient
+from mempool import transaction_id
+from merkle import header_hash, merkle_leaf, verify_merkle_proof
+from models import (
+    BlockHeader,
+    PostTransactionRequest,
+    PostWalletTransactionRequest,
+    SignedTransaction,
+    Transaction,
+)
+from wallet import Singature, Wallet, WalletFactory, generate_signatures
+
+BULK_TIMEOUT_SEC = 60
+BULK_MAX_WALLETS = 10_000
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ゲートウェイへの接続は起動時に作り、全リクエストで共有する
+    app.state.gateway_client = GatewayClient(app.state.gateways)
+    app.state.wallet_factory = WalletFactory()
+    await app.state.gateway_client.start()
+    try:
+        yield
+    finally:
+        await app.state.gateway_client.close()
+        app.state.wallet_factory.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.gateways = ["http://127.0.0.1:5000"]
 temppates = Jinja2Templates(directory="templates")
 
 
+def gateway_client() -> GatewayClient:
+    return app.state.gateway_client
+
+
+def gateway_unavailable() -> JSONResponse:
+    return JSONResponse(
+        {"message": "fail", "error": "gateway_unavailable"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request) -> HTMLResponse:
     return temppates.TemplateResponse(request=request, name="index.html")
@@ -21,24 +57,32 @@ def index(request: Request) -> HTMLResponse:
 
 @app.post("/wallet")
 def create_wallet():
-    my_wallet = Wallet()
-    return {
-        "private_key": my_wallet.private_key,
-        "public_key": my_wallet.public_key,
-        "blockchain_address": my_wallet.blockchain_address,
-    }
+    return Wallet().as_dict()
+
+
+@app.post("/wallet/bulk")
+async def create_wallets(count: int):
+    if not 0 < count <= BULK_MAX_WALLETS:
+        return JSONResponse(
+            {"message": "fail", "error": f"count must be 1 to {BULK_MAX_WALLETS}"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    # 鍵の生成は CPU を使うため、イベントループを止めないようスレッドから各プロセスに配る
+    wallets = await run_in_threadpool(app.state.wallet_factory.generate, count)
+    return {"wallets": wallets}
 
 
 @app.post("/transactions")
-def create_transactions(body: PostWalletTransactionRequest):
+async def create_transactions(body: PostWalletTransactionRequest):
+    transaction = Transaction(
+        sender_blockchain_address=body.sender_blockchain_address,
+        recipient_blockchain_address=body.recipient_blockchain_address,
+        value=body.value,
+    )
     signature = Singature(
         sender_private_key=body.sender_private_key,
         sender_public_key=body.sender_public_key,
-        transaction=Transaction(
-            sender_blockchain_address=body.sender_blockchain_address,
-            recipient_blockchain_address=body.recipient_blockchain_address,
-            value=body.value,
-        ),
+        transaction=transaction,
     )
 
     api_body = PostTransactionRequest(
@@ -46,16 +90,20 @@ def create_transactions(body: PostWalletTransactionRequest):
         recipient_blockchain_address=body.recipient_blockchain_address,
         value=body.value,
         sender_public_key=body.sender_public_key,
-        signature=signature.generate_signature(),
+        # 署名は CPU を使うため、イベントループを止めないようスレッドで行う
+        signature=await run_in_threadpool(signature.generate_signature),
     )
-    response = requests.post(
-        urllib.parse.urljoin(app.state.gateway, "/post_transactions"),
-        json=api_body.model_dump(),
-        timeout=10,
+    response = await gateway_client().request(
+        "POST", "/post_transactions", json=api_body.model_dump()
     )
+    if response is None:
+        return gateway_unavailable()
 
     if response.status_code == status.HTTP_201_CREATED:
-        return JSONResponse({"message": "success"}, status_code=status.HTTP_201_CREATED)
+        return JSONResponse(
+            {"message": "success", "transaction_id": transaction_id(transaction)},
+            status_code=status.HTTP_201_CREATED,
+        )
 
     return JSONResponse(
         {"message": "fail", "response": response.text},
@@ -63,23 +111,121 @@ def create_transactions(body: PostWalletTransactionRequest):
     )
 
 
-app.get("/wallet/amount")
+@app.post("/transactions/bulk")
+async def create_transactions_bulk(body: list[PostWalletTransactionRequest]):
+    # まとめて署名し、ノードへは1回のリクエストで送る
+    transactions = [
+        Transaction(
+            sender_blockchain_address=item.sender_blockchain_address,
+            recipient_blockchain_address=item.recipient_blockchain_address,
+            value=item.value,
+        )
+        for item in body
+    ]
+    signatures = await run_in_threadpool(
+        generate_signatures,
+        [
+            (item.sender_private_key, transaction)
+            for item, transaction in zip(body, transactions)
+        ],
+    )
+    api_body = [
+        PostTransactionRequest(
+            **transaction.model_dump(),
+            sender_public_key=item.sender_public_key,
+            signature=signature,
+        ).model_dump()
+        for item, transaction, signature in zip(body, transactions, signatures)
+    ]
+    response = await gateway_client().request(
+        "POST", "/post_transactions/bulk", json=api_body, timeout=BULK_TIMEOUT_SEC
+    )
+    if response is None:
+        return gateway_unavailable()
+
+    if response.status_code != status.HTTP_200_OK:
+        return JSONResponse(
+            {"message": "fail", "response": response.text},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+    results = response.json()["results"]
+    return {
+        "results": [
+            {**result, "transaction_id": transaction_id(transaction)}
+            for result, transaction in zip(results, transactions)
+        ],
+        "accepted": response.json()["accepted"],
+    }
+
+
+def valid_confirmation_proof(tx_id: str, proof: dict) -> bool:
+    # 返されたトランザクションが問い合わせたIDのもので、公開鍵と署名を含めたその葉が
+    # ヘッダーのマークルルートにつながり、ヘッダーのハッシュが block_hash と一致すること
+    header = BlockHeader.model_validate(proof["header"])
+    transaction = SignedTransaction.model_validate(proof["transaction"])
+    return (
+        header_hash(header) == proof["block_hash"]
+        and transaction_id(transaction) == tx_id
+        and verify_merkle_proof(
+            merkle_leaf(transaction), proof["proof"], header.merkle_root
+        )
+    )
+
+
+@app.get("/wallet/confirmations")
+async def get_confirmations(transaction_id: str, height: int = None, index: int = None):
+    # ノードから包含証明とブロックヘッダー、トランザクション本体だけを受け取り、手元で検証する
+    # 同じ内容の送金が複数あれば occurrences で知らせ、height と index で選ばせる
+    params = {
+        key: value
+        for key, value in (("height", height), ("index", index))
+        if value is not None
+    }
+    response = await gateway_client().request(
+        "GET", f"/transactions/{transaction_id}/proof", params=params
+    )
+    if response is None:
+        return gateway_unavailable()
+    if response.status_code == status.HTTP_404_NOT_FOUND:
+        return {"message": "success", "confirmations": 0}
+    if response.status_code != 200:
+        return JSONResponse(
+            {"message": "fail", "error": response.text},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+    proof = response.json()
+    if not valid_confirmation_proof(transaction_id, proof):
+        return JSONResponse(
+            {"message": "fail", "error": "invalid_proof"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    return {
+        "message": "success",
+        "confirmations": proof["confirmations"],
+        "block_hash": proof["block_hash"],
+        "height": proof["height"],
+        "index": proof["index"],
+        "occurrences": proof["occurrences"],
+    }
 
 
-def calcutate_amount(blockchain_address: str):
+@app.get("/wallet/amount")
+async def calcutate_amount(blockchain_address: str):
     my_blockchain_address = blockchain_address
-    response = requests.get(
-        urllib.parse.urljoin(app.state.config, "amount"),
-        {"blockchain_address": my_blockchain_address},
-        timeout=3,
+    response = await gateway_client().request(
+        "GET", "/amount", params={"blockchain_address": my_blockchain_address}
     )
+    if response is None:
+        return gateway_unavailable()
 
     if response.status_code == 200:
         total = response.json()["amount"]
         return {"message": "success", "amount": total}
 
     return JSONResponse(
-        {"message": "fail", "error": response.content},
+        {"message": "fail", "error": response.text},
         status_code=status.HTTP_400_BAD_REQUEST,
     )
 
@@ -91,10 +237,11 @@ if __name__ == "__main__":
 
     parser = ArgumentParser()
     parser.add_argument("-p", "--port", type=int, default=8080)
+    # カンマ区切りで複数指定すると、先頭から順に使い、落ちていれば次に切り替える
     parser.add_argument("-g", "--gateway", type=str, default="http://127.0.0.1:5000")
 
     args = parser.parse_args()
-    app.state.gateway = args.gateway
+    app.state.gateways = args.gateway.split(",")
     port = args.port
 
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,314 @@
+import struct
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+
+import base58
+
+from models import Block, StateSnapshot
+
+# /chain や /blocks で Accept に指定するとバイナリ形式で返す
+MEDIA_TYPE = "application/vnd.blockchain-learn.blocks"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MAGIC = b"BCW"
+WIRE_VERSION = 4
+STATE_MEDIA_TYPE = "application/vnd.blockchain-learn.state"
+STATE_MAGIC = b"BCS"
+STATE_VERSION = 1
+
+# 文字列はアドレスやハッシュとして元に戻せる場合だけ生のバイト列にする
+TAG_RAW = 0
+TAG_TEXT = 1
+# マイニング報酬の署名のように値がない場合
+TAG_NONE = 2
+BASE58 = "base58"
+HEX = "hex"
+
+DOUBLE = struct.Struct(">d")
+# (送信者, 受信者, 公開鍵) の番号と金額。公開鍵の番号は 0 が公開鍵なしを表す
+TRANSACTION_RECORD = struct.Struct(">IIId")
+# 同じアドレスが何度も現れるため、base58 の変換結果を覚えておく
+ADDRESS_CACHE_SIZE = 65_536
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    # 負の値は右シフトしても 0 にならず終わらないため受け付けない
+    if value < 0:
+        raise ValueError("varint must not be negative")
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, offset: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise WireFormatError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _write_signed(out: bytearray, value: int) -> None:
+    # zigzag 符号化
+    _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _read_signed(data: bytes, offset: int) -> tuple[int, int]:
+    value, offset = _read_varint(data, offset)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+
+def _write_bytes(out: bytearray, raw: bytes) -> None:
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _read_bytes(data: bytes, offset: int) -> tuple[bytes, int]:
+    length, offset = _read_varint(data, offset)
+    end = offset + length
+    if end > len(data):
+        raise WireFormatError("truncated bytes")
+    return data[offset:end], end
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _pack_address(text: str) -> bytes | None:
+    try:
+        raw = base58.b58decode(text)
+    except ValueError:
+        return None
+    return raw if base58.b58encode(raw).decode() == text else None
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _unpack_address(raw: bytes) -> str:
+    return base58.b58encode(raw).decode()
+
+
+def _pack_text(text: str, kind: str) -> bytes | None:
+    # 元の文字列に戻せない表記(大文字の16進など)は文字列のまま送る
+    if kind == BASE58:
+        return _pack_address(text)
+    try:
+        raw = bytes.fromhex(text)
+    except ValueError:
+        return None
+    return raw if raw.hex() == text else None
+
+
+def _write_text(out: bytearray, text: str, kind: str) -> None:
+    raw = _pack_text(text, kind)
+    if raw is None:
+        out.append(TAG_TEXT)
+        _write_bytes(out, text.encode())
+    else:
+        out.append(TAG_RAW)
+        _write_bytes(out, raw)
+
+
+def _write_optional_text(out: bytearray, text: str | None, kind: str) -> None:
+    if text is None:
+        out.append(TAG_NONE)
+    else:
+        _write_text(out, text, kind)
+
+
+def _read_optional_text(data: bytes, offset: int, kind: str) -> tuple[str | None, int]:
+    if offset < len(data) and data[offset] == TAG_NONE:
+        return None, offset + 1
+    return _read_text(data, offset, kind)
+
+
+def _read_text(data: bytes, offset: int, kind: str) -> tuple[str, int]:
+    if offset >= len(data):
+        raise WireFormatError("truncated text")
+    tag = data[offset]
+    if tag not in (TAG_RAW, TAG_TEXT):
+        raise WireFormatError(f"unknown text tag {tag}")
+    raw, offset = _read_bytes(data, offset + 1)
+    if tag == TAG_TEXT:
+        return raw.decode(), offset
+    return (_unpack_address(raw) if kind == BASE58 else raw.hex()), offset
+
+
+def _read_double(data: bytes, offset: int) -> tuple[float, int]:
+    end = offset + DOUBLE.size
+    if end > len(data):
+        raise WireFormatError("truncated double")
+    return DOUBLE.unpack_from(data, offset)[0], end
+
+
+def encode_block(block: Block) -> bytes:
+    # ブロック内のアドレスと公開鍵はそれぞれ表にまとめ、トランザクションは
+    # (送信者の番号, 受信者の番号, 公開鍵の番号, 金額) の固定長レコードとして並べる
+    # 署名は長さが一定でないため、レコードの後にトランザクションの順に並べる
+    out = bytearray()
+    out += DOUBLE.pack(block.timestamp)
+    _write_signed(out, block.nonce)
+    _write_varint(out, block.difficulty)
+    _write_text(out, block.previous_hash, HEX)
+    _write_text(out, block.merkle_root, HEX)
+
+    table = {}
+    keys = {}
+    records = bytearray()
+    for transaction in block.transactions:
+        sender = table.setdefault(transaction.sender_blockchain_address, len(table))
+        recipient = table.setdefault(
+            transaction.recipient_blockchain_address, len(table)
+        )
+        key = 0
+        if transaction.sender_public_key is not None:
+            key = keys.setdefault(transaction.sender_public_key, len(keys) + 1)
+        records += TRANSACTION_RECORD.pack(sender, recipient, key, transaction.value)
+
+    _write_varint(out, len(table))
+    for address in table:
+        _write_text(out, address, BASE58)
+    _write_varint(out, len(keys))
+    for public_key in keys:
+        _write_text(out, public_key, HEX)
+    _write_varint(out, len(block.transactions))
+    out += records
+    for transaction in block.transactions:
+        _write_optional_text(out, transaction.signature, HEX)
+    return bytes(out)
+
+
+def _read_block(data: bytes) -> dict:
+    timestamp, offset = _read_double(data, 0)
+    nonce, offset = _read_signed(data, offset)
+    difficulty, offset = _read_varint(data, offset)
+    previous_hash, offset = _read_text(data, offset, HEX)
+    merkle_root, offset = _read_text(data, offset, HEX)
+
+    table_size, offset = _read_varint(data, offset)
+    table = []
+    for _ in range(table_size):
+        address, offset = _read_text(data, offset, BASE58)
+        table.append(address)
+    key_count, offset = _read_varint(data, offset)
+    keys = [None]
+    for _ in range(key_count):
+        public_key, offset = _read_text(data, offset, HEX)
+        keys.append(public_key)
+
+    count, offset = _read_varint(data, offset)
+    end = offset + count * TRANSACTION_RECORD.size
+    if end > len(data):
+        raise WireFormatError("truncated transactions")
+    try:
+        transactions = [
+            {
+                "sender_blockchain_address": table[sender],
+                "recipient_blockchain_address": table[recipient],
+                "value": value,
+                "sender_public_key": keys[key],
+            }
+            for sender, recipient, key, value in TRANSACTION_RECORD.iter_unpack(
+                data[offset:end]
+            )
+        ]
+    except IndexError:
+        raise WireFormatError("unknown address or key index") from None
+    offset = end
+    for transaction in transactions:
+        transaction["signature"], offset = _read_optional_text(data, offset, HEX)
+    if offset != len(data):
+        raise WireFormatError("block size mismatch")
+    return {
+        "timestamp": timestamp,
+        "transactions": transactions,
+        "nonce": nonce,
+        "previous_hash": previous_hash,
+        "merkle_root": merkle_root,
+        "difficulty": difficulty,
+    }
+
+
+def decode_block(data: bytes) -> Block:
+    return Block.model_validate(_read_block(data))
+
+
+def encode_blocks(blocks: Iterable[Block]) -> Iterator[bytes]:
+    # 先頭にマジックとバージョン、その後は長さ付きのブロックを並べる
+    # ブロック単位で区切れるため、受信しながら順に復号できる
+    yield MAGIC + bytes([WIRE_VERSION])
+    for block in blocks:
+        out = bytearray()
+        _write_bytes(out, encode_block(block))
+        yield bytes(out)
+
+
+def iter_decode_blocks(chunks: Iterable[bytes]) -> Iterator[Block]:
+    # 受信したチャンクを溜めておき、ブロックが1つ揃うたびに復号して返す
+    header = MAGIC + bytes([WIRE_VERSION])
+    buffer = bytearray()
+    has_header = False
+    for chunk in chunks:
+        buffer += chunk
+        if not has_header:
+            if len(buffer) < len(header):
+                continue
+            if buffer[: len(header)] != header:
+                raise WireFormatError("unknown wire header")
+            del buffer[: len(header)]
+            has_header = True
+
+        offset = 0
+        while offset < len(buffer):
+            try:
+                length, start = _read_varint(buffer, offset)
+            except WireFormatError:
+                break
+            end = start + length
+            if end > len(buffer):
+                break
+            yield decode_block(bytes(buffer[start:end]))
+            offset = end
+        del buffer[:offset]
+
+    if buffer or not has_header:
+        raise WireFormatError("truncated block stream")
+
+
+def encode_state_snapshot(snapshot: StateSnapshot) -> bytes:
+    # 残高はアドレス順に (アドレス, 残高) を並べ、同じ状態からは同じバイト列になるようにする
+    out = bytearray(STATE_MAGIC + bytes([STATE_VERSION]))
+    _write_varint(out, snapshot.height)
+    _write_text(out, snapshot.block_hash, HEX)
+    _write_varint(out, len(snapshot.balances))
+    for address in sorted(snapshot.balances):
+        _write_text(out, address, BASE58)
+        out += DOUBLE.pack(snapshot.balances[address])
+    return bytes(out)
+
+
+def decode_state_snapshot(data: bytes) -> StateSnapshot:
+    header = STATE_MAGIC + bytes([STATE_VERSION])
+    if data[: len(header)] != header:
+        raise WireFormatError("unknown state header")
+    height, offset = _read_varint(data, len(header))
+    block_hash, offset = _read_text(data, offset, HEX)
+    count, offset = _read_varint(data, offset)
+    balances = {}
+    for _ in range(count):
+        address, offset = _read_text(data, offset, BASE58)
+        balances[address], offset = _read_double(data, offset)
+    if offset != len(data):
+        raise WireFormatError("trailing bytes after state snapshot")
+    return StateSnapshot(height=height, block_hash=block_hash, balances=balances)
@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+WRITER_BACKLOG_SIZE = 10_000
+# 1回の公開までにまとめて実行する書き込みの最大数
+WRITER_BATCH_SIZE = 256
+
+
+class ChainWriter:
+    # 状態を変更する処理をキューに積み、1つのスレッドで順に実行する
+    # まとめて実行した後に publish を1回呼び、読み取り側には新しいスナップショットを見せる
+    # 呼び出し元には publish の後で結果を返すため、自分の書き込みは直後の読み取りで見える
+    _backlog: queue.Queue
+    _thread: threading.Thread | None
+
+    def __init__(
+        self,
+        publish: Callable[[], None],
+        backlog_size: int = WRITER_BACKLOG_SIZE,
+    ) -> None:
+        self.publish = publish
+        self._backlog = queue.Queue(maxsize=backlog_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="chain-writer", daemon=True
+                )
+                self._thread.start()
+
+    def in_writer(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        self._start()
+        future = Future()
+        self._backlog.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func: Callable, *args, **kwargs):
+        # 書き込みスレッドの中から呼ばれた場合はその場で実行する
+        if self.in_writer():
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def _work(self) -> None:
+        while True:
+            batch = [self._backlog.get()]
+            while len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    batch.append(self._backlog.get_nowait())
+                except queue.Empty:
+                    break
+
+            results = []
+            for future, func, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    results.append((future, func(*args, **kwargs), None))
+                except Exception as ex:
+                    logger.exception({"action": "chain_writer", "ex": str(ex)})
+                    results.append((future, None, ex))
+
+            try:
+                self.publish()
+            except Exception as ex:
+                logger.exception({"action": "chain_writer_publish", "ex": str(ex)})
+            for future, result, ex in results:
+                if ex is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(ex)
+            for _ in batch:
+                self._backlog.task_done()
+
+    def join(self) -> None:
+        self._backlog.join()
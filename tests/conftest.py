@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from pydantic_core import to_jsonable_python
+
+from blockchain import BlockChain
+from models import StateSnapshot
+from peers import PeerClient
+from wire import (
+    decode_state_snapshot,
+    encode_blocks,
+    encode_state_snapshot,
+    iter_decode_blocks,
+)
+
+
+class LocalPeerClient(PeerClient):
+    # HTTP を使わずに、同じプロセスのノードへ直接問い合わせるクライアント
+    # 応答はサーバーと同じく JSON やワイヤ形式を通してから返す
+    network: "LocalNetwork"
+    sent: list[tuple[list[str], str, str, dict | None]]
+    # 問い合わせた (ノード, パス)
+    requested: list[tuple[str, str]]
+
+    def __init__(self, network: "LocalNetwork") -> None:
+        super().__init__(workers=1)
+        self.network = network
+        self.sent = []
+        self.requested = []
+
+    def get_json(self, node: str, path: str, params: dict = None) -> dict | None:
+        self.requested.append((node, path))
+        blockchain = self.network.nodes.get(node)
+        if blockchain is None:
+            return None
+        params = params or {}
+        if path == "/chain/tip":
+            response = blockchain.get_tip()
+        elif path == "/headers":
+            response = {
+                "headers": blockchain.get_headers(
+                    int(params["from_height"]), int(params["limit"])
+                )
+            }
+        elif path.startswith("/blocks/") and path.endswith("/transactions"):
+            transactions = blockchain.get_block_transactions(
+                path.split("/")[2], params["indexes"]
+            )
+            if transactions is None:
+                return None
+            response = {"transactions": transactions}
+        else:
+            raise KeyError(path)
+        return json.loads(json.dumps(to_jsonable_python(response)))
+
+    def get_state_snapshot(self, node: str) -> StateSnapshot | None:
+        blockchain = self.network.nodes.get(node)
+        state = blockchain and blockchain.get_state_snapshot()
+        if state is None:
+            return None
+        return decode_state_snapshot(encode_state_snapshot(state))
+
+    def iter_blocks(self, node: str, path: str, params: dict = None):
+        self.requested.append((node, path))
+        blockchain = self.network.nodes.get(node)
+        if blockchain is None or path != "/chain":
+            return None
+        heights = blockchain.chain_range(
+            int(params["from_height"]), int(params["to_height"])
+        )
+        data = b"".join(encode_blocks(blockchain.iter_chain(heights)))
+        return iter_decode_blocks([data])
+
+    def broadcast(
+        self, nodes: list[str], method: str, path: str, json: dict = None
+    ) -> None:
+        self.sent.append((nodes, method, path, json))
+
+
+class LocalNetwork:
+    nodes: dict[str, BlockChain]
+
+    def __init__(self) -> None:
+        self.nodes = {}
+
+    def add(self, node: str, blockchain: BlockChain) -> BlockChain:
+        # blockchain の近隣ノードへの問い合わせを、このネットワークのノードに向ける
+        self.nodes[node] = blockchain
+        blockchain.peer_client = LocalPeerClient(self)
+        return blockchain
+
+
+@pytest.fixture
+def network() -> LocalNetwork:
+    return LocalNetwork()
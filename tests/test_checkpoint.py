@@ -0,0 +1,128 @@
+import logging
+
+import pytest
+
+import blockchain as blockchain_module
+from blockchain import BlockChain
+from models import StateSnapshot, Transaction
+from storage import BlockStore
+from wallet import Singature, Wallet
+
+logging.disable(logging.CRITICAL)
+
+SNAPSHOT_INTERVAL = 4
+
+
+def _new_chain(address: str, store_dir=None) -> BlockChain:
+    store = BlockStore(str(store_dir)) if store_dir is not None else None
+    return BlockChain(address, mining_workers=1, store=store)
+
+
+@pytest.fixture
+def source(network, monkeypatch):
+    # SNAPSHOT_INTERVAL の高さで残高のスナップショットを作り、その後ろにもう1ブロック掘ったノード
+    monkeypatch.setattr(blockchain_module, "STATE_SNAPSHOT_INTERVAL", SNAPSHOT_INTERVAL)
+    wallet = Wallet()
+    recipient = Wallet()
+    source = network.add("source", _new_chain(wallet.blockchain_address))
+    source.mining()
+    transaction = Transaction(
+        sender_blockchain_address=wallet.blockchain_address,
+        recipient_blockchain_address=recipient.blockchain_address,
+        value=0.5,
+    )
+    signature = Singature(
+        wallet.private_key, wallet.public_key, transaction
+    ).generate_signature()
+    assert source.add_transaction(transaction, wallet.public_key, signature)
+    while len(source.chain) <= SNAPSHOT_INTERVAL + 1:
+        source.mining()
+    assert source.get_state_snapshot().height == SNAPSHOT_INTERVAL
+    return source
+
+
+def _hashes(blockchain: BlockChain) -> list[str]:
+    return [blockchain.block_hash(h) for h in range(len(blockchain.chain))]
+
+
+def _balances(blockchain: BlockChain) -> dict[str, float]:
+    return {k: v for k, v in blockchain.balance_index.snapshot().items() if v}
+
+
+@pytest.mark.parametrize("use_store", [False, True], ids=["memory", "store"])
+def test_bootstrap_then_verify_history(tmp_path, network, source, use_store):
+    node = network.add("node", _new_chain("node", tmp_path if use_store else None))
+    state = source.get_state_snapshot()
+    assert node.bootstrap("source", state.block_hash)
+    node.checkpoint_thread.join()
+
+    # 検証が終わるとヘッダーだけのブロックが本体に置き換わる
+    assert node.checkpoint is None
+    assert _hashes(node) == _hashes(source)[: SNAPSHOT_INTERVAL + 1]
+    assert [len(block.transactions) for block in node.chain] == [
+        len(block.transactions) for block in source.chain[: SNAPSHOT_INTERVAL + 1]
+    ]
+    assert _balances(node) == pytest.approx(state.balances)
+    if use_store:
+        assert node.store.load_checkpoint() is None
+
+    # チェックポイントより後ろのブロックは通常の同期で受け取る
+    assert node.add_blocks(list(source.chain)[SNAPSHOT_INTERVAL + 1 :])
+    assert _hashes(node) == _hashes(source)
+    assert _balances(node) == pytest.approx(_balances(source))
+
+
+@pytest.mark.parametrize("use_store", [False, True], ids=["memory", "store"])
+def test_verify_checkpoint_from_headers_only(tmp_path, network, source, use_store):
+    node = network.add("node", _new_chain("node", tmp_path if use_store else None))
+    state = source.get_state_snapshot()
+    headers = node.fetch_checkpoint_headers("source", state)
+    assert node.writer.call(node._load_checkpoint, state, headers)
+    assert node.checkpoint == state
+    assert all(not block.transactions for block in node.chain)
+    assert not node.history_available(SNAPSHOT_INTERVAL)
+
+    assert not node.verify_checkpoint(["missing"])
+    assert node.checkpoint == state
+    assert node.verify_checkpoint(["missing", "source"])
+    assert node.checkpoint is None
+    assert node.history_available(0)
+    assert _hashes(node) == _hashes(source)[: SNAPSHOT_INTERVAL + 1]
+
+
+def test_bootstrap_rejects_a_different_checkpoint(network, source):
+    node = network.add("node", _new_chain("node"))
+    assert not node.bootstrap("source", source.block_hash(SNAPSHOT_INTERVAL - 1))
+    assert node.checkpoint is None
+    assert len(node.chain) == 1
+
+
+def test_bootstrap_rejects_a_snapshot_off_the_header_chain(network, source):
+    # 配られたスナップショットのハッシュがヘッダーのチェーンの最後と一致しない
+    state = source.get_state_snapshot()
+    source.state_snapshot = StateSnapshot(
+        height=state.height,
+        block_hash=source.block_hash(state.height + 1),
+        balances=state.balances,
+    )
+    source.block_heights[source.state_snapshot.block_hash] = state.height
+    node = network.add("node", _new_chain("node"))
+    assert not node.bootstrap("source")
+    assert node.checkpoint is None
+    assert len(node.chain) == 1
+
+
+def test_verify_checkpoint_replaces_forged_balances(network, source):
+    state = source.get_state_snapshot()
+    forged = {**state.balances, "attacker": 1_000.0}
+    source.state_snapshot = StateSnapshot(
+        height=state.height, block_hash=state.block_hash, balances=forged
+    )
+    node = network.add("node", _new_chain("node"))
+    assert node.bootstrap("source", state.block_hash)
+    node.checkpoint_thread.join()
+
+    # ヘッダーは正しいため取り込むが、履歴から求めた残高に直す
+    assert node.checkpoint is None
+    assert node.calculate_total_amount("attacker") == 0
+    assert _balances(node) == pytest.approx(state.balances)
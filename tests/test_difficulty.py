@@ -0,0 +1,224 @@
+import logging
+import time
+
+import pytest
+
+from blockchain import BlockChain
+from blocktree import BlockTree
+from difficulty import (
+    INITIAL_DIFFICULTY,
+    MAX_DIFFICULTY,
+    MAX_RETARGET_STEP,
+    MEDIAN_TIME_SPAN,
+    MIN_DIFFICULTY,
+    RETARGET_INTERVAL,
+    TARGET_BLOCK_SEC,
+    DifficultyTracker,
+    block_work,
+    meets_difficulty,
+    retarget,
+)
+from merkle import header_hash, merkle_root
+from miner import ProofTemplate
+from models import Block, SignedTransaction
+from validator import (
+    INVALID_DIFFICULTY,
+    INVALID_TIMESTAMP,
+    MAX_FUTURE_BLOCK_SEC,
+    MINING_SENDER,
+    ChainValidator,
+    check_timestamp,
+)
+
+logging.disable(logging.CRITICAL)
+
+EXPECTED_TIMESPAN = TARGET_BLOCK_SEC * RETARGET_INTERVAL
+
+
+def _mine(previous_hash: str, timestamp: float, difficulty: int) -> Block:
+    transactions = [
+        SignedTransaction(
+            sender_blockchain_address=MINING_SENDER,
+            recipient_blockchain_address="miner",
+            value=1.0,
+        )
+    ]
+    block = Block(
+        timestamp=timestamp,
+        transactions=transactions,
+        nonce=0,
+        previous_hash=previous_hash,
+        merkle_root=merkle_root(transactions),
+        difficulty=difficulty,
+    )
+    template = ProofTemplate.from_header(block.header())
+    nonce = 0
+    while not meets_difficulty(template.hash(nonce), difficulty):
+        nonce += 1
+    return block.model_copy(update={"nonce": nonce})
+
+
+def _extend(blocks: list[Block], previous_hash: str, timestamps, difficulty: int):
+    for timestamp in timestamps:
+        block = _mine(previous_hash, timestamp, difficulty)
+        blocks.append(block)
+        previous_hash = header_hash(block.header())
+    return blocks
+
+
+@pytest.fixture(scope="module")
+def validator():
+    validator = ChainValidator(workers=1)
+    yield validator
+    validator.close()
+
+
+@pytest.fixture(scope="module")
+def fast_blocks() -> list[Block]:
+    # 高さ 1 から 2 * RETARGET_INTERVAL - 1 までの、1秒間隔で掘られたブロック
+    start = time.time() - 1_000
+    heights = range(1, 2 * RETARGET_INTERVAL)
+    return _extend([], "ab" * 32, [start + h for h in heights], INITIAL_DIFFICULTY)
+
+
+def _validate(validator: ChainValidator, blocks: list[Block]):
+    return validator.validate(blocks, 1, "ab" * 32, DifficultyTracker(height=1))
+
+
+def test_tracker_retargets_only_at_the_interval_boundary():
+    tracker = DifficultyTracker(height=1)
+    for height in range(1, 4 * RETARGET_INTERVAL):
+        difficulty = tracker.next_difficulty()
+        if height in (2 * RETARGET_INTERVAL, 3 * RETARGET_INTERVAL):
+            # 1秒間隔なので、上げられる上限まで上げる
+            assert difficulty == tracker.difficulty + MAX_RETARGET_STEP
+        else:
+            assert difficulty == tracker.difficulty
+        tracker.push(float(height), difficulty)
+    assert tracker.difficulty == INITIAL_DIFFICULTY + 2 * MAX_RETARGET_STEP
+
+
+@pytest.mark.parametrize(
+    "timespan, step",
+    [
+        (EXPECTED_TIMESPAN, 0),
+        (EXPECTED_TIMESPAN / 2, 1),
+        (EXPECTED_TIMESPAN * 2, -1),
+        (1.0, MAX_RETARGET_STEP),
+        (0.0, MAX_RETARGET_STEP),
+        (EXPECTED_TIMESPAN * 1_000, -MAX_RETARGET_STEP),
+    ],
+)
+def test_retarget_is_clamped_to_the_maximum_step(timespan, step):
+    assert retarget(INITIAL_DIFFICULTY, timespan) == INITIAL_DIFFICULTY + step
+
+
+def test_retarget_stays_within_the_difficulty_range():
+    assert retarget(MIN_DIFFICULTY, EXPECTED_TIMESPAN * 1_000) == MIN_DIFFICULTY
+    assert retarget(MAX_DIFFICULTY, 1.0) == MAX_DIFFICULTY
+    assert retarget(MAX_DIFFICULTY - 1, 1.0) == MAX_DIFFICULTY
+
+
+def test_validator_requires_the_retarget_at_the_boundary(validator, fast_blocks):
+    previous_hash = header_hash(fast_blocks[-1].header())
+    timestamp = fast_blocks[-1].timestamp + 1
+    # 境界の高さで難易度を変えていないブロック
+    unchanged = _mine(previous_hash, timestamp, INITIAL_DIFFICULTY)
+    result = _validate(validator, [*fast_blocks, unchanged])
+    assert not result.valid
+    assert result.height == 2 * RETARGET_INTERVAL
+    assert result.reason == INVALID_DIFFICULTY
+
+    retargeted = _mine(previous_hash, timestamp, INITIAL_DIFFICULTY + 2)
+    assert _validate(validator, [*fast_blocks, retargeted]).valid
+
+
+def test_validator_rejects_a_retarget_before_the_boundary(validator, fast_blocks):
+    early = fast_blocks[:-1]
+    block = _mine(
+        header_hash(early[-1].header()),
+        fast_blocks[-1].timestamp,
+        INITIAL_DIFFICULTY + 2,
+    )
+    result = _validate(validator, [*early, block])
+    assert not result.valid
+    assert result.height == 2 * RETARGET_INTERVAL - 1
+    assert result.reason == INVALID_DIFFICULTY
+
+
+def test_fork_choice_prefers_fewer_harder_blocks():
+    tree = BlockTree()
+    tree.add("genesis", "", block_work(INITIAL_DIFFICULTY))
+    previous = "genesis"
+    for i in range(3):
+        tree.add(f"easy{i}", previous, block_work(INITIAL_DIFFICULTY))
+        previous = f"easy{i}"
+    easy_tip = tree.best_tip
+    previous = "genesis"
+    for i in range(2):
+        tree.add(f"hard{i}", previous, block_work(INITIAL_DIFFICULTY + 2))
+        previous = f"hard{i}"
+
+    assert tree.best_tip.hash == "hard1"
+    detach, attach = tree.fork_path(easy_tip, tree.best_tip)
+    assert [node.hash for node in detach] == ["easy2", "easy1", "easy0"]
+    assert [node.hash for node in attach] == ["hard0", "hard1"]
+
+
+def test_node_switches_to_the_branch_with_more_work():
+    blockchain = BlockChain("a", mining_workers=1)
+    genesis = blockchain.chain[0]
+    start = genesis.timestamp
+    easy = _extend(
+        [],
+        blockchain.hash(genesis),
+        [start + 1, start + 2, start + 3],
+        INITIAL_DIFFICULTY,
+    )
+    # 2ブロックでも難易度が2ビット高ければ、3ブロックより累積ワークが大きい
+    hard = _extend(
+        [], blockchain.hash(genesis), [start + 1, start + 2], INITIAL_DIFFICULTY + 2
+    )
+    assert blockchain.add_blocks(easy)
+    assert len(blockchain.chain) == 4
+
+    assert blockchain.add_blocks(hard)
+    assert len(blockchain.chain) == 3
+    assert [blockchain.hash(block) for block in blockchain.chain[1:]] == [
+        header_hash(block.header()) for block in hard
+    ]
+
+
+def _tracker(timestamps: list[float]) -> DifficultyTracker:
+    tracker = DifficultyTracker(height=1)
+    for timestamp in timestamps:
+        tracker.push(timestamp, INITIAL_DIFFICULTY)
+    return tracker
+
+
+def test_timestamp_must_be_after_the_median_of_recent_blocks():
+    now = time.time()
+    # 中央値より前の古いブロックは MEDIAN_TIME_SPAN から外れる
+    timestamps = [now - 10_000] * 5 + [now - 100 + i for i in range(MEDIAN_TIME_SPAN)]
+    tracker = _tracker(timestamps)
+    median = now - 100 + MEDIAN_TIME_SPAN // 2
+    assert tracker.median_time() == median
+
+    assert check_timestamp(median - 1, tracker, now) == INVALID_TIMESTAMP
+    assert check_timestamp(median, tracker, now) == INVALID_TIMESTAMP
+    assert check_timestamp(median + 0.5, tracker, now) is None
+    assert check_timestamp(now + MAX_FUTURE_BLOCK_SEC, tracker, now) is None
+    assert check_timestamp(now + MAX_FUTURE_BLOCK_SEC + 1, tracker, now) == (
+        INVALID_TIMESTAMP
+    )
+
+
+def test_validator_rejects_a_timestamp_at_the_median(validator, fast_blocks):
+    blocks = fast_blocks[:MEDIAN_TIME_SPAN]
+    median = blocks[MEDIAN_TIME_SPAN // 2].timestamp
+    block = _mine(header_hash(blocks[-1].header()), median, INITIAL_DIFFICULTY)
+    result = _validate(validator, [*blocks, block])
+    assert not result.valid
+    assert result.height == MEDIAN_TIME_SPAN + 1
+    assert result.reason == INVALID_TIMESTAMP
+    assert len(result.hashes) == MEDIAN_TIME_SPAN
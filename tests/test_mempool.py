@@ -0,0 +1,129 @@
+import pytest
+
+from mempool import Mempool, content_key, transaction_id
+from models import PendingTransaction, Transaction
+
+
+def _entry(sender: str, value: float, signature: str = None) -> PendingTransaction:
+    return PendingTransaction(
+        transaction=Transaction(
+            sender_blockchain_address=sender,
+            recipient_blockchain_address="recipient",
+            value=value,
+        ),
+        signature=signature,
+    )
+
+
+def test_add_rejects_duplicates_but_keeps_distinct_signatures():
+    mempool = Mempool()
+    entry = _entry("a", 1.0, signature="aa")
+    tx_id = mempool.add(entry)
+    assert tx_id == transaction_id(entry.transaction, "aa")
+    assert mempool.add(entry) is None
+    assert mempool.add(_entry("a", 1.0, signature="bb")) is not None
+    assert len(mempool) == 2
+    assert tx_id in mempool
+
+
+def test_full_pool_evicts_newest_of_largest_sender():
+    mempool = Mempool(max_size=4)
+    oldest = mempool.add(_entry("a", 1.0))
+    mempool.add(_entry("a", 2.0))
+    newest = mempool.add(_entry("a", 3.0))
+    mempool.add(_entry("b", 1.0))
+
+    assert mempool.add(_entry("c", 1.0)) is not None
+    assert len(mempool) == 4
+    assert newest not in mempool
+    assert oldest in mempool
+    assert mempool.pending_spend("a") == pytest.approx(3.0)
+    assert [t.value for t in mempool.transactions()] == [1.0, 2.0, 1.0, 1.0]
+
+
+def test_full_pool_rejects_the_largest_sender():
+    mempool = Mempool(max_size=3)
+    mempool.add(_entry("a", 1.0))
+    mempool.add(_entry("a", 2.0))
+    mempool.add(_entry("b", 1.0))
+    before = mempool.entries_by_id()
+
+    assert mempool.add(_entry("a", 3.0)) is None
+    assert mempool.entries_by_id() == before
+
+
+def test_full_pool_rejects_a_tied_sender():
+    mempool = Mempool(max_size=2)
+    a = mempool.add(_entry("a", 1.0))
+    b = mempool.add(_entry("b", 1.0))
+    assert mempool.add(_entry("b", 2.0)) is None
+    assert mempool.add(_entry("a", 2.0)) is None
+
+    # 何も溜めていない送信者は、同数で並んだ送信者の最新のものを追い出せる
+    assert mempool.add(_entry("c", 1.0)) is not None
+    assert (a in mempool) != (b in mempool)
+    assert len(mempool) == 2
+
+
+def test_remove_updates_indexes():
+    mempool = Mempool()
+    first = mempool.add(_entry("a", 1.0))
+    mempool.add(_entry("a", 2.5))
+    assert mempool.pending_spend("a") == pytest.approx(3.5)
+
+    assert mempool.remove(first).transaction.value == 1.0
+    assert mempool.remove(first) is None
+    assert mempool.pending_spend("a") == pytest.approx(2.5)
+    assert [t.value for t in mempool.transactions()] == [2.5]
+
+    mempool.remove_transactions(mempool.transactions())
+    assert len(mempool) == 0
+    assert mempool.pending_spend("a") == 0.0
+
+
+def test_transactions_carry_key_and_signature():
+    mempool = Mempool()
+    entry = _entry("a", 1.0, signature="aa")
+    entry.sender_public_key = "bb"
+    tx_id = mempool.add(entry)
+    (transaction,) = mempool.transactions()
+    assert transaction.signature == "aa"
+    assert transaction.sender_public_key == "bb"
+    assert transaction.unsigned() == entry.transaction
+    assert content_key(transaction) == tx_id
+
+
+def test_remove_transactions_matches_the_signature():
+    # ブロックに含まれた署名のエントリーだけを取り除き、同じ内容で署名の異なるものは残す
+    mempool = Mempool()
+    mempool.add(_entry("a", 1.0, signature="aa"))
+    kept = mempool.add(_entry("a", 1.0, signature="bb"))
+    mempool.add(_entry("b", 1.0))
+    included = _entry("a", 1.0, signature="aa").signed()
+
+    mempool.remove_transactions([included, _entry("x", 9.0).signed()])
+    assert len(mempool) == 2
+    assert kept in mempool
+    assert mempool.pending_spend("a") == pytest.approx(1.0)
+
+    mempool.remove_transactions([included])
+    assert len(mempool) == 2
+
+
+def test_drain_changes_records_additions_and_removals():
+    mempool = Mempool()
+    kept = mempool.add(_entry("a", 1.0))
+    removed = mempool.add(_entry("a", 2.0))
+    mempool.remove(removed)
+
+    cleared, changes = mempool.drain_changes()
+    assert not cleared
+    assert changes == {kept: mempool.entries_by_id()[kept], removed: None}
+    assert mempool.drain_changes() == (False, {})
+
+    mempool.clear()
+    added = mempool.add(_entry("b", 1.0))
+    cleared, changes = mempool.drain_changes()
+    assert cleared
+    assert list(changes) == [added]
+    assert mempool.pending_spend("a") == 0.0
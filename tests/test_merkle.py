@@ -0,0 +1,155 @@
+import json
+import logging
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from blockchain import BlockChain
+from mempool import transaction_id
+from merkle import (
+    EMPTY_ROOT,
+    merkle_leaf,
+    merkle_proof,
+    merkle_root,
+    verify_merkle_proof,
+)
+from models import SignedTransaction, Transaction
+from wallet import Singature, Wallet
+from wallet_server import valid_confirmation_proof
+
+logging.disable(logging.CRITICAL)
+
+SIZES = [1, 2, 3, 4, 5, 7, 8, 9, 16, 17, 33, 100]
+
+
+def _transactions(count: int) -> list[Transaction]:
+    return [
+        Transaction(
+            sender_blockchain_address=f"sender{i}",
+            recipient_blockchain_address=f"recipient{i}",
+            value=float(i),
+        )
+        for i in range(count)
+    ]
+
+
+def test_empty_root():
+    assert merkle_root([]) == EMPTY_ROOT
+
+
+def test_single_transaction_root_is_its_leaf():
+    transactions = _transactions(1)
+    assert merkle_root(transactions) == merkle_leaf(transactions[0])
+    assert merkle_proof(transactions, 0) == []
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_every_proof_verifies(size):
+    transactions = _transactions(size)
+    root = merkle_root(transactions)
+    for index, transaction in enumerate(transactions):
+        proof = merkle_proof(transactions, index)
+        assert verify_merkle_proof(merkle_leaf(transaction), proof, root)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_proof_does_not_verify_other_transactions(size):
+    transactions = _transactions(size)
+    root = merkle_root(transactions)
+    outsider = merkle_leaf(_transactions(size + 1)[size])
+    for index in range(size):
+        proof = merkle_proof(transactions, index)
+        assert not verify_merkle_proof(outsider, proof, root)
+        other = (index + 1) % size
+        if other != index:
+            assert not verify_merkle_proof(
+                merkle_leaf(transactions[other]), proof, root
+            )
+
+
+def test_root_depends_on_order_and_content():
+    transactions = _transactions(4)
+    root = merkle_root(transactions)
+    assert merkle_root(list(reversed(transactions))) != root
+    changed = transactions[:3] + [transactions[3].model_copy(update={"value": 9.0})]
+    assert merkle_root(changed) != root
+    # 奇数個の段で最後のノードを複製しないため、複製した木とは根が異なる
+    assert merkle_root(transactions[:3]) != merkle_root(
+        transactions[:3] + transactions[2:3]
+    )
+
+
+def test_tampered_proofs_are_rejected():
+    transactions = _transactions(9)
+    root = merkle_root(transactions)
+    tx_id = merkle_leaf(transactions[4])
+    proof = merkle_proof(transactions, 4)
+    assert verify_merkle_proof(tx_id, proof, root)
+
+    flipped = [
+        {**step, "position": "left" if step["position"] == "right" else "right"}
+        for step in proof
+    ]
+    assert not verify_merkle_proof(tx_id, flipped, root)
+    assert not verify_merkle_proof(tx_id, proof[:-1], root)
+    assert not verify_merkle_proof(tx_id, proof + proof[-1:], root)
+    wrong_hash = [{**proof[0], "hash": "00" * 32}] + proof[1:]
+    assert not verify_merkle_proof(tx_id, wrong_hash, root)
+    assert not verify_merkle_proof(tx_id, proof, EMPTY_ROOT)
+
+
+@pytest.mark.parametrize(
+    "proof",
+    [
+        [{"hash": "zz", "position": "left"}],
+        [{"hash": "00" * 32, "position": "up"}],
+        [{"position": "left"}],
+        [{"hash": None, "position": "left"}],
+    ],
+)
+def test_malformed_proofs_are_rejected(proof):
+    transactions = _transactions(2)
+    root = merkle_root(transactions)
+    assert not verify_merkle_proof(merkle_leaf(transactions[0]), proof, root)
+    assert not verify_merkle_proof("not hex", [], root)
+
+
+def test_leaf_commits_key_and_signature():
+    transaction = SignedTransaction(
+        **_transactions(1)[0].model_dump(), sender_public_key="aa", signature="bb"
+    )
+    leaves = {
+        merkle_leaf(transaction),
+        merkle_leaf(transaction.model_copy(update={"signature": "cc"})),
+        merkle_leaf(transaction.model_copy(update={"sender_public_key": "cc"})),
+        merkle_leaf(transaction.unsigned()),
+    }
+    assert len(leaves) == 4
+
+
+def test_wallet_verifies_a_node_proof():
+    wallet = Wallet()
+    blockchain = BlockChain(wallet.blockchain_address, mining_workers=1)
+    blockchain.mining()
+    transaction = Transaction(
+        sender_blockchain_address=wallet.blockchain_address,
+        recipient_blockchain_address="recipient",
+        value=0.5,
+    )
+    signature = Singature(
+        wallet.private_key, wallet.public_key, transaction
+    ).generate_signature()
+    assert blockchain.add_transaction(transaction, wallet.public_key, signature)
+    blockchain.mining()
+
+    tx_id = transaction_id(transaction)
+    proof = json.loads(
+        json.dumps(jsonable_encoder(blockchain.transaction_proof(tx_id)))
+    )
+    assert valid_confirmation_proof(tx_id, proof)
+
+    # ノードが別の署名のトランザクションを返しても、葉がマークルルートにつながらない
+    forged = {**proof, "transaction": {**proof["transaction"], "signature": "00"}}
+    assert not valid_confirmation_proof(tx_id, forged)
+    other = {**proof, "transaction": {**proof["transaction"], "value": 9.0}}
+    assert not valid_confirmation_proof(tx_id, other)
@@ -0,0 +1,59 @@
+import hashlib
+import random
+
+from difficulty import meets_difficulty
+from merkle import header_hash
+from miner import MiningJob, ProofTemplate, SerialMiningEngine
+from models import BlockHeader, Transaction
+
+# 乱数の種を固定して失敗を再現できるようにする
+SEED = 20241018
+CASES = 500
+
+
+def _random_header(rng: random.Random) -> BlockHeader:
+    return BlockHeader(
+        timestamp=rng.choice(
+            [
+                rng.uniform(0, 2e9),
+                float(rng.randrange(2**31)),
+                rng.random(),
+                rng.uniform(-1e6, 0),
+            ]
+        ),
+        merkle_root=hashlib.sha256(rng.randbytes(32)).hexdigest(),
+        nonce=0,
+        previous_hash=rng.choice(["", hashlib.sha256(rng.randbytes(8)).hexdigest()]),
+        difficulty=rng.randrange(0, 64),
+    )
+
+
+def test_proof_template_matches_header_hash():
+    rng = random.Random(SEED)
+    for _ in range(CASES):
+        header = _random_header(rng)
+        template = ProofTemplate.from_header(header)
+        for nonce in (0, rng.randrange(2**63), -rng.randrange(2**31)):
+            expected = header_hash(header.model_copy(update={"nonce": nonce}))
+            assert template.hash(nonce) == expected
+
+
+def test_proof_template_ignores_header_nonce():
+    rng = random.Random(SEED + 1)
+    header = _random_header(rng)
+    template = ProofTemplate.from_header(header.model_copy(update={"nonce": 12345}))
+    assert template.hash(7) == ProofTemplate.from_header(header).hash(7)
+
+
+def test_serial_engine_finds_valid_nonce():
+    transactions = [
+        Transaction(
+            sender_blockchain_address="sender",
+            recipient_blockchain_address="recipient",
+            value=1.0,
+        )
+    ]
+    job = MiningJob(transactions, "ab" * 32, difficulty=8, timestamp=1700000000.0)
+    nonce = SerialMiningEngine().search(job)
+    assert nonce is not None
+    assert meets_difficulty(header_hash(job.header(nonce)), job.difficulty)
@@ -0,0 +1,138 @@
+import logging
+
+import pytest
+
+from blockchain import MINING_SENDER, BlockChain
+from merkle import header_hash
+from models import CompactBlock, Transaction
+from relay import (
+    RELAY_ACCEPTED,
+    RELAY_KNOWN,
+    RELAY_QUEUED,
+    RELAY_REJECTED,
+    compact_block,
+)
+from wallet import Singature, Wallet
+
+logging.disable(logging.CRITICAL)
+
+SENDER = "10.0.0.1:5000"
+RECEIVER = "10.0.0.2:5000"
+
+
+@pytest.fixture
+def nodes(network):
+    # 先頭2ブロックを共有する送信元と受信側。受信側は送信元を近隣ノードとして知っている
+    wallet = Wallet()
+    sender = network.add(
+        SENDER, BlockChain(wallet.blockchain_address, mining_workers=1)
+    )
+    receiver = network.add(RECEIVER, BlockChain("receiver", mining_workers=1))
+    sender.mining()
+    receiver.add_blocks(list(sender.chain))
+    receiver.neighbours = [SENDER]
+    return sender, receiver, wallet
+
+
+def _transfer(wallet: Wallet, value: float) -> tuple[Transaction, str]:
+    transaction = Transaction(
+        sender_blockchain_address=wallet.blockchain_address,
+        recipient_blockchain_address=Wallet().blockchain_address,
+        value=value,
+    )
+    signature = Singature(
+        wallet.private_key, wallet.public_key, transaction
+    ).generate_signature()
+    return transaction, signature
+
+
+def _announced(blockchain: BlockChain, height: int = None) -> CompactBlock:
+    # announce_block と同じくマイニング報酬だけを本体で送る通知を、HTTP と同じく JSON を通して返す
+    height = len(blockchain.chain) - 1 if height is None else height
+    block = blockchain.chain[height]
+    compact = compact_block(
+        block,
+        height,
+        SENDER,
+        prefilled=[
+            index
+            for index, transaction in enumerate(block.transactions)
+            if transaction.sender_blockchain_address == MINING_SENDER
+        ],
+    )
+    return CompactBlock.model_validate_json(compact.model_dump_json())
+
+
+def _hashes(blockchain: BlockChain) -> list[str]:
+    return [blockchain.block_hash(h) for h in range(len(blockchain.chain))]
+
+
+def test_reconstructs_from_the_mempool(nodes):
+    sender, receiver, wallet = nodes
+    transfers = [_transfer(wallet, 0.1 * (i + 1)) for i in range(3)]
+    for transaction, signature in transfers:
+        assert sender.add_transaction(transaction, wallet.public_key, signature)
+        assert receiver.add_transaction(transaction, wallet.public_key, signature)
+    sender.mining()
+    compact = _announced(sender)
+    assert len(compact.short_ids) == len(transfers)
+
+    assert receiver.receive_compact_block(compact) == RELAY_ACCEPTED
+    assert _hashes(receiver) == _hashes(sender)
+    assert receiver.peer_client.requested == []
+    # 取り込んだトランザクションはプールから消える
+    assert receiver.transaction_pool == []
+    assert receiver.receive_compact_block(compact) == RELAY_KNOWN
+
+
+def test_fetches_missing_transactions_from_the_sender(nodes):
+    sender, receiver, wallet = nodes
+    shared = _transfer(wallet, 0.1)
+    missing = _transfer(wallet, 0.2)
+    assert sender.add_transaction(shared[0], wallet.public_key, shared[1])
+    assert receiver.add_transaction(shared[0], wallet.public_key, shared[1])
+    assert sender.add_transaction(missing[0], wallet.public_key, missing[1])
+    sender.mining()
+    compact = _announced(sender)
+    block_hash = header_hash(compact.header)
+
+    assert receiver.receive_compact_block(compact) == RELAY_ACCEPTED
+    assert receiver.peer_client.requested == [
+        (SENDER, f"/blocks/{block_hash}/transactions")
+    ]
+    assert _hashes(receiver) == _hashes(sender)
+    assert receiver.chain[-1].transactions == sender.chain[-1].transactions
+
+
+def test_rejects_an_untrusted_node(nodes):
+    sender, receiver, _ = nodes
+    receiver.neighbours = []
+    sender.mining()
+    compact = _announced(sender)
+
+    # 近隣ノードでも、通知を送ってきたホストでもないノードには問い合わせない
+    assert receiver.receive_compact_block(compact) == RELAY_REJECTED
+    assert receiver.receive_compact_block(compact, "10.0.0.9") == RELAY_REJECTED
+    invalid = compact.model_copy(update={"node": "not-an-address"})
+    assert receiver.receive_compact_block(invalid, "10.0.0.1") == RELAY_REJECTED
+    assert receiver.peer_client.requested == []
+    assert len(receiver.chain) == len(sender.chain) - 1
+
+    assert receiver.receive_compact_block(compact, "10.0.0.1") == RELAY_ACCEPTED
+    assert _hashes(receiver) == _hashes(sender)
+
+
+def test_unknown_parent_queues_a_full_sync(nodes):
+    sender, receiver, _ = nodes
+    for _ in range(2):
+        sender.mining()
+    # 1つ前のブロックの通知を受け取っていないため、先端につながらない
+    assert receiver.receive_compact_block(_announced(sender)) == RELAY_QUEUED
+    thread = receiver.relay_sync_thread
+    if thread is not None:
+        thread.join()
+
+    assert receiver.relay_sync_tips == {}
+    assert (SENDER, "/chain") in receiver.peer_client.requested
+    assert _hashes(receiver) == _hashes(sender)
+    assert receiver.receive_compact_block(_announced(sender)) == RELAY_KNOWN
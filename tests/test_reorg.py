@@ -0,0 +1,131 @@
+import logging
+
+import pytest
+
+from blockchain import MINING_SENDER, BlockChain
+from ledger import BalanceIndex
+from mempool import transaction_id
+from models import SignedTransaction, Transaction
+from storage import BlockStore
+from wallet import Singature, Wallet
+
+logging.disable(logging.CRITICAL)
+
+
+def _new_chain(address: str, store_dir=None) -> BlockChain:
+    store = BlockStore(str(store_dir)) if store_dir is not None else None
+    return BlockChain(address, mining_workers=1, store=store)
+
+
+def _balances(balance_index: BalanceIndex) -> dict[str, float]:
+    # 戻した結果 0 になったアドレスは残るため、残高のあるアドレスだけを比べる
+    return {k: v for k, v in balance_index.snapshot().items() if abs(v) > 1e-9}
+
+
+def _hashes(blockchain: BlockChain) -> list[str]:
+    return [blockchain.block_hash(h) for h in range(len(blockchain.chain))]
+
+
+def _fork(tmp_path, use_store: bool):
+    # a と b は共通の先頭2ブロックを持ち、a は送金を含むブロックを1つ、
+    # b はそれより累積ワークの大きい3ブロックを掘る
+    wallet = Wallet()
+    recipient = Wallet()
+    a = _new_chain(wallet.blockchain_address, tmp_path / "a" if use_store else None)
+    b = _new_chain("b")
+    a.mining()
+    b.add_blocks(list(a.chain))
+    assert _hashes(b) == _hashes(a)
+
+    transaction = Transaction(
+        sender_blockchain_address=wallet.blockchain_address,
+        recipient_blockchain_address=recipient.blockchain_address,
+        value=1.0,
+    )
+    signature = Singature(
+        wallet.private_key, wallet.public_key, transaction
+    ).generate_signature()
+    assert a.add_transaction(transaction, wallet.public_key, signature)
+    a.mining()
+    assert a.calculate_total_amount(recipient.blockchain_address) == 1.0
+    assert a.get_transaction(transaction_id(transaction)) is not None
+    transaction = SignedTransaction(
+        **transaction.model_dump(),
+        sender_public_key=wallet.public_key,
+        signature=signature,
+    )
+
+    for _ in range(3):
+        b.mining()
+    return a, b, wallet, recipient, transaction
+
+
+@pytest.mark.parametrize("use_store", [False, True])
+def test_reorg_reverts_detached_blocks(tmp_path, use_store):
+    a, b, wallet, recipient, transaction = _fork(tmp_path, use_store)
+    old_snapshot = a.snapshot
+    old_hashes = _hashes(a)
+
+    assert a.add_blocks(list(b.chain)[2:])
+    assert _hashes(a) == _hashes(b)
+
+    # 逆向きに戻した残高は、新しいチェーンから作り直した残高と一致する
+    rebuilt = BalanceIndex()
+    rebuilt.rebuild(list(a.chain))
+    assert _balances(a.balance_index) == pytest.approx(_balances(rebuilt))
+    assert a.calculate_total_amount(recipient.blockchain_address) == 0.0
+    assert a.calculate_total_amount(wallet.blockchain_address) == pytest.approx(
+        b.calculate_total_amount(wallet.blockchain_address)
+    )
+
+    # 外れたブロックの送金は公開鍵と署名ごとプールに戻り、マイニング報酬は戻らない
+    assert a.transaction_pool == [transaction]
+    assert all(t.sender_blockchain_address != MINING_SENDER for t in a.transaction_pool)
+    assert a.get_transaction(transaction_id(transaction)) is None
+    for height, block in enumerate(b.chain):
+        for index, t in enumerate(block.transactions):
+            assert (height, index) in a.snapshot.locate(transaction_id(t))
+
+    # 公開済みのスナップショットは付け替えの影響を受けない
+    assert [old_snapshot.block_hash(h) for h in range(old_snapshot.length)] == (
+        old_hashes
+    )
+
+    # 戻した送金は新しい先端の上で掘り直せ、そのブロックも検証を通る
+    a.mining()
+    assert a.chain[-1].transactions[1:] == [transaction]
+    assert a.valid_blockchain(list(a.chain))
+
+
+def test_reorg_survives_restart(tmp_path):
+    a, b, wallet, recipient, transaction = _fork(tmp_path, use_store=True)
+    assert a.add_blocks(list(b.chain)[2:])
+    a.save_transaction_pool()
+    a.store.close()
+
+    restarted = _new_chain(wallet.blockchain_address, tmp_path / "a")
+    assert _hashes(restarted) == _hashes(b)
+    assert _balances(restarted.balance_index) == pytest.approx(
+        _balances(a.balance_index)
+    )
+    assert restarted.transaction_pool == [transaction]
+
+
+def test_shorter_branch_does_not_reorganize(tmp_path):
+    a, b, *_ = _fork(tmp_path, use_store=False)
+    assert b.add_blocks(list(a.chain)[2:]) is False
+    assert len(b.chain) == 5
+
+
+def test_extension_appends_without_copying_the_chain():
+    a = _new_chain("a")
+    b = _new_chain("b")
+    a.mining()
+    b.add_blocks(list(a.chain))
+    for _ in range(2):
+        a.mining()
+    chain = b.chain
+    assert b.add_blocks(list(a.chain)[2:])
+    # 外すブロックがない場合は同じリストに追記する
+    assert b.chain is chain
+    assert _hashes(b) == _hashes(a)
@@ -0,0 +1,153 @@
+import logging
+import sys
+import threading
+
+import pytest
+
+import storage
+from blockchain import BlockChain
+from merkle import header_hash
+from storage import BLOCKS_FILE, INDEX_ENTRY, INDEX_FILE, BlockStore
+
+logging.disable(logging.CRITICAL)
+
+
+def _mined_blocks(count: int) -> list:
+    blockchain = BlockChain("miner", mining_workers=1)
+    for _ in range(count - 1):
+        blockchain.mining()
+    return list(blockchain.chain)
+
+
+def _branch(blocks: list, height: int, count: int) -> list:
+    # blocks の先頭 height 個から分かれた count 個のブロック
+    blockchain = BlockChain("branch", mining_workers=1)
+    blockchain.add_blocks(blocks[:height])
+    for _ in range(count):
+        blockchain.mining()
+    return list(blockchain.chain)[height:]
+
+
+def _hashes(blocks) -> list[str]:
+    return [header_hash(block.header()) for block in blocks]
+
+
+def _store_hashes(store: BlockStore) -> list[str]:
+    return [store.hash_at(h) for h in range(len(store))]
+
+
+def _reopen(store: BlockStore, tmp_path) -> BlockStore:
+    store.close()
+    return BlockStore(str(tmp_path))
+
+
+@pytest.fixture(scope="module")
+def blocks() -> list:
+    return _mined_blocks(6)
+
+
+@pytest.mark.parametrize("index_size", [None, 0, 2 * INDEX_ENTRY.size + 5])
+def test_reopen_rebuilds_a_missing_or_short_index(tmp_path, blocks, index_size):
+    store = BlockStore(str(tmp_path))
+    store.extend(blocks)
+    store.close()
+    index_path = tmp_path / INDEX_FILE
+    if index_size is None:
+        index_path.unlink()
+    else:
+        with open(index_path, "r+b") as f:
+            f.truncate(index_size)
+
+    store = BlockStore(str(tmp_path))
+    assert _store_hashes(store) == _hashes(blocks)
+    assert _hashes(store) == _hashes(blocks)
+    # 作り直したインデックスは次に開いたときにそのまま使える
+    assert index_path.stat().st_size == len(blocks) * INDEX_ENTRY.size
+    assert _store_hashes(_reopen(store, tmp_path)) == _hashes(blocks)
+
+
+def test_reopen_drops_a_torn_tail(tmp_path, blocks):
+    store = BlockStore(str(tmp_path))
+    store.extend(blocks[:5])
+    store.close()
+    blocks_path = tmp_path / BLOCKS_FILE
+    size = blocks_path.stat().st_size
+    # 書き込みの途中で止まった行
+    line = blocks[5].model_dump_json().encode()
+    with open(blocks_path, "ab") as f:
+        f.write(line[: len(line) // 2])
+
+    store = BlockStore(str(tmp_path))
+    assert _store_hashes(store) == _hashes(blocks[:5])
+    assert blocks_path.stat().st_size == size
+    store.append(blocks[5])
+    assert _hashes(_reopen(store, tmp_path)) == _hashes(blocks)
+
+
+def test_reopen_replays_a_truncate_record(tmp_path, blocks):
+    store = BlockStore(str(tmp_path))
+    store.extend(blocks)
+    index = (tmp_path / INDEX_FILE).read_bytes()
+    store.truncate(3)
+    store.close()
+    # truncate の記録を書いた後、インデックスを切り詰める前に止まった状態にする
+    (tmp_path / INDEX_FILE).write_bytes(index)
+
+    store = BlockStore(str(tmp_path))
+    assert _store_hashes(store) == _hashes(blocks[:3])
+    branch = _branch(blocks, 3, 2)
+    store.extend(branch)
+    (tmp_path / INDEX_FILE).unlink()
+
+    # 外したブロックの行はファイルに残るが、先頭から読み直しても取り込まない
+    store = _reopen(store, tmp_path)
+    assert _store_hashes(store) == _hashes(blocks[:3] + branch)
+    assert _hashes(store) == _hashes(blocks[:3] + branch)
+
+
+def test_view_reads_the_old_generation_after_truncate(tmp_path, blocks):
+    store = BlockStore(str(tmp_path))
+    store.extend(blocks)
+    view = store.view()
+    store.truncate(3)
+    branch = _branch(blocks, 3, 2)
+    store.extend(branch)
+
+    assert _store_hashes(store) == _hashes(blocks[:3] + branch)
+    assert len(view) == len(blocks)
+    assert [view.hash_at(h) for h in range(len(view))] == _hashes(blocks)
+    assert _hashes(view[h] for h in range(len(view))) == _hashes(blocks)
+    assert _hashes(view) == _hashes(blocks)
+    assert view[5].timestamp == blocks[5].timestamp
+
+
+def test_concurrent_views_share_the_cache(tmp_path, monkeypatch):
+    # キャッシュを小さくして、読み取りスレッド同士の追い出しを頻繁に起こす
+    monkeypatch.setattr(storage, "BLOCK_CACHE_SIZE", 4)
+    blocks = _mined_blocks(24)
+    store = BlockStore(str(tmp_path))
+    store.extend(blocks)
+    hashes = [store.hash_at(h) for h in range(len(store))]
+    errors = []
+
+    def read(view) -> None:
+        try:
+            for _ in range(200):
+                for height in range(len(view)):
+                    assert view[height]._hash == hashes[height]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(store.view(),)) for _ in range(16)]
+    # スレッドの切り替えを細かくして、キャッシュの操作の途中で切り替わるようにする
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert len(store._cache) <= 4
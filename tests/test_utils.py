@@ -0,0 +1,20 @@
+import logging
+
+from utils import load_seeds
+
+logging.disable(logging.CRITICAL)
+
+
+def test_load_seeds_skips_malformed_lines(tmp_path):
+    path = tmp_path / "seeds.txt"
+    path.write_text(
+        "# シード\n"
+        "10.0.0.1:5000\n"
+        "\n"
+        "10.0.0.2  # ポートがない\n"
+        "10.0.0.3:http\n"
+        ":5001\n"
+        "10.0.0.4:70000\n"
+        "node.example:5002  # 名前でもよい\n"
+    )
+    assert load_seeds(str(path)) == ["10.0.0.1:5000", "node.example:5002"]
@@ -0,0 +1,158 @@
+import logging
+import time
+
+import pytest
+
+from difficulty import INITIAL_DIFFICULTY, DifficultyTracker, meets_difficulty
+from merkle import header_hash, merkle_root
+from miner import ProofTemplate
+from models import Block, SignedTransaction, Transaction
+from validator import (
+    INVALID_DIFFICULTY,
+    INVALID_SIGNATURE,
+    MINING_SENDER,
+    VALIDATE_BATCH_MIN_TRANSACTIONS,
+    ChainValidator,
+)
+from wallet import Wallet, generate_signatures
+
+logging.disable(logging.CRITICAL)
+
+TRANSACTIONS_PER_BLOCK = VALIDATE_BATCH_MIN_TRANSACTIONS // 2
+SENDERS = [Wallet() for _ in range(4)]
+
+
+def _sign(
+    wallet: Wallet, recipient: str, value: float, public_key: str = None
+) -> SignedTransaction:
+    transaction = Transaction(
+        sender_blockchain_address=wallet.blockchain_address,
+        recipient_blockchain_address=recipient,
+        value=value,
+    )
+    (signature,) = generate_signatures([(wallet.private_key, transaction)])
+    return SignedTransaction(
+        **transaction.model_dump(),
+        sender_public_key=public_key or wallet.public_key,
+        signature=signature,
+    )
+
+
+# 署名の作成には時間がかかるため、同じ送金を各ブロックで使い回す
+TRANSFERS = [
+    _sign(wallet, f"recipient{i}", 1.0 + i) for i, wallet in enumerate(SENDERS * 2)
+]
+
+
+def _transactions(extra: list[SignedTransaction] = ()) -> list[SignedTransaction]:
+    reward = SignedTransaction(
+        sender_blockchain_address=MINING_SENDER,
+        recipient_blockchain_address=SENDERS[0].blockchain_address,
+        value=1.0,
+    )
+    transfers = [
+        TRANSFERS[i % len(TRANSFERS)] for i in range(TRANSACTIONS_PER_BLOCK - 1)
+    ]
+    return [reward, *transfers[: len(transfers) - len(extra)], *extra]
+
+
+def _mine(
+    previous_hash: str,
+    timestamp: float,
+    difficulty: int = INITIAL_DIFFICULTY,
+    transactions: list[SignedTransaction] = None,
+) -> Block:
+    if transactions is None:
+        transactions = _transactions()
+    block = Block(
+        timestamp=timestamp,
+        transactions=transactions,
+        nonce=0,
+        previous_hash=previous_hash,
+        merkle_root=merkle_root(transactions),
+        difficulty=difficulty,
+    )
+    if not 0 < difficulty <= 64:
+        return block
+    template = ProofTemplate.from_header(block.header())
+    nonce = 0
+    while not meets_difficulty(template.hash(nonce), difficulty):
+        nonce += 1
+    return block.model_copy(update={"nonce": nonce})
+
+
+def _chain(count: int) -> list[Block]:
+    now = time.time()
+    blocks = []
+    previous_hash = "ab" * 32
+    for i in range(count):
+        block = _mine(previous_hash, now - 100 + i)
+        blocks.append(block)
+        previous_hash = header_hash(block.header())
+    return blocks
+
+
+@pytest.fixture(scope="module", params=[1, 2], ids=["serial", "parallel"])
+def validator(request):
+    validator = ChainValidator(workers=request.param)
+    yield validator
+    validator.close()
+
+
+def test_valid_chain(validator):
+    blocks = _chain(3)
+    result = validator.validate(blocks, 1, "ab" * 32, DifficultyTracker(height=1))
+    assert result.valid
+    assert result.hashes == [header_hash(block.header()) for block in blocks]
+
+
+@pytest.mark.parametrize("difficulty", [-1, 0, 10_000])
+@pytest.mark.parametrize("position", [0, 2])
+def test_out_of_range_difficulty_is_rejected(validator, difficulty, position):
+    # 範囲外の難易度はワイヤ形式に符号化する前に弾く
+    blocks = _chain(3)
+    previous_hash = header_hash(blocks[position - 1].header()) if position else None
+    blocks[position] = _mine(previous_hash or "ab" * 32, time.time(), difficulty)
+    result = validator.validate(blocks, 1, "ab" * 32, DifficultyTracker(height=1))
+    assert not result.valid
+    assert result.height == 1 + position
+    assert result.reason == INVALID_DIFFICULTY
+    assert len(result.hashes) == position
+
+
+def _unsigned() -> SignedTransaction:
+    return SignedTransaction(**TRANSFERS[0].unsigned().model_dump())
+
+
+def _other_key() -> SignedTransaction:
+    # 他人の公開鍵と、その鍵での正しい署名。送信者のアドレスと一致しない
+    transaction = _sign(SENDERS[1], "thief", 5.0)
+    return transaction.model_copy(
+        update={"sender_blockchain_address": SENDERS[0].blockchain_address}
+    )
+
+
+def _forged() -> SignedTransaction:
+    # 送信者の公開鍵は正しいが、署名は別の内容に対するもの
+    return TRANSFERS[0].model_copy(update={"value": 100.0})
+
+
+def _malformed_key() -> SignedTransaction:
+    return TRANSFERS[0].model_copy(update={"sender_public_key": "zz"})
+
+
+@pytest.mark.parametrize(
+    "make_transaction", [_unsigned, _other_key, _forged, _malformed_key]
+)
+def test_invalid_signature_is_rejected(validator, make_transaction):
+    blocks = _chain(3)
+    blocks[1] = _mine(
+        header_hash(blocks[0].header()),
+        blocks[1].timestamp,
+        transactions=_transactions([make_transaction()]),
+    )
+    result = validator.validate(blocks, 1, "ab" * 32, DifficultyTracker(height=1))
+    assert not result.valid
+    assert result.height == 2
+    assert result.reason == INVALID_SIGNATURE
+    assert len(result.hashes) == 1
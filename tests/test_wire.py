@@ -0,0 +1,128 @@
+import random
+
+import pytest
+
+from models import Block, SignedTransaction, StateSnapshot
+from wallet import Wallet
+from wire import (
+    WireFormatError,
+    decode_block,
+    decode_state_snapshot,
+    encode_block,
+    encode_blocks,
+    encode_state_snapshot,
+    iter_decode_blocks,
+)
+
+SEED = 20241018
+
+
+def _addresses() -> list[str]:
+    # base58 に戻せるアドレスと、文字列のまま送る表記の両方を含める
+    return [
+        Wallet().blockchain_address,
+        Wallet().blockchain_address,
+        "1" + Wallet().blockchain_address,
+        "THE BLOCKCHAIN",
+        "b",
+        "",
+    ]
+
+
+def _random_blocks(count: int) -> list[Block]:
+    rng = random.Random(SEED)
+    addresses = _addresses()
+    hashes = ["", "ab" * 32, "AB" * 32, "00" * 32, "zz", "abc"]
+    keys = [None, Wallet().public_key, Wallet().public_key, "not hex"]
+    return [
+        Block(
+            timestamp=rng.choice([0.0, rng.uniform(0, 2e9), -rng.random()]),
+            transactions=[
+                SignedTransaction(
+                    sender_blockchain_address=rng.choice(addresses),
+                    recipient_blockchain_address=rng.choice(addresses),
+                    value=rng.choice([0.0, 1.0, rng.uniform(0, 1e6), 0.1 + 0.2]),
+                    sender_public_key=rng.choice(keys),
+                    signature=rng.choice(
+                        [None, rng.randbytes(rng.randrange(60, 73)).hex(), "XYZ", ""]
+                    ),
+                )
+                for _ in range(rng.randrange(0, 30))
+            ],
+            nonce=rng.choice([0, rng.randrange(2**63), -rng.randrange(2**31)]),
+            previous_hash=rng.choice(hashes),
+            merkle_root=rng.choice(hashes),
+            difficulty=rng.randrange(0, 256),
+        )
+        for _ in range(count)
+    ]
+
+
+def _dump(blocks) -> list[str]:
+    return [block.model_dump_json() for block in blocks]
+
+
+def test_block_round_trip():
+    for block in _random_blocks(100):
+        assert decode_block(encode_block(block)).model_dump_json() == (
+            block.model_dump_json()
+        )
+
+
+def test_block_stream_round_trip_in_any_chunking():
+    blocks = _random_blocks(50)
+    data = b"".join(encode_blocks(blocks))
+    assert _dump(iter_decode_blocks([data])) == _dump(blocks)
+    assert _dump(iter_decode_blocks(data[i : i + 1] for i in range(len(data)))) == (
+        _dump(blocks)
+    )
+    assert _dump(iter_decode_blocks(encode_blocks(blocks))) == _dump(blocks)
+
+
+def test_empty_block_stream():
+    assert list(iter_decode_blocks(encode_blocks([]))) == []
+
+
+def test_truncated_block_stream_is_rejected():
+    data = b"".join(encode_blocks(_random_blocks(3)))
+    with pytest.raises(WireFormatError):
+        list(iter_decode_blocks([data[:-1]]))
+    with pytest.raises(WireFormatError):
+        list(iter_decode_blocks([b""]))
+
+
+def test_unknown_stream_header_is_rejected():
+    data = b"".join(encode_blocks(_random_blocks(1)))
+    with pytest.raises(WireFormatError):
+        list(iter_decode_blocks([b"XXX" + data[3:]]))
+
+
+def test_block_with_trailing_bytes_is_rejected():
+    with pytest.raises(WireFormatError):
+        decode_block(encode_block(_random_blocks(1)[0]) + b"\x00")
+
+
+def test_state_snapshot_round_trip():
+    rng = random.Random(SEED)
+    snapshot = StateSnapshot(
+        height=rng.randrange(2**40),
+        block_hash="cd" * 32,
+        balances={address: rng.uniform(-1e6, 1e6) for address in _addresses()},
+    )
+    data = encode_state_snapshot(snapshot)
+    assert decode_state_snapshot(data) == snapshot
+
+    # 同じ状態からは残高の並び順によらず同じバイト列になる
+    reordered = snapshot.model_copy(
+        update={"balances": dict(reversed(list(snapshot.balances.items())))}
+    )
+    assert encode_state_snapshot(reordered) == data
+
+    with pytest.raises(WireFormatError):
+        decode_state_snapshot(data + b"\x00")
+
+
+def test_negative_difficulty_is_not_encoded():
+    block = _random_blocks(1)[0].model_copy(update={"difficulty": -1})
+    with pytest.raises(ValueError):
+        encode_block(block)